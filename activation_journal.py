@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+Journal d'activations en ajout seul
+Chaque activation (ou lot de mises à jour) coûte une ligne ajoutée à activations.journal.jsonl ; l'état complet
+est reconstruit depuis le dernier instantané (activations.json) plus la fin du journal,
+et le journal est compacté périodiquement dans l'instantané, par un thread en arrière-plan.
+
+Compaction sans risque en cas d'arrêt brutal : le journal est d'abord renommé en
+activations.journal.jsonl.<génération>, puis l'instantané est écrit avec cette génération
+({"journal_generation": n, "activations": [...]}) et seulement ensuite le journal renommé est
+supprimé. Au chargement, seuls les journaux renommés de génération supérieure à celle de
+l'instantané sont rejoués : aucune activation n'est appliquée deux fois
+"""
+
+import heapq
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left, insort
+from contextlib import contextmanager
+
+from license_store import file_signature, write_json_atomic
+from dashboard_stats import ActivationStats, activation_hour, hour_range, record_project
+
+try:
+    import fcntl
+except ImportError:  # Windows : verrouillage limité au processus
+    fcntl = None
+
+# Nombre d'entrées de journal avant compaction dans l'instantané
+COMPACT_EVERY = int(os.environ.get("ACTIVATIONS_COMPACT_EVERY", "1000"))
+# Taille du journal (octets) déclenchant aussi la compaction : une ligne de heartbeats groupés
+# peut porter des milliers de postes, le nombre de lignes seul ne borne pas le journal
+COMPACT_BYTES = int(os.environ.get("ACTIVATIONS_COMPACT_BYTES", str(16 * 1024 * 1024)))
+
+logger = logging.getLogger(__name__)
+
+
+def matches(record, where):
+    """Vrai si le record contient toutes les valeurs du filtre"""
+    return all(record.get(field) == value for field, value in where.items())
+
+
+def keep_latest(devices, record):
+    """Garder dans devices (device_id -> activation) la dernière activation de chaque machine"""
+    device_id = record.get("device_id")
+    current = devices.get(device_id)
+    if current is None or record.get("timestamp", "") > current.get("timestamp", ""):
+        devices[device_id] = record
+
+
+def record_group(record):
+    """Clé de l'index des positions : (projet, statut)"""
+    return record_project(record), record.get("status")
+
+
+def positions_before(positions, cursor):
+    """Positions (liste triée) inférieures au curseur, de la plus grande à la plus petite"""
+    return (positions[i] for i in range(bisect_left(positions, cursor) - 1, -1, -1))
+
+
+class ActivationJournal:
+    """Activations stockées en instantané JSON + journal d'opérations en ajout seul"""
+
+    def __init__(self, snapshot_path, journal_path=None, compact_every=COMPACT_EVERY, compact_bytes=COMPACT_BYTES):
+        self.snapshot_path = snapshot_path
+        if journal_path is None:
+            journal_path = os.path.splitext(snapshot_path)[0] + ".journal.jsonl"
+        self.journal_path = journal_path
+        self.lock_path = journal_path + ".lock"
+        self.compact_every = compact_every
+        self.compact_bytes = compact_bytes
+        self._lock = threading.RLock()
+        self._snapshot_signature = None
+        self._loaded = False
+        self._offset = 0
+        self._journal_entries = 0
+        self._journal_bytes = 0
+        # Génération du dernier journal intégré à l'instantané (0 : instantané historique, simple liste)
+        self._generation = 0
+        self._records = []
+        # Positions (dans _records) des activations de chaque licence, pour les mises à jour ciblées
+        self._positions_by_license = {}
+        # (projet, statut) -> positions triées, pour paginer un filtre sans parcourir tout l'historique
+        self._positions_by_group = {}
+        # Index license_key -> {device_id -> dernière activation}, mis à jour à chaque ajout ;
+        # les mises à jour modifient les mêmes objets, l'index reste donc à jour
+        self._by_license = {}
+        # Compteur activation_code -> nombre d'activations actives, ajusté à chaque opération
+        self._active_by_code = {}
+        # Activations par jour et par projet, postes occupés (tableau de bord)
+        self._stats = ActivationStats()
+        # Compaction en cours (thread en arrière-plan), None sinon
+        self._compactor = None
+
+    @contextmanager
+    def _file_lock(self, exclusive=False):
+        """Verrou inter-processus : partagé pour lire, exclusif pour ajouter au journal ou compacter"""
+        if fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(self.lock_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- Reconstruction de l'état ---
+
+    def _index(self, record, position):
+        license_key = record.get("license_key")
+        self._positions_by_group.setdefault(record_group(record), []).append(position)
+        if license_key is not None:
+            self._positions_by_license.setdefault(license_key, []).append(position)
+            keep_latest(self._by_license.setdefault(license_key, {}), record)
+        self._count_active(record, 1)
+        self._stats.add(record)
+
+    def _count_active(self, record, delta):
+        code = record.get("activation_code")
+        if code is not None and record.get("status") == "active":
+            self._active_by_code[code] = self._active_by_code.get(code, 0) + delta
+
+    def _matching(self, where):
+        """Positions des activations correspondant au filtre (parmi celles de la licence si elle est précisée)"""
+        if "license_key" in where:
+            candidates = self._positions_by_license.get(where["license_key"], [])
+        else:
+            candidates = range(len(self._records))
+        return [position for position in candidates if matches(self._records[position], where)]
+
+    def _update(self, where, changes):
+        for position in self._matching(where):
+            record = self._records[position]
+            group = record_group(record)
+            self._count_active(record, -1)
+            self._stats.remove(record)
+            record.update(changes)
+            self._count_active(record, 1)
+            self._stats.add(record)
+            if record_group(record) != group:
+                # Changement de statut : la position passe dans la liste de son nouveau groupe
+                positions = self._positions_by_group[group]
+                del positions[bisect_left(positions, position)]
+                insort(self._positions_by_group.setdefault(record_group(record), []), position)
+
+    def _apply(self, entry):
+        op = entry.get("op")
+        if op == "add":
+            self._records.append(entry["record"])
+            self._index(entry["record"], len(self._records) - 1)
+        elif op == "update":
+            self._update(entry["where"], entry["set"])
+        elif op == "update_many":
+            for update in entry["updates"]:
+                self._update(update["where"], update["set"])
+
+    def _sealed_journals(self):
+        """[(génération, chemin)] des journaux renommés par une compaction, par génération croissante"""
+        directory = os.path.dirname(self.journal_path) or "."
+        prefix = os.path.basename(self.journal_path) + "."
+        try:
+            names = os.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            (int(name[len(prefix):]), os.path.join(directory, name))
+            for name in names
+            if name.startswith(prefix) and name[len(prefix):].isdigit()
+        )
+
+    def _replay(self, chunk):
+        """Appliquer les lignes complètes d'un morceau de journal ; retourne le nombre d'octets consommés"""
+        # Ignorer une éventuelle ligne incomplète en fin de morceau
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if line.strip():
+                self._apply(json.loads(line))
+                self._journal_entries += 1
+        self._journal_bytes += end
+        return end
+
+    def _load_snapshot(self):
+        try:
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+        except FileNotFoundError:
+            snapshot = []
+        if isinstance(snapshot, dict):
+            self._generation = snapshot.get("journal_generation", 0)
+            self._records = snapshot.get("activations", [])
+        else:
+            self._generation = 0
+            self._records = snapshot
+        self._positions_by_license = {}
+        self._positions_by_group = {}
+        self._by_license = {}
+        self._active_by_code = {}
+        self._stats = ActivationStats()
+        for position, record in enumerate(self._records):
+            self._index(record, position)
+        self._snapshot_signature = file_signature(self.snapshot_path)
+        self._loaded = True
+        self._offset = 0
+        self._journal_entries = 0
+        self._journal_bytes = 0
+        # Compaction interrompue avant l'écriture de l'instantané : ses journaux renommés restent à rejouer
+        for generation, path in self._sealed_journals():
+            if generation > self._generation:
+                with open(path, "rb") as f:
+                    self._replay(f.read())
+
+    def _read_tail(self):
+        """Rejouer uniquement les lignes du journal ajoutées depuis la dernière lecture"""
+        try:
+            with open(self.journal_path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        self._offset += self._replay(chunk)
+
+    def _refresh(self):
+        journal_size = os.path.getsize(self.journal_path) if os.path.exists(self.journal_path) else 0
+        if (not self._loaded or file_signature(self.snapshot_path) != self._snapshot_signature
+                or journal_size < self._offset):
+            # Premier accès, instantané remplacé ou journal compacté (par un autre processus, ou compaction interrompue)
+            self._load_snapshot()
+        if journal_size > self._offset:
+            self._read_tail()
+
+    # --- Écritures ---
+
+    def _append_entries(self, entries):
+        payload = "".join(json.dumps(entry) + "\n" for entry in entries)
+        directory = os.path.dirname(self.journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.journal_path, "a") as f:
+            f.write(payload)
+        # Appliquer localement en relisant la fin du journal (inclut les ajouts concurrents)
+        self._read_tail()
+
+    def _maybe_compact(self):
+        """Lancer la compaction en arrière-plan quand le journal atteint compact_every entrées ou compact_bytes
+        octets (la requête qui franchit le seuil n'attend pas ; les écritures suivantes attendent la fin de la réécriture)"""
+        by_entries = self.compact_every and self._journal_entries >= self.compact_every
+        by_bytes = self.compact_bytes and self._journal_bytes >= self.compact_bytes
+        if not (by_entries or by_bytes):
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._compact_in_background, name="activations-compact", daemon=True)
+        self._compactor.start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Erreur compaction du journal d'activations: {e}")
+
+    def append(self, record):
+        """Ajouter une activation (une seule ligne écrite)"""
+        self.append_many([record])
+
+    def append_many(self, records):
+        """Ajouter plusieurs activations en une seule écriture"""
+        if not records:
+            return
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._refresh()
+                self._append_entries([{"op": "add", "record": record} for record in records])
+            self._maybe_compact()
+
+    def append_if_available(self, record, max_activations):
+        """Ajouter l'activation si son code a moins de max_activations activations actives
+
+        Vérification et ajout sous le verrou exclusif du journal : deux processus ne peuvent pas
+        dépasser ensemble la limite. Retourne (ajoutée ?, activations actives avant l'ajout)
+        """
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._refresh()
+                active = self._active_by_code.get(record.get("activation_code"), 0)
+                if active >= max_activations:
+                    return False, active
+                self._append_entries([{"op": "add", "record": record}])
+            self._maybe_compact()
+            return True, active
+
+    def update_where(self, where, changes):
+        """Mettre à jour les activations correspondant au filtre ; retourne le nombre modifié"""
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._refresh()
+                count = len(self._matching(where))
+                if count:
+                    self._append_entries([{"op": "update", "where": where, "set": changes}])
+            self._maybe_compact()
+            return count
+
+    def update_many(self, updates):
+        """Appliquer un lot de (filtre, changements) en une seule ligne de journal ; retourne le nombre modifié"""
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._refresh()
+                batch = []
+                count = 0
+                for where, changes in updates:
+                    matched = len(self._matching(where))
+                    if matched:
+                        batch.append({"where": where, "set": changes})
+                        count += matched
+                if batch:
+                    self._append_entries([{"op": "update_many", "updates": batch}])
+            self._maybe_compact()
+            return count
+
+    def compact(self):
+        """Réécrire l'instantané complet et repartir d'un journal vide
+
+        1. journal renommé en <journal>.<génération> (les ajouts suivants créent un nouveau journal)
+        2. instantané écrit de façon atomique avec cette génération : c'est le point de bascule
+        3. journaux renommés supprimés ; un arrêt avant 2 les fait rejouer, après 2 les fait ignorer
+        """
+        with self._lock:
+            with self._file_lock(exclusive=True):
+                self._refresh()
+                sealed = self._sealed_journals()
+                generation = max([self._generation] + [g for g, _ in sealed]) + 1
+                if os.path.exists(self.journal_path):
+                    os.replace(self.journal_path, f"{self.journal_path}.{generation}")
+                    sealed.append((generation, f"{self.journal_path}.{generation}"))
+                write_json_atomic(self.snapshot_path, {"journal_generation": generation, "activations": self._records})
+                self._generation = generation
+                self._snapshot_signature = file_signature(self.snapshot_path)
+                self._offset = 0
+                self._journal_entries = 0
+                self._journal_bytes = 0
+                for _, path in sealed:
+                    os.remove(path)
+
+    # --- Lectures ---
+
+    def all(self):
+        """Toutes les activations (copies), instantané puis journal"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            return [dict(record) for record in self._records]
+
+    def latest_by_device(self, license_key):
+        """Dernière activation de chaque machine d'une licence (copies)"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            return [dict(record) for record in self._by_license.get(license_key, {}).values()]
+
+    def iter_all(self):
+        """Parcourir les activations une par une (copies faites au fil de l'itération)"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            records = list(self._records)
+        for record in records:
+            yield dict(record)
+
+    def count_active(self, activation_code):
+        """Nombre d'activations actives pour un code d'activation (compteur maintenu)"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            return self._active_by_code.get(activation_code, 0)
+
+    def stats(self, day):
+        """(activations du jour par projet, postes occupés par projet), compteurs maintenus"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            return self._stats.on_day(day), self._stats.seats()
+
+    def page(self, project=None, status=None, date_from=None, date_to=None, cursor=None, limit=50):
+        """(activations de la page, plus récentes d'abord, curseur suivant ou None, nombre total filtré)
+
+        Le curseur est la position de la dernière activation de la page (le journal n'a pas de suppression).
+        Projet et statut passent par l'index des positions (seules les activations du filtre sont lues) ;
+        les dates sont vérifiées au fil du parcours, le total vient des agrégats horaires
+        """
+        start, end = hour_range(date_from, date_to)
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            cursor = len(self._records) if cursor is None else min(cursor, len(self._records))
+            if project is None and status is None:
+                positions = range(cursor - 1, -1, -1)
+            else:
+                # Fusion, des plus récentes aux plus anciennes, des listes des groupes du filtre
+                positions = heapq.merge(*(
+                    positions_before(group_positions, cursor)
+                    for (group_project, group_status), group_positions in self._positions_by_group.items()
+                    if (project is None or group_project == project) and (status is None or group_status == status)
+                ), reverse=True)
+            page = []
+            next_cursor = None
+            for position in positions:
+                record = self._records[position]
+                hour = activation_hour(record)
+                if hour < start or (end is not None and hour >= end):
+                    continue
+                if len(page) == limit:
+                    next_cursor = position + 1
+                    break
+                page.append(dict(record))
+            total = sum(row[3] for row in self._stats.rollups.rows(date_from, date_to, project, status=status))
+            return page, next_cursor, total
+
+    def rollups(self, date_from=None, date_to=None, project=None, code=None):
+        """Lignes d'agrégats horaires (heure, projet, code, nombre) de l'intervalle"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            return self._stats.rollups.rows(date_from, date_to, project, code)
+
+    def latest_by_license(self):
+        """Dernière activation de chaque machine, groupée par licence (copies)"""
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+            return {
+                license_key: [dict(record) for record in devices.values()]
+                for license_key, devices in self._by_license.items()
+            }
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Tokens d'API des clients, éventuellement limités à un projet
+Seul le SHA-256 du token est conservé (api_tokens.json). La vérification passe par une
+table en mémoire indexée par le préfixe public du token : une requête authentifiée ne
+lit aucun fichier. Contrôle actif quand security.require_api_token est vrai dans rules.json
+
+Les serveurs partagent data/api_tokens.json ; gestion en ligne de commande :
+    python api_tokens.py create <nom> [projet] | list | revoke <préfixe>
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from license_store import file_signature, write_json_atomic
+
+# Forme des tokens : mgl_<préfixe>.<secret>
+TOKEN_SCHEME = "mgl_"
+HEADER = "X-API-Token"
+
+# Délai minimal entre deux vérifications du fichier (révocations faites par un autre processus)
+RELOAD_CHECK_SECONDS = 2
+
+# Fichier partagé par les serveurs (et par la ligne de commande)
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "api_tokens.json")
+
+
+def hash_token(token):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def split_token(token):
+    """Préfixe d'un token, None s'il n'a pas la bonne forme"""
+    if not token or not token.startswith(TOKEN_SCHEME):
+        return None
+    prefix, _, secret = token[len(TOKEN_SCHEME):].partition(".")
+    return prefix if prefix and secret else None
+
+
+def public_record(prefix, record):
+    """Informations d'un token affichables (sans empreinte)"""
+    return {"prefix": prefix, **{field: value for field, value in record.items() if field != "hash"}}
+
+
+class ApiTokenStore:
+    """Tokens indexés par préfixe, rechargés si le fichier change"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._signature = None
+        self._checked_at = 0.0
+        self._tokens = {}
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        signature = file_signature(self.path)
+        if signature != self._signature:
+            self._tokens = self._load()
+            self._signature = signature
+
+    def _persist(self):
+        write_json_atomic(self.path, self._tokens)
+        self._signature = file_signature(self.path)
+
+    def verify(self, token):
+        """Informations du token s'il est valide et non révoqué, sinon None"""
+        prefix = split_token(token)
+        if prefix is None:
+            return None
+        with self._lock:
+            self._refresh()
+            record = self._tokens.get(prefix)
+        if record is None or record.get("revoked_at"):
+            return None
+        if not hmac.compare_digest(record["hash"], hash_token(token)):
+            return None
+        return record
+
+    def create(self, name, project=None):
+        """(token en clair, informations) ; le token n'est plus récupérable ensuite
+        Un token avec un projet n'est accepté que pour les licences et codes de ce projet"""
+        with self._lock:
+            self._refresh(force=True)
+            prefix = secrets.token_hex(4)
+            while prefix in self._tokens:
+                prefix = secrets.token_hex(4)
+            token = f"{TOKEN_SCHEME}{prefix}.{secrets.token_urlsafe(32)}"
+            record = {
+                "name": name,
+                "project": project or None,
+                "hash": hash_token(token),
+                "created_at": datetime.now().isoformat(),
+                "revoked_at": None,
+            }
+            self._tokens = {**self._tokens, prefix: record}
+            self._persist()
+        return token, public_record(prefix, record)
+
+    def revoke(self, prefix):
+        """Révoquer un token (conservé pour l'historique) ; False s'il n'existe pas"""
+        with self._lock:
+            self._refresh(force=True)
+            record = self._tokens.get(prefix)
+            if record is None:
+                return False
+            if not record.get("revoked_at"):
+                self._tokens = {**self._tokens, prefix: {**record, "revoked_at": datetime.now().isoformat()}}
+                self._persist()
+        return True
+
+    def list(self):
+        """Tokens (sans empreinte), plus récents d'abord"""
+        with self._lock:
+            self._refresh(force=True)
+            tokens = list(self._tokens.items())
+        records = [public_record(prefix, record) for prefix, record in tokens]
+        return sorted(records, key=lambda record: record.get("created_at") or "", reverse=True)
+
+
+def request_token(request):
+    """Token présenté : en-tête Authorization: Bearer ou X-API-Token"""
+    authorization = request.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        return authorization[7:].strip()
+    return request.headers.get(HEADER)
+
+
+def unauthorized(detail):
+    return JSONResponse(status_code=401, content={"detail": detail}, headers={"WWW-Authenticate": "Bearer"})
+
+
+def token_project(request):
+    """Projet auquel le token de la requête est limité, None s'il n'y en a pas"""
+    record = getattr(request.state, "api_token", None)
+    return record.get("project") if record else None
+
+
+def token_refusal(request, project):
+    """(403, message) si le token de la requête est limité à un autre projet (sans casse), sinon None"""
+    scope = token_project(request)
+    if scope and scope.lower() != (project or "").lower():
+        return 403, f"Token d'API limité au projet {scope}"
+    return None
+
+
+def check_token_project(request, project):
+    """Lever une HTTPException 403 si le token n'autorise pas ce projet"""
+    refusal = token_refusal(request, project)
+    if refusal:
+        raise HTTPException(*refusal)
+
+
+def install_api_token_auth(app, paths, store, security):
+    """Exiger un token sur les routes listées (et leurs sous-chemins) si security()["require_api_token"]"""
+    prefixes = tuple(path + "/" for path in paths)
+
+    @app.middleware("http")
+    async def api_token_middleware(request, call_next):
+        path = request.url.path
+        if request.method == "OPTIONS" or (path not in paths and not path.startswith(prefixes)):
+            return await call_next(request)
+        if not security().get("require_api_token"):
+            return await call_next(request)
+
+        token = request_token(request)
+        if not token:
+            return unauthorized("Token d'API requis")
+        record = store.verify(token)
+        if record is None:
+            return unauthorized("Token d'API invalide ou révoqué")
+        request.state.api_token = record
+        return await call_next(request)
+
+    return store
+
+
+if __name__ == "__main__":
+    store = ApiTokenStore(DEFAULT_PATH)
+    command = sys.argv[1] if len(sys.argv) > 1 else "list"
+    if command == "create" and len(sys.argv) > 2:
+        token, record = store.create(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+        print(f"Token {record['prefix']} (projet : {record['project'] or 'tous'}) : {token}")
+        print("Conservez-le : il ne sera plus affiché")
+    elif command == "list":
+        for record in store.list():
+            status = f"révoqué le {record['revoked_at']}" if record.get("revoked_at") else "actif"
+            print(f"{record['prefix']}  {record['name']}  projet={record.get('project') or 'tous'}  {status}")
+    elif command == "revoke" and len(sys.argv) > 2:
+        print("Token révoqué" if store.revoke(sys.argv[2]) else "Token inconnu")
+    else:
+        print("Usage : python api_tokens.py create <nom> [projet] | list | revoke <préfixe>")
+        sys.exit(1)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Caches de l'authentification de l'interface d'administration
+Annuaire des utilisateurs chargé une fois (invalidé à chaque écriture) et tokens
+JWT déjà décodés gardés quelques secondes : une page d'administration ne coûte
+ni lecture de users_conf.json ni vérification de signature
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+# Relecture périodique de l'annuaire, pour les modifications faites hors du serveur (setup_users.py)
+USERS_MAX_AGE_SECONDS = 60
+# Durée de vie d'un token décodé dans le cache
+TOKEN_TTL_SECONDS = 30
+TOKEN_CACHE_SIZE = 1024
+
+
+class UserDirectory:
+    """Utilisateurs en mémoire, rechargés après invalidate() ou passé max_age secondes"""
+
+    def __init__(self, load, max_age=USERS_MAX_AGE_SECONDS):
+        self._load = load
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._users = None
+        self._loaded_at = 0.0
+        self._generation = 0
+
+    def _current(self):
+        with self._lock:
+            if self._users is not None and time.monotonic() - self._loaded_at < self.max_age:
+                return self._users
+            generation = self._generation
+        users = self._load()
+        with self._lock:
+            # Une invalidation pendant le chargement rend ce résultat obsolète : ne pas le garder
+            if generation == self._generation:
+                self._users = users
+                self._loaded_at = time.monotonic()
+        return users
+
+    def get(self, username):
+        """Données de l'utilisateur (copie), None s'il n'existe pas"""
+        user_data = self._current().get(username)
+        return dict(user_data) if user_data is not None else None
+
+    def all(self):
+        """Tous les utilisateurs (copie)"""
+        return {username: dict(data) for username, data in self._current().items()}
+
+    def invalidate(self):
+        """À appeler après chaque écriture des utilisateurs"""
+        with self._lock:
+            self._users = None
+            self._generation += 1
+
+
+class TokenCache:
+    """Sujet (sub) des tokens déjà décodés, pendant ttl secondes sans dépasser leur expiration"""
+
+    def __init__(self, ttl=TOKEN_TTL_SECONDS, max_entries=TOKEN_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, token):
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[token]
+                return None
+            self._entries.move_to_end(token)
+            return entry[0]
+
+    def put(self, token, subject, expires_at=None):
+        """Garder le sujet d'un token valide ; expires_at : claim exp (secondes epoch)"""
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[token] = (subject, deadline)
+            self._entries.move_to_end(token)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
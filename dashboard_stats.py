@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Statistiques du tableau de bord tenues à jour à chaque écriture
+Compteurs des codes (actifs, utilisés, expirés), agrégats horaires des activations
+par projet et par code, et occupation des postes : le tableau de bord et les métriques
+les lisent sans parcourir l'historique.
+Le backend SQLite tient les mêmes compteurs par triggers (voir storage.py)
+"""
+
+import heapq
+from bisect import bisect_left, insort
+
+# Granularités des métriques d'activation et regroupements possibles
+BUCKETS = ("hour", "day")
+GROUP_BY = ("project", "code")
+
+
+def record_project(record):
+    """Projet d'une activation : le sien ou celui de la licence embarquée ("" si inconnu)"""
+    license_data = (record.get("license_data") or {}).get("data") or {}
+    return record.get("project") or license_data.get("project") or ""
+
+
+def activation_hour(record):
+    """Heure (AAAA-MM-JJTHH) d'une activation"""
+    return (record.get("timestamp") or record.get("activated_at") or "")[:13]
+
+
+def hour_range(date_from=None, date_to=None):
+    """Bornes [début, fin) sur les heures pour des dates ISO incluses (date seule acceptée)"""
+    start = date_from[:13] if date_from else ""
+    # "~" suit tous les séparateurs : "2024-03-31" inclut toutes les heures du 31
+    end = date_to[:13] + "~" if date_to else None
+    return start, end
+
+
+def uses_seat(record):
+    """Vrai si l'activation occupe un poste d'un code d'activation"""
+    return record.get("status") == "active" and record.get("activation_code") is not None
+
+
+class CodeStats:
+    """Compteurs des codes d'activation par projet (total, utilisés, postes) et codes expirés"""
+
+    def __init__(self, codes=None):
+        # code -> (projet, utilisé, postes, expiration)
+        self._codes = {}
+        # projet -> [total, utilisés, postes]
+        self._projects = {}
+        # Tas (expiration, code) des codes non utilisés, expirés paresseusement à la lecture
+        self._expiry = []
+        self._expired = set()
+        for code, info in (codes or {}).items():
+            self.add(code, info)
+
+    def _count(self, entry, delta):
+        counts = self._projects.setdefault(entry[0], [0, 0, 0])
+        counts[0] += delta
+        counts[1] += delta * entry[1]
+        counts[2] += delta * entry[2]
+
+    def add(self, code, info):
+        self.remove(code)
+        entry = (info.get("project") or "", bool(info.get("used")), info.get("max_activations") or 0, info.get("expires_at"))
+        self._codes[code] = entry
+        self._count(entry, 1)
+        if not entry[1] and entry[3]:
+            heapq.heappush(self._expiry, (entry[3], code))
+
+    def remove(self, code):
+        entry = self._codes.pop(code, None)
+        if entry is not None:
+            self._count(entry, -1)
+            # L'entrée du tas devient obsolète : ignorée quand elle arrive à échéance
+            self._expired.discard(code)
+
+    def projects(self):
+        """projet -> (total, utilisés, postes)"""
+        return {project: tuple(counts) for project, counts in self._projects.items() if counts[0]}
+
+    def expired(self, now):
+        """Nombre de codes non utilisés dont l'expiration (ISO) est passée"""
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, code = heapq.heappop(self._expiry)
+            entry = self._codes.get(code)
+            if entry is not None and not entry[1] and entry[3] == expires_at:
+                self._expired.add(code)
+        return len(self._expired)
+
+
+class ActivationRollups:
+    """Nombre d'activations par heure, projet, code et statut, ajusté à chaque écriture"""
+
+    def __init__(self):
+        # Heures connues, triées pour les requêtes par intervalle
+        self._hours = []
+        # heure -> {(projet, code, statut) -> nombre}
+        self._counts = {}
+
+    def add(self, record, delta=1):
+        hour = activation_hour(record)
+        counts = self._counts.get(hour)
+        if counts is None:
+            counts = self._counts[hour] = {}
+            insort(self._hours, hour)
+        key = (record_project(record), record.get("activation_code") or "", record.get("status"))
+        counts[key] = counts.get(key, 0) + delta
+
+    def rows(self, date_from=None, date_to=None, project=None, code=None, status=None):
+        """(heure, projet, code, nombre) des heures de l'intervalle, filtrés par projet, code et statut"""
+        start, end = hour_range(date_from, date_to)
+        first = bisect_left(self._hours, start)
+        last = bisect_left(self._hours, end) if end else len(self._hours)
+        rows = []
+        for hour in self._hours[first:last]:
+            # Statuts additionnés : une ligne par (projet, code)
+            merged = {}
+            for (row_project, row_code, row_status), count in self._counts[hour].items():
+                if (count and (project is None or row_project == project) and (code is None or row_code == code)
+                        and (status is None or row_status == status)):
+                    merged[(row_project, row_code)] = merged.get((row_project, row_code), 0) + count
+            rows.extend((hour, row_project, row_code, count) for (row_project, row_code), count in merged.items() if count)
+        return rows
+
+
+def rollup_series(rows, bucket="day", by="project"):
+    """Séries d'activations par intervalle (heure ou jour) depuis les lignes d'agrégats"""
+    if bucket not in BUCKETS:
+        raise ValueError(f"Intervalle non supporté : {bucket}")
+    if by not in GROUP_BY:
+        raise ValueError(f"Regroupement non supporté : {by}")
+    width = 13 if bucket == "hour" else 10
+    series = {}
+    for hour, project, code, count in rows:
+        key = (hour[:width], project, code if by == "code" else "")
+        series[key] = series.get(key, 0) + count
+    points = []
+    for (point_bucket, project, code), count in sorted(series.items()):
+        if not count:
+            continue
+        point = {"bucket": point_bucket, "project": project, "activations": count}
+        if by == "code":
+            point["activation_code"] = code
+        points.append(point)
+    return points
+
+
+class ActivationStats:
+    """Agrégats horaires des activations et postes occupés par projet"""
+
+    def __init__(self):
+        self.rollups = ActivationRollups()
+        # projet -> activations actives rattachées à un code
+        self._seats = {}
+
+    def add(self, record, delta=1):
+        self.rollups.add(record, delta)
+        if uses_seat(record):
+            project = record_project(record)
+            self._seats[project] = self._seats.get(project, 0) + delta
+
+    def remove(self, record):
+        self.add(record, -1)
+
+    def on_day(self, day):
+        """projet -> activations du jour"""
+        today = {}
+        for _, project, _, count in self.rollups.rows(day, day):
+            today[project] = today.get(project, 0) + count
+        return {project: count for project, count in today.items() if count}
+
+    def seats(self):
+        """projet -> postes occupés"""
+        return {project: count for project, count in self._seats.items() if count}
+
+
+def summarize(code_projects, expired, seats_used, today):
+    """Statistiques du tableau de bord à partir des compteurs bruts d'un backend"""
+    projects = {}
+    for project in set(code_projects) | set(seats_used) | set(today):
+        total, used, seats = code_projects.get(project, (0, 0, 0))
+        projects[project] = {
+            "codes": total,
+            "used_codes": used,
+            "seats": seats,
+            "seats_used": seats_used.get(project, 0),
+            "today_activations": today.get(project, 0),
+        }
+    total_codes = sum(counts[0] for counts in code_projects.values())
+    used_codes = sum(counts[1] for counts in code_projects.values())
+    seats = sum(counts[2] for counts in code_projects.values())
+    seats_in_use = sum(seats_used.values())
+    return {
+        "total_codes": total_codes,
+        "active_codes": total_codes - used_codes - expired,
+        "used_codes": used_codes,
+        "expired_codes": expired,
+        "today_activations": sum(today.values()),
+        "seats": seats,
+        "seats_used": seats_in_use,
+        "seat_utilisation": round(100 * seats_in_use / seats, 1) if seats else 0.0,
+        "projects": projects,
+    }
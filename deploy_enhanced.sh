@@ -55,6 +55,12 @@ echo "🔄 Mise à jour du serveur principal..."
 cp "licences/main_enhanced.py" "$SERVER_DIR/main.py"
 echo "✅ main_enhanced.py → main.py"
 
+# Modules partagés importés par le serveur
+for module in license_store.py activation_journal.py storage.py key_manager.py leases.py heartbeats.py idempotency.py http_cache.py license_search.py exports.py dashboard_stats.py events.py auth_cache.py rate_limit.py api_tokens.py software_registry.py rules_history.py; do
+    cp "licences/$module" "$SERVER_DIR/"
+    echo "✅ $module"
+done
+
 # 4. Copie des templates
 echo ""
 echo "🎨 Mise à jour des templates HTML..."
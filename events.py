@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Bus d'événements en mémoire et flux Server-Sent Events pour les pages d'administration
+Les chemins d'écriture publient (activation, désactivation, génération de code) ;
+chaque page ouverte reçoit les événements au fil de l'eau au lieu de se recharger.
+Le bus est propre au processus : un autre serveur ne voit pas ces événements
+"""
+
+import asyncio
+import json
+import threading
+from collections import deque
+from datetime import datetime
+
+from fastapi.responses import StreamingResponse
+
+# Types d'événements publiés
+ACTIVATION = "activation"
+DEACTIVATION = "deactivation"
+CODE_GENERATED = "code_generated"
+
+# Libellés affichés dans les activités récentes
+MESSAGES = {
+    ACTIVATION: "Activation d'un poste ({project})",
+    DEACTIVATION: "Désactivation d'un poste ({project})",
+    CODE_GENERATED: "Code d'activation généré ({project})",
+}
+
+# Événements gardés pour la reprise après reconnexion (en-tête Last-Event-ID)
+HISTORY_SIZE = 500
+# Événements en attente par abonné : au-delà, les plus anciens sont abandonnés
+QUEUE_SIZE = 1000
+# Commentaire envoyé périodiquement pour garder la connexion ouverte
+KEEPALIVE_SECONDS = 15
+
+
+def _offer(queue, event):
+    """Ajouter un événement à la file d'un abonné (abandonner le plus ancien si elle est pleine)"""
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+class EventBus:
+    """Diffusion des événements vers les files asyncio des abonnés (publication depuis tout thread)"""
+
+    def __init__(self, history_size=HISTORY_SIZE, queue_size=QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._history = deque(maxlen=history_size)
+        self._subscribers = {}
+        self._next_id = 1
+
+    def publish(self, event_type, data):
+        """Publier un événement ; retourne l'événement avec son identifiant"""
+        with self._lock:
+            event = {"id": self._next_id, "type": event_type, "data": data}
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers.items())
+        for queue, loop in subscribers:
+            try:
+                loop.call_soon_threadsafe(_offer, queue, event)
+            except RuntimeError:
+                # Boucle fermée : l'abonné a disparu sans se désabonner
+                self.unsubscribe(queue)
+        return event
+
+    def subscribe(self, last_event_id=None):
+        """File d'événements pour la boucle courante, préremplie des événements manqués"""
+        queue = asyncio.Queue(self.queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event["id"] > last_event_id:
+                        _offer(queue, event)
+            self._subscribers[queue] = asyncio.get_running_loop()
+        return queue
+
+    def recent(self, limit=10):
+        """Derniers événements publiés, plus récents d'abord"""
+        with self._lock:
+            return list(self._history)[::-1][:limit]
+
+    def unsubscribe(self, queue):
+        with self._lock:
+            self._subscribers.pop(queue, None)
+
+
+# Bus partagé par les routes d'un processus
+bus = EventBus()
+
+
+def publish(event_type, **data):
+    """Publier sur le bus du processus (horodatage et libellé ajoutés)"""
+    data.setdefault("timestamp", datetime.now().isoformat())
+    data["message"] = MESSAGES.get(event_type, event_type).format(project=data.get("project") or "projet inconnu")
+    return bus.publish(event_type, data)
+
+
+def recent_activities(limit=10):
+    """Activités récentes du processus pour le tableau de bord (type, message, horodatage)"""
+    return [{"type": event["type"], **event["data"]} for event in bus.recent(limit)]
+
+
+def format_event(event):
+    """Trame SSE d'un événement"""
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+
+
+def _last_event_id(request):
+    try:
+        return int(request.headers.get("last-event-id"))
+    except (TypeError, ValueError):
+        return None
+
+
+async def event_stream(request, types=None, event_bus=None):
+    """Trames SSE des événements du bus jusqu'à la déconnexion du client"""
+    event_bus = event_bus or bus
+    queue = event_bus.subscribe(_last_event_id(request))
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            if types and event["type"] not in types:
+                continue
+            yield format_event(event)
+    finally:
+        event_bus.unsubscribe(queue)
+
+
+def event_stream_response(request, types=None):
+    """StreamingResponse text/event-stream ; types : liste séparée par des virgules, None pour tous"""
+    wanted = {name.strip() for name in types.split(",") if name.strip()} if types else None
+    return StreamingResponse(
+        event_stream(request, wanted),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
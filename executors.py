@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+"""
+Pools de threads bornés pour les routes async
+Les lectures/écritures de fichiers, la signature RSA/Ed25519 et bcrypt sont exécutés
+hors de la boucle d'événements pour qu'une requête lente ne bloque pas les autres
+"""
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Taille des pools (configurable par variables d'environnement)
+IO_WORKERS = int(os.environ.get("LICENSE_IO_WORKERS", "8"))
+CRYPTO_WORKERS = int(os.environ.get("LICENSE_CRYPTO_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+# Entrées/sorties fichiers et stockage
+io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="license-io")
+# Opérations coûteuses en CPU : signatures, vérifications, bcrypt
+crypto_pool = ThreadPoolExecutor(max_workers=CRYPTO_WORKERS, thread_name_prefix="license-crypto")
+
+
+async def run_io(func, *args, **kwargs):
+    """Exécuter une fonction bloquante d'entrées/sorties dans le pool I/O"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(io_pool, functools.partial(func, *args, **kwargs))
+
+
+async def run_crypto(func, *args, **kwargs):
+    """Exécuter une opération cryptographique dans le pool dédié"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(crypto_pool, functools.partial(func, *args, **kwargs))
+
+
+def shutdown():
+    """Arrêter les pools (à l'arrêt du serveur)"""
+    io_pool.shutdown(wait=True)
+    crypto_pool.shutdown(wait=True)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Exports en flux (CSV / NDJSON) des licences, activations et codes
+Les lignes sont produites une à une depuis le stockage et envoyées au fil de l'eau :
+la mémoire reste constante quelle que soit la taille de l'export
+"""
+
+import csv
+import io
+import json
+
+from fastapi.responses import StreamingResponse
+
+from dashboard_stats import record_project
+
+FORMATS = ("csv", "ndjson")
+DATASETS = ("licenses", "activations", "codes")
+
+# Colonnes des exports CSV (le NDJSON contient les enregistrements complets)
+LICENSE_FIELDS = ["key", "email", "project", "version", "status", "activations", "max_activations", "expires_at"]
+ACTIVATION_FIELDS = [
+    "license_key", "device_id", "activation_code", "project", "status",
+    "timestamp", "last_seen", "deactivated_at",
+]
+CODE_FIELDS = ["code", "project", "email", "status", "max_activations", "created_at", "expires_at"]
+
+MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+
+def in_range(value, date_from=None, date_to=None):
+    """Vrai si la date ISO est dans [date_from, date_to] (bornes incluses, date seule acceptée)"""
+    if not date_from and not date_to:
+        return True
+    if not value:
+        return False
+    value = str(value)
+    if date_from and value < date_from:
+        return False
+    # "2024-03-31" inclut toute la journée du 31
+    if date_to and value[:len(date_to)] > date_to:
+        return False
+    return True
+
+
+def csv_stream(rows, fieldnames):
+    """Lignes CSV encodées, une par enregistrement (tampon réutilisé)"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames, extrasaction="ignore")
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    # Un export vide contient au moins l'en-tête
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+def ndjson_stream(rows):
+    """Un objet JSON par ligne"""
+    for row in rows:
+        yield (json.dumps(row, ensure_ascii=False, default=str) + "\n").encode()
+
+
+def export_response(rows, fmt, fieldnames, filename):
+    """StreamingResponse CSV ou NDJSON ; ValueError si le format est inconnu"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Format non supporté : {fmt}")
+    body = csv_stream(rows, fieldnames) if fmt == "csv" else ndjson_stream(rows)
+    return StreamingResponse(
+        body,
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f"attachment; filename={filename}.{fmt}"},
+    )
+
+
+def license_rows(storage, project=None, date_from=None, date_to=None):
+    """Licences filtrées par projet et date de création"""
+    for lic in storage.iter_licenses():
+        if project and lic.get("project") != project:
+            continue
+        if not in_range(lic.get("created_at"), date_from, date_to):
+            continue
+        yield lic
+
+
+def activation_project(storage, record, projects):
+    """Projet d'une activation : celui de l'enregistrement, de la licence embarquée, ou de la licence"""
+    project = record_project(record)
+    if project:
+        return project
+    license_key = record.get("license_key")
+    if license_key not in projects:
+        lic = storage.get_license(license_key) if license_key else None
+        projects[license_key] = lic.get("project") if lic else None
+    return projects[license_key]
+
+
+def activation_rows(storage, project=None, date_from=None, date_to=None):
+    """Activations filtrées par projet et date d'activation"""
+    # Projet des licences déjà consultées (une lecture par licence, pas par activation)
+    projects = {}
+    for record in storage.iter_activations():
+        if not in_range(record.get("timestamp") or record.get("activated_at"), date_from, date_to):
+            continue
+        found = activation_project(storage, record, projects)
+        if project and found != project:
+            continue
+        record["project"] = found
+        yield record
+
+
+def code_rows(storage, project=None, date_from=None, date_to=None):
+    """Codes d'activation filtrés par projet et date de création"""
+    for code, info in storage.iter_codes():
+        if project and info.get("project") != project:
+            continue
+        if not in_range(info.get("created_at"), date_from, date_to):
+            continue
+        yield {"code": code, **info}
+
+
+ROWS = {"licenses": license_rows, "activations": activation_rows, "codes": code_rows}
+FIELDS = {"licenses": LICENSE_FIELDS, "activations": ACTIVATION_FIELDS, "codes": CODE_FIELDS}
+
+
+def export_dataset(storage, dataset, fmt="csv", project=None, date_from=None, date_to=None):
+    """Export en flux d'un jeu de données ; ValueError si le jeu ou le format est inconnu"""
+    if dataset not in DATASETS:
+        raise ValueError(f"Export non supporté : {dataset}")
+    rows = ROWS[dataset](storage, project, date_from, date_to)
+    return export_response(rows, fmt, FIELDS[dataset], f"{dataset}_export")
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Heartbeats des postes clients
+Les check-ins (license_key, device_id) sont gardés en mémoire et écrits par lots
+sur les activations correspondantes (champ last_seen) à intervalle régulier :
+des milliers de postes ne coûtent qu'une écriture par intervalle
+"""
+
+import atexit
+import logging
+import os
+import threading
+from datetime import datetime
+
+# Intervalle entre deux écritures des heartbeats (secondes, 0 = écriture immédiate)
+FLUSH_SECONDS = float(os.environ.get("HEARTBEAT_FLUSH_SECONDS", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+class HeartbeatBuffer:
+    """Derniers check-ins en mémoire, écrits en lot dans le stockage des activations"""
+
+    def __init__(self, storage, flush_seconds=FLUSH_SECONDS):
+        self.storage = storage
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._last_seen = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _ensure_flusher(self):
+        if self._thread is None and self.flush_seconds > 0:
+            self._thread = threading.Thread(target=self._run, name="heartbeat-flush", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Erreur écriture des heartbeats: {e}")
+
+    def record(self, license_key, device_id, seen_at=None):
+        """Enregistrer un check-in (en mémoire seulement)"""
+        seen_at = seen_at or datetime.now().isoformat()
+        with self._lock:
+            self._pending[(license_key, device_id)] = seen_at
+            self._last_seen[(license_key, device_id)] = seen_at
+            self._ensure_flusher()
+        if self.flush_seconds <= 0:
+            # Écriture immédiate si l'intervalle est désactivé
+            self.flush()
+        return seen_at
+
+    def last_seen(self, license_key, device_id):
+        """Dernier check-in connu de ce processus, None si aucun"""
+        with self._lock:
+            return self._last_seen.get((license_key, device_id))
+
+    def flush(self):
+        """Écrire les check-ins en attente en une seule opération ; retourne le nombre d'activations mises à jour"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        updates = [
+            ({"license_key": license_key, "device_id": device_id, "status": "active"}, {"last_seen": seen_at})
+            for (license_key, device_id), seen_at in pending.items()
+        ]
+        try:
+            return self.storage.update_activations_many(updates)
+        except Exception:
+            # Remettre les check-ins en attente (sans écraser les plus récents) pour le prochain essai
+            with self._lock:
+                for device, seen_at in pending.items():
+                    self._pending.setdefault(device, seen_at)
+            raise
+
+    def close(self):
+        """Arrêter l'écriture périodique et écrire ce qui reste"""
+        self._stop.set()
+        self.flush()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Réponses conditionnelles (ETag / If-None-Match / Cache-Control)
+Le corps et son ETag fort sont calculés une fois par version du contenu (signature des
+fichiers sources) ; un client qui renvoie l'ETag reçoit un 304 sans corps
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from fastapi.responses import Response
+
+# Indications de cache par type de contenu
+LICENSE_CACHE_CONTROL = "private, no-cache"
+PUBLIC_KEY_CACHE_CONTROL = "public, max-age=300"
+METADATA_CACHE_CONTROL = "public, max-age=60"
+
+
+def make_etag(content):
+    """ETag fort dérivé du contenu"""
+    return '"' + hashlib.sha256(content).hexdigest()[:32] + '"'
+
+
+def read_file(path):
+    """Contenu brut d'un fichier"""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def not_modified(request, etag):
+    """Vrai si l'en-tête If-None-Match du client correspond à l'ETag"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+class VersionedBodies:
+    """Corps de réponse (bytes) et ETag, recalculés seulement quand la version change"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, name, version, build):
+        """(contenu, etag) de name pour cette version ; build() n'est appelé qu'au changement"""
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(name)
+                return entry[1], entry[2]
+        content = build()
+        etag = make_etag(content)
+        with self._lock:
+            self._entries[name] = (version, content, etag)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return content, etag
+
+
+# Cache partagé par les routes d'un processus
+bodies = VersionedBodies()
+
+
+def conditional_response(request, content, etag, media_type, cache_control, headers=None):
+    """Réponse complète, ou 304 si le client possède déjà cette version"""
+    response_headers = {"ETag": etag, "Cache-Control": cache_control}
+    if headers:
+        response_headers.update(headers)
+    if not_modified(request, etag):
+        return Response(status_code=304, headers=response_headers)
+    return Response(content=content, media_type=media_type, headers=response_headers)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Clés d'idempotence (en-tête Idempotency-Key)
+Une requête POST rejouée avec la même clé reçoit la réponse enregistrée, sans refaire
+la signature ni les écritures. Cache borné (LRU + durée de vie), propre à chaque processus
+"""
+
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi.responses import JSONResponse, Response
+
+HEADER = "Idempotency-Key"
+
+# Durée de conservation des réponses et nombre maximum d'entrées
+TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+MAX_ENTRIES = int(os.environ.get("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+
+class IdempotencyCache:
+    """Réponses terminées, indexées par (chemin, clé), expirées après ttl_seconds"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl_seconds=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if time.monotonic() > expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def _replay(stored):
+    response = Response(content=stored["body"], status_code=stored["status_code"])
+    response.raw_headers = stored["headers"] + [(b"idempotent-replayed", b"true")]
+    return response
+
+
+def install_idempotency(app, paths, cache=None):
+    """Honorer Idempotency-Key sur les routes POST listées (réponses 2xx mises en cache)"""
+    cache = cache or IdempotencyCache()
+    in_flight = {}
+
+    @app.middleware("http")
+    async def idempotency_middleware(request, call_next):
+        key = request.headers.get(HEADER)
+        if not key or request.method != "POST" or request.url.path not in paths:
+            return await call_next(request)
+
+        fingerprint = hashlib.sha256(await request.body()).hexdigest()
+        cache_key = (request.url.path, key)
+
+        # Une requête identique encore en cours : attendre sa réponse plutôt que la refaire
+        pending = in_flight.setdefault(cache_key, [asyncio.Lock(), 0])
+        pending[1] += 1
+        try:
+            async with pending[0]:
+                stored = cache.get(cache_key)
+                if stored is not None:
+                    if stored["fingerprint"] != fingerprint:
+                        return JSONResponse(
+                            status_code=422,
+                            content={"detail": f"{HEADER} déjà utilisée pour une autre requête"},
+                        )
+                    return _replay(stored)
+
+                response = await call_next(request)
+                if not 200 <= response.status_code < 300:
+                    return response
+
+                body = b"".join([chunk async for chunk in response.body_iterator])
+                stored = {
+                    "fingerprint": fingerprint,
+                    "status_code": response.status_code,
+                    "headers": list(response.raw_headers),
+                    "body": body,
+                }
+                cache.put(cache_key, stored)
+                buffered = Response(content=body, status_code=response.status_code)
+                buffered.raw_headers = stored["headers"]
+                return buffered
+        finally:
+            pending[1] -= 1
+            if pending[1] == 0:
+                del in_flight[cache_key]
+
+    return cache
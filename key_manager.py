@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+Gestionnaire de clés du serveur de licences (RSA et Ed25519)
+Charge les clés une seule fois et ne les relit que si les fichiers PEM changent
+(rotation via /admin/keys/force ou par un autre processus)
+"""
+
+import os
+import threading
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+
+from license_store import file_signature
+
+# Valeurs du champ alg des licences signées
+RSA_PKCS1V15 = "RSA-PKCS1v1.5-SHA256"
+RSA_PKCS1V15_ALIASES = (RSA_PKCS1V15, "RSA-PKCS1v15-SHA256")
+RSA_PSS = "RSA-PSS-SHA256"
+ED25519 = "Ed25519"
+
+
+def ed25519_key_paths(private_path, public_path):
+    """Fichiers de la paire Ed25519 rangée à côté de la paire RSA (private_ed25519.pem, ...)"""
+    private_root, private_ext = os.path.splitext(private_path)
+    public_root, public_ext = os.path.splitext(public_path)
+    return f"{private_root}_ed25519{private_ext}", f"{public_root}_ed25519{public_ext}"
+
+
+class KeyManager:
+    """Paire de clés (RSA ou Ed25519) mise en cache, partagée par tous les chemins de signature"""
+
+    def __init__(self, private_path, public_path, key_type="rsa"):
+        self.private_path = private_path
+        self.public_path = public_path
+        self.key_type = key_type
+        self._lock = threading.RLock()
+        self._private_key = None
+        self._private_signature = None
+        self._public_key = None
+        self._public_pem = None
+        self._public_signature = None
+
+    def has_keys(self):
+        return os.path.exists(self.private_path) and os.path.exists(self.public_path)
+
+    def has_any_key(self):
+        return os.path.exists(self.private_path) or os.path.exists(self.public_path)
+
+    def generate(self):
+        """Générer et sauvegarder une nouvelle paire (remplace l'existante)"""
+        with self._lock:
+            if self.key_type == "ed25519":
+                private_key = ed25519.Ed25519PrivateKey.generate()
+            else:
+                private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            public_key = private_key.public_key()
+
+            for path in (self.private_path, self.public_path):
+                directory = os.path.dirname(path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+
+            with open(self.private_path, "wb") as f:
+                f.write(
+                    private_key.private_bytes(
+                        encoding=serialization.Encoding.PEM,
+                        format=serialization.PrivateFormat.PKCS8,
+                        encryption_algorithm=serialization.NoEncryption(),
+                    )
+                )
+            public_pem = public_key.public_bytes(
+                encoding=serialization.Encoding.PEM,
+                format=serialization.PublicFormat.SubjectPublicKeyInfo,
+            )
+            with open(self.public_path, "wb") as f:
+                f.write(public_pem)
+
+            self._private_key = private_key
+            self._private_signature = file_signature(self.private_path)
+            self._public_key = public_key
+            self._public_pem = public_pem
+            self._public_signature = file_signature(self.public_path)
+            return private_key
+
+    def ensure_keys(self):
+        """Générer la paire si elle est absente"""
+        with self._lock:
+            if not self.has_keys():
+                self.generate()
+
+    def private_key(self, generate=True):
+        """Clé privée en cache ; rechargée seulement si private.pem a changé sur le disque"""
+        with self._lock:
+            if generate:
+                self.ensure_keys()
+            signature = file_signature(self.private_path)
+            if signature is None:
+                self._private_key = None
+                self._private_signature = None
+                return None
+            if signature != self._private_signature:
+                with open(self.private_path, "rb") as f:
+                    self._private_key = serialization.load_pem_private_key(f.read(), password=None)
+                self._private_signature = signature
+            return self._private_key
+
+    def _refresh_public(self):
+        signature = file_signature(self.public_path)
+        if signature is None:
+            self._public_key = None
+            self._public_pem = None
+        elif signature != self._public_signature:
+            with open(self.public_path, "rb") as f:
+                self._public_pem = f.read()
+            self._public_key = serialization.load_pem_public_key(self._public_pem)
+        self._public_signature = signature
+
+    def public_key(self):
+        """Clé publique en cache ; rechargée seulement si public.pem a changé, None si absente"""
+        with self._lock:
+            self._refresh_public()
+            return self._public_key
+
+    def public_pem(self):
+        """Contenu PEM de la clé publique en cache, None si absente"""
+        with self._lock:
+            self._refresh_public()
+            return self._public_pem
+
+
+def _padding_for(alg):
+    """Schéma de padding RSA correspondant au champ alg d'une licence signée"""
+    if alg in RSA_PKCS1V15_ALIASES:
+        return padding.PKCS1v15()
+    if alg == RSA_PSS:
+        return padding.PSS(mgf=padding.MGF1(hashes.SHA256()), salt_length=padding.PSS.MAX_LENGTH)
+    raise ValueError(f"Algorithme de signature inconnu : {alg}")
+
+
+class LicenseSigner:
+    """Signature des licences avec l'algorithme choisi par projet (RSA ou Ed25519)"""
+
+    def __init__(self, rsa_manager, ed25519_manager):
+        self.rsa_manager = rsa_manager
+        self.ed25519_manager = ed25519_manager
+
+    def manager_for(self, alg):
+        return self.ed25519_manager if alg == ED25519 else self.rsa_manager
+
+    def sign(self, payload, alg=RSA_PKCS1V15):
+        """Signer le payload (bytes) ; la paire de l'algorithme est générée si absente"""
+        private_key = self.manager_for(alg).private_key()
+        if alg == ED25519:
+            return private_key.sign(payload)
+        return private_key.sign(payload, _padding_for(alg), hashes.SHA256())
+
+    def rotate(self):
+        """Régénérer la paire RSA, et la paire Ed25519 si elle est utilisée"""
+        self.rsa_manager.generate()
+        if self.ed25519_manager.has_any_key():
+            self.ed25519_manager.generate()
+
+
+class LicenseVerifier:
+    """Vérification de signatures avec les clés publiques en cache, selon le champ alg"""
+
+    def __init__(self, rsa_manager, ed25519_manager):
+        self.rsa_manager = rsa_manager
+        self.ed25519_manager = ed25519_manager
+
+    def _public_key(self, alg):
+        manager = self.ed25519_manager if alg == ED25519 else self.rsa_manager
+        return manager.public_key()
+
+    def _verify_with(self, public_key, payload, signature, alg):
+        try:
+            if alg == ED25519:
+                public_key.verify(signature, payload)
+            else:
+                public_key.verify(signature, payload, _padding_for(alg), hashes.SHA256())
+            return True
+        except (InvalidSignature, ValueError, TypeError, AttributeError):
+            return False
+
+    def verify(self, payload, signature, alg=RSA_PKCS1V15):
+        """Vrai si la signature (bytes) du payload (bytes) est valide ; False si aucune clé publique"""
+        public_key = self._public_key(alg)
+        if public_key is None:
+            return False
+        return self._verify_with(public_key, payload, signature, alg)
+
+    def verify_many(self, items):
+        """Vérifier un lot de (payload, signature, alg) avec une seule résolution de clé par algorithme"""
+        keys = {}
+        results = []
+        for payload, signature, alg in items:
+            if alg not in keys:
+                keys[alg] = self._public_key(alg)
+            public_key = keys[alg]
+            results.append(public_key is not None and self._verify_with(public_key, payload, signature, alg))
+        return results
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_key_manager(private_path, public_path, key_type="rsa"):
+    """Gestionnaire partagé pour une paire de fichiers de clés"""
+    cache_key = (os.path.abspath(private_path), os.path.abspath(public_path))
+    with _managers_lock:
+        if cache_key not in _managers:
+            _managers[cache_key] = KeyManager(private_path, public_path, key_type)
+        return _managers[cache_key]
+
+
+def get_ed25519_key_manager(private_path, public_path):
+    """Gestionnaire de la paire Ed25519 associée à une paire RSA"""
+    return get_key_manager(*ed25519_key_paths(private_path, public_path), key_type="ed25519")
+
+
+def get_license_signer(private_path, public_path):
+    """Signataire partagé (RSA + Ed25519) pour cette paire de clés"""
+    return LicenseSigner(
+        get_key_manager(private_path, public_path),
+        get_ed25519_key_manager(private_path, public_path),
+    )
+
+
+def get_license_verifier(private_path, public_path):
+    """Vérificateur partagé (RSA + Ed25519) pour cette paire de clés"""
+    return LicenseVerifier(
+        get_key_manager(private_path, public_path),
+        get_ed25519_key_manager(private_path, public_path),
+    )
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Baux de licence hors ligne
+/verify peut renvoyer un bail signé (clé, device_id, expiration) que le client vérifie
+localement avec la clé publique jusqu'à son expiration ; il ne rappelle le serveur que
+pour le renouveler
+"""
+
+import json
+from datetime import datetime, timedelta
+
+from key_manager import RSA_PKCS1V15
+
+# Durée d'un bail si ni le projet ni activation_rules ne la précisent
+DEFAULT_RENEWAL_HOURS = 24
+
+# Champs d'un bail émis par issue_lease
+LEASE_FIELDS = ("key", "device_id", "project", "issued_at", "expires_at")
+
+
+def lease_hours_for(rules, project):
+    """Durée du bail : lease_renewal_hours du projet dans rules.json, sinon celle de activation_rules"""
+    project_info = next((p for p in rules.get("projects", []) if p.get("id") == project), {})
+    default = rules.get("activation_rules", {}).get("lease_renewal_hours", DEFAULT_RENEWAL_HOURS)
+    return project_info.get("lease_renewal_hours", default)
+
+
+def _canonical(lease):
+    return json.dumps(lease, sort_keys=True, separators=(",", ":")).encode()
+
+
+def issue_lease(signer, lic, device_id, hours, alg=RSA_PKCS1V15):
+    """Bail signé pour cette machine, sans dépasser l'expiration de la licence"""
+    now = datetime.now()
+    expires_at = min(now + timedelta(hours=hours), datetime.fromisoformat(lic["expires_at"]))
+    lease = {
+        "key": lic["key"],
+        "device_id": device_id,
+        "project": lic["project"],
+        "issued_at": now.isoformat(),
+        "expires_at": expires_at.isoformat(),
+    }
+    return {
+        "lease": lease,
+        "signature": signer.sign(_canonical(lease), alg).hex(),
+        "alg": alg,
+    }
+
+
+def verify_lease(verifier, signed, key, device_id):
+    """Vrai si signed est un bail authentique émis pour cette licence et cette machine (même expiré)"""
+    try:
+        lease = signed["lease"]
+        signature = bytes.fromhex(signed["signature"])
+        alg = signed.get("alg", RSA_PKCS1V15)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return False
+    # Bail mal formé (pas un objet, champ manquant) : invalide, /verify repart d'une vérification normale
+    if not isinstance(lease, dict) or not isinstance(alg, str) or any(field not in lease for field in LEASE_FIELDS):
+        return False
+    if lease["key"] != key or lease["device_id"] != device_id:
+        return False
+    return verifier.verify(_canonical(lease), signature, alg)
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Recherche et pagination des licences pour l'administration
+Index de trigrammes sur clé, email et projet (recherche de sous-chaîne sans parcours
+complet) et pagination par curseur triée par created_at ou expires_at
+"""
+
+import base64
+import json
+from bisect import bisect_left, bisect_right
+
+# Champs de tri autorisés
+SORT_FIELDS = ("created_at", "expires_at")
+SEARCH_FIELDS = ("key", "email", "project")
+
+
+def encode_cursor(value, key):
+    """Curseur opaque désignant la dernière licence d'une page"""
+    return base64.urlsafe_b64encode(json.dumps([value, key]).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """(valeur de tri, clé) d'un curseur ; ValueError s'il est invalide"""
+    try:
+        value, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Curseur invalide")
+    return (value, key)
+
+
+def trigrams(text):
+    """Ensemble des trigrammes d'un texte"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def matches_query(lic, query):
+    """Sous-chaîne (insensible à la casse) de la clé, de l'email ou du projet, comme l'ancien filtre"""
+    return any(query in str(lic.get(field, "")).lower() for field in SEARCH_FIELDS)
+
+
+def sort_value(lic, sort):
+    return lic.get(sort) or ""
+
+
+class LicenseSearchIndex:
+    """Index construit une fois pour un état des licences : trigrammes et ordres de tri"""
+
+    def __init__(self, licenses):
+        self._licenses = licenses
+        self._postings = {}
+        for position, lic in enumerate(licenses):
+            # Séparateur nul : pas de trigramme à cheval sur deux champs
+            text = "\0".join(str(lic.get(field, "")).lower() for field in SEARCH_FIELDS)
+            for gram in trigrams(text):
+                self._postings.setdefault(gram, set()).add(position)
+        self._orders = {}
+        for sort in SORT_FIELDS:
+            order = sorted(range(len(licenses)), key=lambda p: (sort_value(licenses[p], sort), licenses[p]["key"]))
+            self._orders[sort] = (
+                [(sort_value(licenses[p], sort), licenses[p]["key"]) for p in order],
+                order,
+            )
+
+    def _candidates(self, query):
+        """Positions des licences correspondant à la recherche, None si pas de filtre"""
+        if not query:
+            return None
+        if len(query) < 3:
+            # Trop court pour les trigrammes : vérification directe
+            return {p for p, lic in enumerate(self._licenses) if matches_query(lic, query)}
+        grams = sorted(trigrams(query), key=lambda gram: len(self._postings.get(gram, ())))
+        positions = set(self._postings.get(grams[0], ()))
+        for gram in grams[1:]:
+            positions &= self._postings.get(gram, set())
+            if not positions:
+                break
+        return {p for p in positions if matches_query(self._licenses[p], query)}
+
+    def page(self, query="", sort="created_at", descending=False, cursor=None, limit=50):
+        """(licences de la page (copies), curseur de la page suivante ou None)"""
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Tri non supporté : {sort}")
+        candidates = self._candidates(query.lower())
+        keys, order = self._orders[sort]
+        if candidates is not None and len(candidates) < len(order) // 8:
+            # Peu de résultats : trier directement les candidats
+            order = sorted(candidates, key=lambda p: (sort_value(self._licenses[p], sort), self._licenses[p]["key"]))
+            keys = [(sort_value(self._licenses[p], sort), self._licenses[p]["key"]) for p in order]
+            candidates = None
+
+        if descending:
+            end = bisect_left(keys, decode_cursor(cursor)) if cursor else len(order)
+            indices = range(end - 1, -1, -1)
+        else:
+            start = bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+            indices = range(start, len(order))
+
+        selected = []
+        for i in indices:
+            if candidates is None or order[i] in candidates:
+                selected.append(order[i])
+                if len(selected) > limit:
+                    break
+
+        next_cursor = None
+        if len(selected) > limit:
+            selected = selected[:limit]
+            last = self._licenses[selected[-1]]
+            next_cursor = encode_cursor(sort_value(last, sort), last["key"])
+        return [dict(self._licenses[p]) for p in selected], next_cursor
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+Dépôt de licences en mémoire pour le serveur de licences
+Charge licenses.json une seule fois, maintient des index par clé et par (email, projet)
+et ne relit le fichier que lorsqu'il a été modifié sur le disque
+"""
+
+import json
+import os
+import threading
+import uuid
+
+from license_search import LicenseSearchIndex
+
+
+def file_signature(path):
+    """Signature (mtime, taille) d'un fichier, ou None s'il n'existe pas"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def write_text_atomic(path, text):
+    """Écrire un fichier via un fichier temporaire propre à l'écriture (deux écrivains ne partagent
+    jamais le même), synchronisé sur le disque avant de remplacer la cible : jamais de fichier partiel"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data):
+    """Écrire un fichier JSON sans jamais exposer un fichier partiel"""
+    write_text_atomic(path, json.dumps(data, indent=2))
+
+
+class LicenseStore:
+    """Licences indexées par clé et par (email, projet), rechargées si le fichier change"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._signature = None
+        self._licenses = []
+        self._by_key = {}
+        self._by_email_project = {}
+        # Index de recherche/tri de l'administration, reconstruit à la demande après un changement
+        self._search_index = None
+
+    def _reindex(self):
+        self._by_key = {}
+        self._by_email_project = {}
+        self._search_index = None
+        for lic in self._licenses:
+            self._index(lic)
+
+    def _index(self, lic):
+        # Conserver la première occurrence, comme l'ancien parcours linéaire
+        self._by_key.setdefault(lic["key"], lic)
+        self._by_email_project.setdefault((lic["email"], lic["project"]), lic)
+        self._search_index = None
+
+    def _refresh(self):
+        """Recharger le fichier uniquement si sa signature a changé"""
+        signature = file_signature(self.path)
+        if signature == self._signature:
+            return
+        if signature is None:
+            self._licenses = []
+        else:
+            with open(self.path, "r") as f:
+                self._licenses = json.load(f)
+        self._reindex()
+        self._signature = signature
+
+    def _persist(self):
+        write_json_atomic(self.path, self._licenses)
+        self._signature = file_signature(self.path)
+
+    def get(self, key):
+        """Licence pour une clé donnée (copie), ou None"""
+        with self._lock:
+            self._refresh()
+            lic = self._by_key.get(key)
+            return dict(lic) if lic is not None else None
+
+    def find_by_email_project(self, email, project):
+        """Licence existante pour ce client et ce projet (copie), ou None"""
+        with self._lock:
+            self._refresh()
+            lic = self._by_email_project.get((email, project))
+            return dict(lic) if lic is not None else None
+
+    def all(self):
+        """Toutes les licences (copies), dans l'ordre du fichier"""
+        with self._lock:
+            self._refresh()
+            return [dict(lic) for lic in self._licenses]
+
+    def iter_all(self):
+        """Parcourir les licences une par une (copies faites au fil de l'itération)"""
+        with self._lock:
+            self._refresh()
+            licenses = list(self._licenses)
+        for lic in licenses:
+            yield dict(lic)
+
+    def page(self, query="", sort="created_at", descending=False, cursor=None, limit=50):
+        """Page de licences filtrée et triée (copies) et curseur de la page suivante"""
+        with self._lock:
+            self._refresh()
+            if self._search_index is None:
+                self._search_index = LicenseSearchIndex(self._licenses)
+            return self._search_index.page(query, sort, descending, cursor, limit)
+
+    def exists(self):
+        with self._lock:
+            self._refresh()
+            return self._signature is not None
+
+    def add(self, license_data):
+        with self._lock:
+            self._refresh()
+            lic = dict(license_data)
+            self._licenses.append(lic)
+            self._index(lic)
+            self._persist()
+
+    def update(self, key, update):
+        """Mettre à jour les champs d'une licence ; retourne False si la clé est inconnue"""
+        with self._lock:
+            self._refresh()
+            if key not in self._by_key:
+                return False
+            for lic in self._licenses:
+                if lic["key"] == key:
+                    lic.update(update)
+            self._reindex()
+            self._persist()
+            return True
+
+    def update_many(self, updates):
+        """Mettre à jour plusieurs licences ({clé: champs}) en une seule écriture ; retourne les clés modifiées"""
+        with self._lock:
+            self._refresh()
+            updated = [key for key in updates if key in self._by_key]
+            if not updated:
+                return []
+            for lic in self._licenses:
+                if lic["key"] in updates:
+                    lic.update(updates[lic["key"]])
+            self._reindex()
+            self._persist()
+            return updated
+
+    def update_by_email_project(self, email, project, updater):
+        """Appliquer updater(lic) à chaque licence de ce client/projet ; retourne les licences modifiées"""
+        with self._lock:
+            self._refresh()
+            if (email, project) not in self._by_email_project:
+                return []
+            updated = []
+            for lic in self._licenses:
+                if lic["email"] == email and lic["project"] == project:
+                    updater(lic)
+                    updated.append(dict(lic))
+            self._reindex()
+            self._persist()
+            return updated
+
+    def delete(self, key):
+        with self._lock:
+            self._refresh()
+            self._licenses = [lic for lic in self._licenses if lic["key"] != key]
+            self._reindex()
+            self._persist()
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request, HTTPException, Form
+from fastapi import FastAPI, Request, HTTPException, Form, Query
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -7,17 +7,40 @@ from datetime import datetime, timedelta
 import uuid, json, os
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from storage import get_storage
+from key_manager import get_key_manager, get_license_signer, get_license_verifier, RSA_PKCS1V15
+from leases import issue_lease, lease_hours_for, verify_lease
+from idempotency import install_idempotency
+from rate_limit import install_rate_limit, rules_limits
+from http_cache import bodies, conditional_response, read_file, LICENSE_CACHE_CONTROL, PUBLIC_KEY_CACHE_CONTROL
+from license_store import file_signature, write_json_atomic
+from rules_history import RulesHistory
+from exports import export_response, license_rows, LICENSE_FIELDS
 
 app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# Rejeux (Idempotency-Key) : réponse enregistrée, pas de licence en double
+install_idempotency(app, {"/api/licenses/generate-from-client"})
+
+DATA_DIR = "data"
 LICENSE_FILE = "data/licenses.json"
 RULES_FILE = "data/rules.json"
-RULES_HISTORY = "data/rules_history.json"
+RULES_HISTORY = "data/rules_history.json"  # Ancien format (copies complètes), converti au premier accès
+RULES_HISTORY_LOG = "data/rules_history.jsonl"
 LOG_FILE = "data/activations.log"
 KEYS_DIR = "data/keys"
 
+# Limites de security dans rules.json (par IP et par clé de licence), relues à chaque modification
+install_rate_limit(app, {"/verify"}, rules_limits(RULES_FILE))
+
+storage = get_storage(DATA_DIR)
+rules_history = RulesHistory(RULES_HISTORY_LOG, legacy_path=RULES_HISTORY)
+key_manager = get_key_manager(os.path.join(KEYS_DIR, "private.pem"), os.path.join(KEYS_DIR, "public.pem"))
+license_signer = get_license_signer(key_manager.private_path, key_manager.public_path)
+license_verifier = get_license_verifier(key_manager.private_path, key_manager.public_path)
+
 # Utils
 
 def load_rules():
@@ -25,91 +48,48 @@ def load_rules():
         return json.load(f)
 
 def save_rules(data):
-    if os.path.exists(RULES_HISTORY):
-        with open(RULES_HISTORY, "r") as f:
-            history = json.load(f)
-    else:
-        history = []
-    history.append({"timestamp": datetime.now().isoformat(), "rules": data})
-    with open(RULES_HISTORY, "w") as f:
-        json.dump(history, f, indent=2)
-    with open(RULES_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    # Une ligne de changements ajoutée à l'historique, quelle que soit sa taille
+    rules_history.append(data)
+    write_json_atomic(RULES_FILE, data)
 
 def save_license(license_data):
-    if os.path.exists(LICENSE_FILE):
-        with open(LICENSE_FILE, "r") as f:
-            data = json.load(f)
-    else:
-        data = []
-    data.append(license_data)
-    with open(LICENSE_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    storage.add_license(license_data)
 
 def find_license_by_key(key):
-    if not os.path.exists(LICENSE_FILE):
-        return None
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-    for lic in licenses:
-        if lic["key"] == key:
-            return lic
-    return None
+    return storage.get_license(key)
 
 def update_license(key, update):
-    with open(LICENSE_FILE, "r") as f:
-        data = json.load(f)
-    for lic in data:
-        if lic["key"] == key:
-            lic.update(update)
-    with open(LICENSE_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    storage.update_license(key, update)
 
 def log_activation(entry):
     with open(LOG_FILE, "a") as f:
         f.write(json.dumps(entry) + "\n")
 
+# (signature de rules.json, projet -> algorithme), remplacé d'un bloc quand le fichier change
+_signature_algs = (None, {})
+
+def signature_alg_for(project):
+    """Algorithme de signature du projet (champ signature_alg de rules.json, RSA par défaut)"""
+    global _signature_algs
+    version = file_signature(RULES_FILE)
+    if version != _signature_algs[0]:
+        # Premier projet retenu en cas de doublon d'identifiant
+        projects = reversed(load_rules()["projects"])
+        _signature_algs = (version, {p["id"]: p.get("signature_alg", RSA_PKCS1V15) for p in projects})
+    return _signature_algs[1].get(project, RSA_PKCS1V15)
+
 def sign_license(data):
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-
-    # Génération de la paire si absente (PyCA cryptography)
-    if not os.path.exists(privkey_path) or not os.path.exists(pubkey_path):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-
-        with open(privkey_path, "wb") as f:
-            f.write(
-                private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.PKCS8,
-                    encryption_algorithm=serialization.NoEncryption(),
-                )
-            )
-        with open(pubkey_path, "wb") as f:
-            f.write(
-                public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PublicFormat.SubjectPublicKeyInfo,
-                )
-            )
-    else:
-        with open(privkey_path, "rb") as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-
-    # Signature RSA-PKCS1v1.5 + SHA256 sur un JSON CANONIQUE (stable)
+    alg = signature_alg_for(data["project"])
+
+    # Signature (RSA-PKCS1v1.5 + SHA256 ou Ed25519) sur un JSON CANONIQUE (stable)
+    # avec la clé en cache, générée si absente (PyCA cryptography)
     payload = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
-    signature = private_key.sign(
-        payload,
-        padding.PKCS1v15(),
-        hashes.SHA256()
-    )
+    signature = license_signer.sign(payload, alg)
 
     signed_data = {
         "license": data,
         "signature": signature.hex(),   # on garde hex pour compat client (Node/Python)
-        "alg": "RSA-PKCS1v1.5-SHA256"
+        "alg": alg
     }
     path = f"data/licenses/{data['key']}.signed.json"
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -201,46 +181,8 @@ def generate_license_from_client(request: Request, data: dict):
 
     save_license(license_data)
 
-    # Génération ou chargement des clés RSA avec cryptography
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-    if not os.path.exists(privkey_path) or not os.path.exists(pubkey_path):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-        with open(privkey_path, "wb") as f:
-            f.write(private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-        with open(pubkey_path, "wb") as f:
-            f.write(public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ))
-    else:
-        with open(privkey_path, "rb") as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-
-    # Signature du JSON canonique avec RSA SHA256
-    payload = json.dumps(license_data, sort_keys=True, separators=(",", ":")).encode()
-    signature = private_key.sign(
-        payload,
-        padding.PKCS1v15(),
-        hashes.SHA256()
-    )
-
-    signed_data = {
-        "license": license_data,
-        "signature": signature.hex(),
-        "alg": "RSA-PKCS1v1.5-SHA256"
-    }
-
-    path = f"data/licenses/{key}.signed.json"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        json.dump(signed_data, f, indent=2)
+    # Signature du JSON canonique avec la clé privée en cache
+    path = sign_license(license_data)
 
     return FileResponse(path, filename=f"{key}.signed.json", media_type="application/json")
 
@@ -251,17 +193,12 @@ from cryptography.hazmat.primitives.asymmetric import padding
 
 
 def _verify_signed_license_file(filepath: str) -> bool:
-    """Return True if the signed license JSON verifies with public.pem (RSA PKCS1v1.5 SHA256)."""
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    if not os.path.exists(pubkey_path):
+    """Return True if the signed license JSON verifies with the cached public key of its alg (RSA PKCS1v1.5 SHA256 or Ed25519)."""
+    if key_manager.public_key() is None and not license_signer.ed25519_manager.has_keys():
         raise HTTPException(404, "Clé publique introuvable. Générez-la depuis /admin/keys.")
     if not os.path.exists(filepath):
         raise HTTPException(404, "Fichier de licence signé introuvable.")
 
-    # Load public key
-    with open(pubkey_path, "rb") as f:
-        public_key = serialization.load_pem_public_key(f.read())
-
     # Load signed JSON
     with open(filepath, "r") as f:
         signed = json.load(f)
@@ -269,21 +206,15 @@ def _verify_signed_license_file(filepath: str) -> bool:
     if not isinstance(signed, dict) or "license" not in signed or "signature" not in signed:
         raise HTTPException(400, "Format de licence invalide.")
 
-    # Rebuild the exact payload the server signed (same json.dumps default settings)
-    payload = json.dumps(signed["license"]).encode()
-    signature = bytes.fromhex(signed["signature"])
-
+    # Rebuild the exact payload the server signed (canonical JSON, see sign_license)
+    payload = json.dumps(signed["license"], sort_keys=True, separators=(",", ":")).encode()
     try:
-        public_key.verify(
-            signature,
-            payload,
-            padding.PKCS1v15(),
-            hashes.SHA256(),
-        )
-        return True
-    except Exception:
+        signature = bytes.fromhex(signed["signature"])
+    except ValueError:
         return False
 
+    return license_verifier.verify(payload, signature, signed.get("alg", RSA_PKCS1V15))
+
 
 @app.get("/verify-signature")
 def verify_signature(key: str):
@@ -296,11 +227,17 @@ def verify_signature(key: str):
     return {"key": key, "valid_signature": ok}
 
 @app.get("/download-license")
-def download_license(key: str):
+def download_license(key: str, request: Request):
     path = f"data/licenses/{key}.signed.json"
-    if not os.path.exists(path):
+    version = file_signature(path)
+    if version is None:
         raise HTTPException(404, "Fichier introuvable")
-    return FileResponse(path, filename=f"{key}.signed.json", media_type="application/json")
+    # ETag calculé une fois par version du fichier signé ; 304 si le client l'a déjà
+    content, etag = bodies.get(f"license:{path}", version, lambda: read_file(path))
+    return conditional_response(
+        request, content, etag, "application/json", LICENSE_CACHE_CONTROL,
+        {"Content-Disposition": f'attachment; filename="{key}.signed.json"'}
+    )
 
 # Formulaire de génération des règles
 @app.get("/admin/rules", response_class=HTMLResponse)
@@ -356,36 +293,52 @@ def reset_rules():
     return RedirectResponse("/admin/rules", status_code=303)
 
 @app.get("/admin/rules/history", response_class=HTMLResponse)
-def show_rules_history(request: Request):
-    if not os.path.exists(RULES_HISTORY):
-        return templates.TemplateResponse("rules_history.html", {"request": request, "history": []})
-    with open(RULES_HISTORY, "r") as f:
-        history = json.load(f)
-    return templates.TemplateResponse("rules_history.html", {"request": request, "history": history})
+def show_rules_history(request: Request, cursor: int = None, limit: int = 20):
+    # Page de l'historique (plus récentes d'abord) : seules les lignes de la page sont lues
+    history, next_cursor, total = rules_history.page(cursor, max(1, min(limit, 200)))
+    return templates.TemplateResponse("rules_history.html", {
+        "request": request, "history": history, "next_cursor": next_cursor, "total": total,
+    })
+
+@app.get("/api/admin/rules/history")
+def rules_history_page(cursor: int = None, limit: int = 20):
+    history, next_cursor, total = rules_history.page(cursor, max(1, min(limit, 200)))
+    return {"history": history, "next_cursor": next_cursor, "total": total}
+
+@app.get("/api/admin/rules/at")
+def rules_at(timestamp: str = None, version: int = None):
+    """Règles en vigueur à une date (ISO) ou à une version de l'historique"""
+    found = rules_history.rules_at(timestamp, version)
+    if found is None:
+        raise HTTPException(404, "Aucune version des règles à cette date")
+    return {"version": found[0], "rules": found[1]}
  
  
 # Page d'administration des licences avec recherche et suppression
 @app.get("/admin/licenses", response_class=HTMLResponse)
-def admin_licenses(request: Request, q: str = ""):
-    if not os.path.exists(LICENSE_FILE):
-        licenses = []
-    else:
-        with open(LICENSE_FILE, "r") as f:
-            licenses = json.load(f)
-    if q:
-        q = q.lower()
-        licenses = [lic for lic in licenses if q in lic["email"].lower() or q in lic["project"].lower() or q in lic["key"].lower()]
-    return templates.TemplateResponse("licenses_admin.html", {"request": request, "licenses": licenses, "query": q})
+def admin_licenses(request: Request, q: str = "", sort: str = "created_at", order: str = "asc",
+                   cursor: str = None, limit: int = 50):
+    # Recherche indexée (clé, email, projet), tri et pagination par curseur
+    limit = max(1, min(limit, 200))
+    try:
+        licenses, next_cursor = storage.search_licenses(q, sort, order == "desc", cursor, limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return templates.TemplateResponse("licenses_admin.html", {
+        "request": request,
+        "licenses": licenses,
+        "query": q,
+        "sort": sort,
+        "order": order,
+        "limit": limit,
+        "next_cursor": next_cursor
+    })
 
 @app.post("/admin/licenses/delete")
 def delete_license(key: str = Form(...)):
-    if not os.path.exists(LICENSE_FILE):
+    if not storage.has_licenses():
         raise HTTPException(404, "Aucune licence")
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-    updated = [lic for lic in licenses if lic["key"] != key]
-    with open(LICENSE_FILE, "w") as f:
-        json.dump(updated, f, indent=2)
+    storage.delete_license(key)
     # Supprimer le fichier signé si existant
     signed_path = f"data/licenses/{key}.signed.json"
     if os.path.exists(signed_path):
@@ -393,34 +346,32 @@ def delete_license(key: str = Form(...)):
     return RedirectResponse("/admin/licenses", status_code=303)
 
 @app.get("/admin/licenses/export")
-def export_licenses_csv():
-    import csv
-    from io import StringIO
-
-    if not os.path.exists(LICENSE_FILE):
+def export_licenses_csv(format: str = "csv", project: str = None,
+                        date_from: str = Query(None, alias="from"), date_to: str = Query(None, alias="to")):
+    """Export des licences en flux (CSV ou NDJSON), filtrable par projet et date de création"""
+    if not storage.has_licenses():
         raise HTTPException(404, "Aucune licence")
 
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=["key", "email", "project", "version", "status", "activations", "max_activations", "expires_at"])
-    writer.writeheader()
-    for lic in licenses:
-        writer.writerow({
-            "key": lic["key"],
-            "email": lic["email"],
-            "project": lic["project"],
-            "version": lic.get("version", ""),
-            "status": lic["status"],
-            "activations": lic["activations"],
-            "max_activations": lic["max_activations"],
-            "expires_at": lic["expires_at"]
-        })
+    def rows():
+        for lic in license_rows(storage, project, date_from, date_to):
+            if format != "csv":
+                yield lic
+                continue
+            yield {
+                "key": lic["key"],
+                "email": lic["email"],
+                "project": lic["project"],
+                "version": lic.get("version", ""),
+                "status": lic["status"],
+                "activations": lic["activations"],
+                "max_activations": lic["max_activations"],
+                "expires_at": lic["expires_at"]
+            }
 
-    response = HTMLResponse(content=output.getvalue(), media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=licenses.csv"
-    return response
+    try:
+        return export_response(rows(), format, LICENSE_FIELDS, "licenses")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, PlainTextResponse
 
@@ -431,39 +382,23 @@ def show_keygen_form(request: Request):
 
 @app.post("/admin/keys")
 def generate_keypair_safe():
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    if os.path.exists(pubkey_path) or os.path.exists(privkey_path):
+    if key_manager.has_any_key():
         raise HTTPException(400, "❗ Clé déjà générée. Utilisez /admin/keys/force pour forcer.")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-    public_key = private_key.public_key()
-
-    with open(privkey_path, "wb") as f:
-        f.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
-    with open(pubkey_path, "wb") as f:
-        f.write(
-            public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo,
-            )
-        )
+    key_manager.generate()
     return RedirectResponse("/admin/keys", status_code=303)
 
 
 @app.get("/admin/keys/download")
-def download_public_key():
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    if not os.path.exists(pubkey_path):
+def download_public_key(request: Request, alg: str = RSA_PKCS1V15):
+    manager = license_signer.manager_for(alg)
+    version = file_signature(manager.public_path)
+    if version is None:
         raise HTTPException(404, "Clé publique introuvable")
-    return FileResponse(pubkey_path, filename="public.pem", media_type="application/x-pem-file")
+    content, etag = bodies.get(f"public-key:{manager.public_path}", version, manager.public_pem)
+    return conditional_response(
+        request, content, etag, "application/x-pem-file", PUBLIC_KEY_CACHE_CONTROL,
+        {"Content-Disposition": f'attachment; filename="{os.path.basename(manager.public_path)}"'}
+    )
 
 @app.get("/admin/keys/preview", response_class=PlainTextResponse)
 def preview_public_key():
@@ -475,28 +410,8 @@ def preview_public_key():
 
 @app.post("/admin/keys/force")
 def generate_keypair_force():
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-    public_key = private_key.public_key()
-
-    with open(privkey_path, "wb") as f:
-        f.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
-    with open(pubkey_path, "wb") as f:
-        f.write(
-            public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo,
-            )
-        )
+    # Rotation : les nouvelles clés remplacent immédiatement celles en cache
+    license_signer.rotate()
     return RedirectResponse("/admin/keys", status_code=303)
 
     
@@ -532,6 +447,8 @@ class VerifyRequest(BaseModel):
     key: str
     device_id: str
     version: str
+    lease: bool = False           # demander un bail signé vérifiable hors ligne
+    previous_lease: dict = None   # bail précédent, pour un renouvellement
 
 @app.post("/verify")
 def verify_license(payload: VerifyRequest, request: Request):
@@ -545,11 +462,17 @@ def verify_license(payload: VerifyRequest, request: Request):
         raise HTTPException(403, "Version non autorisée")
     if rules["activation_rules"]["check_expiration"] and datetime.now() > datetime.fromisoformat(lic["expires_at"]):
         raise HTTPException(403, "Licence expirée")
-    if lic["activations"] >= lic["max_activations"]:
-        raise HTTPException(403, "Limite d'activation atteinte")
 
-    lic["activations"] += 1
-    update_license(payload.key, {"activations": lic["activations"]})
+    # Renouvellement d'un bail : la machine est déjà comptée, pas de réécriture des licences
+    renewal = payload.previous_lease is not None and verify_lease(
+        license_verifier, payload.previous_lease, payload.key, payload.device_id
+    )
+    if not renewal:
+        if lic["activations"] >= lic["max_activations"]:
+            raise HTTPException(403, "Limite d'activation atteinte")
+
+        lic["activations"] += 1
+        update_license(payload.key, {"activations": lic["activations"]})
 
     if rules["activation_rules"]["track_ip_address"]:
         log_activation({
@@ -559,4 +482,9 @@ def verify_license(payload: VerifyRequest, request: Request):
             "timestamp": datetime.now().isoformat()
         })
 
-    return {"status": "valid", "project": lic["project"], "expires_at": lic["expires_at"]}
+    response = {"status": "valid", "project": lic["project"], "expires_at": lic["expires_at"]}
+    if payload.lease:
+        hours = lease_hours_for(rules, lic["project"])
+        response["lease"] = issue_lease(license_signer, lic, payload.device_id, hours, signature_alg_for(lic["project"]))
+        response["renewed"] = renewal
+    return response
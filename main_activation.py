@@ -19,7 +19,17 @@ import hmac
 import base64
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+import asyncio
 import logging
+from storage import get_storage
+from executors import run_io, run_crypto
+from idempotency import install_idempotency
+from rate_limit import install_rate_limit, rules_limits, rules_security
+from api_tokens import ApiTokenStore, check_token_project, install_api_token_auth
+from http_cache import bodies, conditional_response, METADATA_CACHE_CONTROL, PUBLIC_KEY_CACHE_CONTROL
+from license_store import file_signature
+from software_registry import SoftwareRegistry
+from key_manager import get_key_manager, get_license_signer, get_license_verifier, ED25519, RSA_PSS
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +42,22 @@ app = FastAPI(
     version="3.0.0"
 )
 
+# Rejeux (Idempotency-Key) : réponse enregistrée, sans nouvelle signature ni écriture
+install_idempotency(app, {"/api/activate", "/api/download-license"})
+
+# Section security de rules.json : tokens d'API des clients et limites de débit
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rules.json")
+api_tokens = ApiTokenStore(os.path.join(os.path.dirname(RULES_FILE), "api_tokens.json"))
+install_api_token_auth(
+    app,
+    {"/api/activate", "/api/verify-license", "/api/start-license", "/api/download-license", "/api/register-activation"},
+    api_tokens,
+    rules_security(RULES_FILE),
+)
+
+# Limites par IP et par code ; ajoutées avant CORS pour que les 401 / 429 en portent les en-têtes
+install_rate_limit(app, {"/api/activate", "/api/download-license"}, rules_limits(RULES_FILE))
+
 # CORS pour permettre les requêtes depuis l'application locale
 app.add_middleware(
     CORSMiddleware,
@@ -53,6 +79,23 @@ ACTIVATION_CODES_FILE = os.path.join(DATA_DIR, "activation_codes.json")
 PUBLIC_KEY_FILE = os.path.join(DATA_DIR, "public.pem")
 PRIVATE_KEY_FILE = os.path.join(DATA_DIR, "private.pem")
 
+storage = get_storage(DATA_DIR)
+
+# Configurations des logiciels fusionnées au démarrage, rechargées quand un fichier change
+software_registry = SoftwareRegistry(DATA_DIR, "software_configs.json", project_files=True, default_file="required_email.json")
+software_registry.refresh()
+
+key_manager = get_key_manager(PRIVATE_KEY_FILE, PUBLIC_KEY_FILE)
+license_signer = get_license_signer(PRIVATE_KEY_FILE, PUBLIC_KEY_FILE)
+license_verifier = get_license_verifier(PRIVATE_KEY_FILE, PUBLIC_KEY_FILE)
+
+# Verrou des séquences lecture-vérification-écriture sur les codes d'activation, propre au processus
+# (les accès au stockage se font dans le pool I/O, hors de la boucle d'événements).
+# La limite de postes ne dépend pas de ce verrou : comptage et ajout de l'activation sont
+# atomiques dans le stockage (verrou exclusif du journal JSON, transaction SQLite).
+# Les compteurs des codes (used_count, machines) ne sont en revanche sérialisés que dans le processus
+code_lock = asyncio.Lock()
+
 # Templates
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
@@ -101,113 +144,110 @@ def load_required_email():
 
 def load_software_config(project_name):
     """Charger la configuration pour un logiciel spécifique"""
-    # Essayer d'abord le fichier spécifique au projet
-    specific_file = os.path.join(DATA_DIR, f"required_email_{project_name.lower()}.json")
+    # Fichier du projet, fichier multi-logiciels, puis required_email.json (registre en mémoire)
+    config = software_registry.get(project_name)
+    if config is not None:
+        return config
     
-    if os.path.exists(specific_file):
-        with open(specific_file, 'r') as f:
-            return json.load(f)
+    # Configuration par défaut
+    default_config = {
+        "required_email": "user@company.com",
+        "company_name": "Default Company",
+        "max_activations": 4,
+        "license_duration_days": 365,
+        "project": project_name,
+        "description": f"Configuration par défaut pour {project_name}"
+    }
     
-    # Essayer le fichier de configurations multiples
-    softwares_file = os.path.join(DATA_DIR, "software_configs.json")
-    if os.path.exists(softwares_file):
-        with open(softwares_file, 'r') as f:
-            configs = json.load(f)
-            if project_name in configs:
-                return configs[project_name]
+    # Sauvegarder la configuration par défaut
+    os.makedirs(DATA_DIR, exist_ok=True)
+    specific_file = os.path.join(DATA_DIR, f"required_email_{project_name.lower()}.json")
+    with open(specific_file, 'w') as f:
+        json.dump(default_config, f, indent=2)
+    software_registry.refresh(force=True)
     
-    # Fallback sur la configuration par défaut
-    try:
-        with open(REQUIRED_EMAIL_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        # Configuration par défaut
-        default_config = {
-            "required_email": "user@company.com",
-            "company_name": "Default Company",
-            "max_activations": 4,
-            "license_duration_days": 365,
-            "project": project_name,
-            "description": f"Configuration par défaut pour {project_name}"
-        }
-        
-        # Sauvegarder la configuration par défaut
-        os.makedirs(DATA_DIR, exist_ok=True)
-        with open(specific_file, 'w') as f:
-            json.dump(default_config, f, indent=2)
-        
-        return default_config
+    return default_config
 
 def get_all_software_configs():
     """Récupérer toutes les configurations de logiciels"""
-    configs = {}
+    return software_registry.all()
+
+def build_softwares_body():
+    """Corps JSON de /api/softwares"""
+    configs = get_all_software_configs()
+    
+    # Retourner une version simplifiée pour la sécurité
+    simplified_configs = {}
+    for project, config in configs.items():
+        simplified_configs[project] = {
+            "project": config.get("project", project),
+            "description": config.get("description", f"Logiciel {project}"),
+            "max_activations": config.get("max_activations", 4),
+            "license_duration_days": config.get("license_duration_days", 365),
+            "company_name": config.get("company_name", "Enterprise")
+        }
     
-    # Charger depuis le fichier multi-logiciels
-    softwares_file = os.path.join(DATA_DIR, "software_configs.json")
-    if os.path.exists(softwares_file):
-        with open(softwares_file, 'r') as f:
-            configs.update(json.load(f))
+    return json.dumps({
+        "softwares": simplified_configs,
+        "count": len(simplified_configs)
+    }).encode()
+
+def softwares_body():
+    """(corps, etag) de /api/softwares, reconstruit seulement si une configuration a changé"""
+    return bodies.get("softwares", software_registry.version(), build_softwares_body)
+
+def public_key_body(alg):
+    """(corps, etag) de /api/public-key pour cet algorithme, reconstruit à la rotation des clés"""
+    manager = license_signer.manager_for(alg)
+    if not os.path.exists(manager.public_path):
+        # Générer les clés si elles n'existent pas
+        manager.generate()
     
-    # Charger depuis les fichiers individuels
-    if os.path.exists(DATA_DIR):
-        for filename in os.listdir(DATA_DIR):
-            if filename.startswith("required_email_") and filename.endswith(".json"):
-                project_name = filename[15:-5]  # Enlever "required_email_" et ".json"
-                file_path = os.path.join(DATA_DIR, filename)
-                
-                try:
-                    with open(file_path, 'r') as f:
-                        config = json.load(f)
-                        # Utiliser le nom du projet depuis le fichier ou déduire du nom de fichier
-                        project_key = config.get('project', project_name.title())
-                        configs[project_key] = config
-                except Exception as e:
-                    logger.warning(f"Erreur lecture config {filename}: {e}")
+    algorithm = ED25519 if alg == ED25519 else RSA_PSS
     
-    return configs
+    def build():
+        return json.dumps({
+            "success": True,
+            "public_key": manager.public_pem().decode(),
+            "algorithm": algorithm
+        }).encode()
+    
+    return bodies.get(f"api-public-key:{algorithm}", file_signature(manager.public_path), build)
 
 def load_activation_codes():
     """Charger les codes d'activation"""
-    try:
-        with open(ACTIVATION_CODES_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return storage.load_codes()
+
+def get_activation_code(code):
+    """Charger un code d'activation, ou None s'il n'existe pas"""
+    return storage.get_code(code)
 
-def save_activation_codes(codes):
-    """Sauvegarder les codes d'activation"""
-    with open(ACTIVATION_CODES_FILE, 'w') as f:
-        json.dump(codes, f, indent=2)
+def save_activation_code(code, info):
+    """Sauvegarder un code d'activation (mise à jour d'une seule entrée)"""
+    storage.save_code(code, info)
 
 def load_activations():
     """Charger les activations existantes"""
-    try:
-        with open(ACTIVATIONS_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
-
-def save_activation(activation_data):
-    """Sauvegarder une nouvelle activation"""
-    activations = load_activations()
+    return storage.list_activations()
+
+def count_active_activations(code):
+    """Nombre d'activations actives pour un code (compteur maintenu par le stockage)"""
+    return storage.count_active_activations(code)
+
+def save_activation_if_available(activation_data, max_activations):
+    """Sauvegarder une nouvelle activation si le code a encore un poste libre
+    (comptage et ajout atomiques dans le stockage, y compris entre workers) ;
+    retourne (sauvegardée ?, activations actives avant l'ajout)"""
     activation_data['activated_at'] = datetime.now().isoformat()
     activation_data['id'] = str(uuid.uuid4())
-    activations.append(activation_data)
-    
-    with open(ACTIVATIONS_FILE, 'w') as f:
-        json.dump(activations, f, indent=2)
-    
-    logger.info(f"Nouvelle activation sauvegardée: {activation_data['activation_code']}")
+    added, active_count = storage.add_activation_if_available(activation_data, max_activations)
+    if added:
+        logger.info(f"Nouvelle activation sauvegardée: {activation_data['activation_code']}")
+    return added, active_count
 
 def verify_license_signature(license_data):
     """Vérifier la signature de la licence"""
     try:
-        if not os.path.exists(PUBLIC_KEY_FILE):
-            return False
-            
-        with open(PUBLIC_KEY_FILE, 'rb') as f:
-            public_key = serialization.load_pem_public_key(f.read())
-        
         # Extraire la signature et les données
         if 'signature' not in license_data or 'data' not in license_data:
             return False
@@ -215,17 +255,8 @@ def verify_license_signature(license_data):
         signature = base64.b64decode(license_data['signature'])
         data_to_verify = json.dumps(license_data['data'], sort_keys=True).encode()
         
-        # Vérifier la signature
-        public_key.verify(
-            signature,
-            data_to_verify,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
-        return True
+        # Vérifier la signature avec la clé publique en cache de l'algorithme annoncé
+        return license_verifier.verify(data_to_verify, signature, license_data.get('alg', RSA_PSS))
         
     except Exception as e:
         logger.error(f"Erreur vérification signature: {e}")
@@ -253,8 +284,8 @@ ensure_data_files()
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
     """Page d'accueil avec informations sur le serveur"""
-    configs = get_all_software_configs()
-    main_config = load_required_email()  # Configuration par défaut
+    configs = await run_io(get_all_software_configs)
+    main_config = await run_io(load_required_email)  # Configuration par défaut
     
     return templates.TemplateResponse("activation_home.html", {
         "request": request,
@@ -264,25 +295,10 @@ async def home(request: Request):
     })
 
 @app.get("/api/softwares")
-async def get_supported_softwares():
-    """Obtenir la liste des logiciels supportés"""
-    configs = get_all_software_configs()
-    
-    # Retourner une version simplifiée pour la sécurité
-    simplified_configs = {}
-    for project, config in configs.items():
-        simplified_configs[project] = {
-            "project": config.get("project", project),
-            "description": config.get("description", f"Logiciel {project}"),
-            "max_activations": config.get("max_activations", 4),
-            "license_duration_days": config.get("license_duration_days", 365),
-            "company_name": config.get("company_name", "Enterprise")
-        }
-    
-    return {
-        "softwares": simplified_configs,
-        "count": len(simplified_configs)
-    }
+async def get_supported_softwares(request: Request):
+    """Obtenir la liste des logiciels supportés (ETag, 304 si inchangée)"""
+    content, etag = await run_io(softwares_body)
+    return conditional_response(request, content, etag, "application/json", METADATA_CACHE_CONTROL)
 
 @app.get("/health")
 async def health_check():
@@ -316,89 +332,82 @@ async def activate_license(
             )
         
         # Vérifier la signature de la licence
-        if not verify_license_signature(license_json):
+        if not await run_crypto(verify_license_signature, license_json):
             raise HTTPException(
                 status_code=400,
                 detail="Signature de licence invalide"
             )
         
-        # Charger et vérifier le code d'activation
-        activation_codes = load_activation_codes()
-        
-        if activationCode not in activation_codes:
-            raise HTTPException(
-                status_code=400,
-                detail="Code d'activation non reconnu"
-            )
-        
-        code_info = activation_codes[activationCode]
+        async with code_lock:
+            # Charger et vérifier le code d'activation
+            code_info = await run_io(get_activation_code, activationCode)
         
-        # Vérifier si le code a déjà été utilisé
-        if code_info.get('used', False):
-            raise HTTPException(
-                status_code=400,
-                detail="Ce code d'activation a déjà été utilisé"
-            )
-        
-        # Vérifier l'expiration du code
-        if 'expires_at' in code_info:
-            expires_at = datetime.fromisoformat(code_info['expires_at'])
-            if datetime.now() > expires_at:
+            if code_info is None:
                 raise HTTPException(
                     status_code=400,
-                    detail="Code d'activation expiré"
+                    detail="Code d'activation non reconnu"
                 )
         
-        # Déterminer le projet depuis les données de licence
-        license_email = license_json.get('data', {}).get('email', '')
-        license_project = license_json.get('data', {}).get('project', 'MostaGare')
+            # Vérifier si le code a déjà été utilisé
+            if code_info.get('used', False):
+                raise HTTPException(
+                    status_code=400,
+                    detail="Ce code d'activation a déjà été utilisé"
+                )
         
-        # Charger la configuration pour ce projet spécifique
-        required_config = load_software_config(license_project)
+            # Vérifier l'expiration du code
+            if 'expires_at' in code_info:
+                expires_at = datetime.fromisoformat(code_info['expires_at'])
+                if datetime.now() > expires_at:
+                    raise HTTPException(
+                        status_code=400,
+                        detail="Code d'activation expiré"
+                    )
         
-        # Vérifier l'email de la licence contre l'email requis pour ce projet
-        if license_email != required_config.get('required_email', ''):
-            raise HTTPException(
-                status_code=403,
-                detail=f"Email de licence non autorisé pour {license_project}. Email requis: {required_config.get('required_email')}"
-            )
+            # Déterminer le projet depuis les données de licence
+            license_email = license_json.get('data', {}).get('email', '')
+            license_project = license_json.get('data', {}).get('project', 'MostaGare')
+            check_token_project(request, license_project)
+            check_token_project(request, code_info.get('project', 'MostaGare'))
         
-        # Générer l'ID machine
-        machine_id = get_machine_id_from_request(request)
+            # Charger la configuration pour ce projet spécifique
+            required_config = await run_io(load_software_config, license_project)
         
-        # Vérifier le nombre d'activations existantes
-        activations = load_activations()
-        active_activations = [
-            a for a in activations 
-            if a.get('activation_code') == activationCode and a.get('status') == 'active'
-        ]
+            # Vérifier l'email de la licence contre l'email requis pour ce projet
+            if license_email != required_config.get('required_email', ''):
+                raise HTTPException(
+                    status_code=403,
+                    detail=f"Email de licence non autorisé pour {license_project}. Email requis: {required_config.get('required_email')}"
+                )
         
-        max_activations = code_info.get('max_activations', required_config.get('max_activations', 4))
+            # Générer l'ID machine
+            machine_id = get_machine_id_from_request(request)
         
-        if len(active_activations) >= max_activations:
-            raise HTTPException(
-                status_code=403,
-                detail=f"Nombre maximum d'activations atteint ({max_activations})"
-            )
+            max_activations = code_info.get('max_activations', required_config.get('max_activations', 4))
         
-        # Créer l'activation
-        activation_data = {
-            'activation_code': activationCode,
-            'machine_id': machine_id,
-            'email': license_email,
-            'license_data': license_json,
-            'status': 'active',
-            'client_ip': request.client.host,
-            'user_agent': request.headers.get('User-Agent', ''),
-        }
+            # Créer l'activation
+            activation_data = {
+                'activation_code': activationCode,
+                'machine_id': machine_id,
+                'email': license_email,
+                'license_data': license_json,
+                'status': 'active',
+                'client_ip': request.client.host,
+                'user_agent': request.headers.get('User-Agent', ''),
+            }
         
-        # Sauvegarder l'activation
-        save_activation(activation_data)
+            # Vérifier le nombre d'activations et sauvegarder en une seule opération
+            added, active_count = await run_io(save_activation_if_available, activation_data, max_activations)
+            if not added:
+                raise HTTPException(
+                    status_code=403,
+                    detail=f"Nombre maximum d'activations atteint ({max_activations})"
+                )
         
-        # Marquer le code comme utilisé
-        activation_codes[activationCode]['used'] = True
-        activation_codes[activationCode]['first_used_at'] = datetime.now().isoformat()
-        save_activation_codes(activation_codes)
+            # Marquer le code comme utilisé
+            code_info['used'] = True
+            code_info['first_used_at'] = datetime.now().isoformat()
+            await run_io(save_activation_code, activationCode, code_info)
         
         # Calculer les jours restants
         license_expires = license_json.get('data', {}).get('expires_at')
@@ -416,7 +425,7 @@ async def activate_license(
             'email': license_email,
             'project': license_json.get('data', {}).get('project', 'MostaGare'),
             'expires_at': license_expires,
-            'activations': len(active_activations) + 1,
+            'activations': active_count + 1,
             'max_activations': max_activations,
             'key': license_json.get('data', {}).get('key', activationCode[:8])
         }
@@ -438,44 +447,12 @@ async def activate_license(
         )
 
 @app.get("/api/public-key")
-async def get_public_key():
-    """Télécharger la clé publique pour vérification locale"""
+async def get_public_key(request: Request, alg: str = RSA_PSS):
+    """Télécharger la clé publique pour vérification locale (?alg=Ed25519 pour la clé Ed25519)"""
     try:
-        if not os.path.exists(PUBLIC_KEY_FILE):
-            # Générer les clés si elles n'existent pas
-            from cryptography.hazmat.primitives.asymmetric import rsa
-            from cryptography.hazmat.primitives import serialization
-            
-            private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048
-            )
-            
-            # Sauvegarder la clé privée
-            with open(PRIVATE_KEY_FILE, 'wb') as f:
-                f.write(private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.PKCS8,
-                    encryption_algorithm=serialization.NoEncryption()
-                ))
-            
-            # Sauvegarder la clé publique
-            public_key = private_key.public_key()
-            with open(PUBLIC_KEY_FILE, 'wb') as f:
-                f.write(public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PublicFormat.SubjectPublicKeyInfo
-                ))
-        
-        # Lire et retourner la clé publique
-        with open(PUBLIC_KEY_FILE, 'r') as f:
-            public_key_content = f.read()
-        
-        return {
-            "success": True,
-            "public_key": public_key_content,
-            "algorithm": "RSA-PSS-SHA256"
-        }
+        # Corps et ETag en cache jusqu'à la prochaine rotation des clés
+        content, etag = await run_crypto(public_key_body, alg)
+        return conditional_response(request, content, etag, "application/json", PUBLIC_KEY_CACHE_CONTROL)
         
     except Exception as e:
         logger.error(f"Erreur récupération clé publique: {e}")
@@ -483,6 +460,7 @@ async def get_public_key():
 
 @app.post("/api/verify-license")
 async def verify_license_only(
+    request: Request,
     activationCode: str = Form(...),
     licenseData: str = Form(None)
 ):
@@ -497,16 +475,15 @@ async def verify_license_only(
                 detail="Code d'activation invalide"
             )
         
-        # Charger les codes d'activation
-        activation_codes = load_activation_codes()
+        # Charger le code d'activation
+        code_info = await run_io(get_activation_code, activationCode)
         
-        if activationCode not in activation_codes:
+        if code_info is None:
             raise HTTPException(
                 status_code=404,
                 detail="Code d'activation non trouvé"
             )
-        
-        code_info = activation_codes[activationCode]
+        check_token_project(request, code_info.get('project', 'MostaGare'))
         
         # Vérifier l'expiration du code
         if 'expires_at' in code_info:
@@ -518,20 +495,16 @@ async def verify_license_only(
                 )
         
         # Vérifier si le code a déjà été utilisé au maximum
-        activations = load_activations()
-        active_activations = [
-            a for a in activations 
-            if a.get('activation_code') == activationCode and a.get('status') == 'active'
-        ]
+        active_count = await run_io(count_active_activations, activationCode)
         
         max_activations = code_info.get('max_activations', 4)
-        activations_remaining = max_activations - len(active_activations)
+        activations_remaining = max_activations - active_count
         
         # Si des données de licence sont fournies, vérifier la signature
         if licenseData:
             try:
                 license_json = json.loads(licenseData)
-                if not verify_license_signature(license_json):
+                if not await run_crypto(verify_license_signature, license_json):
                     raise HTTPException(
                         status_code=400,
                         detail="Signature de licence invalide"
@@ -551,7 +524,7 @@ async def verify_license_only(
                 "project": code_info.get('project', 'MostaGare'),
                 "expires_at": code_info.get('expires_at'),
                 "max_activations": max_activations,
-                "activations_used": len(active_activations),
+                "activations_used": active_count,
                 "activations_remaining": activations_remaining,
                 "already_used": code_info.get('used', False)
             },
@@ -592,66 +565,58 @@ async def start_license_counting(
             )
         
         # Vérifier la signature
-        if not verify_license_signature(license_json):
+        if not await run_crypto(verify_license_signature, license_json):
             raise HTTPException(
                 status_code=400,
                 detail="Signature de licence invalide"
             )
         
-        # Charger et vérifier le code d'activation
-        activation_codes = load_activation_codes()
-        
-        if activationCode not in activation_codes:
-            raise HTTPException(
-                status_code=404,
-                detail="Code d'activation non trouvé"
-            )
-        
-        code_info = activation_codes[activationCode]
-        
-        # Vérifier le nombre d'activations
-        activations = load_activations()
-        active_activations = [
-            a for a in activations 
-            if a.get('activation_code') == activationCode and a.get('status') == 'active'
-        ]
-        
-        max_activations = code_info.get('max_activations', 4)
-        
-        if len(active_activations) >= max_activations:
-            raise HTTPException(
-                status_code=403,
-                detail=f"Nombre maximum d'activations atteint ({max_activations})"
-            )
+        async with code_lock:
+            # Charger et vérifier le code d'activation
+            code_info = await run_io(get_activation_code, activationCode)
         
-        # Obtenir l'ID machine
-        if not machineId:
-            machineId = get_machine_id_from_request(request)
-        
-        # Créer l'activation avec timestamp de début
-        activation_data = {
-            'activation_code': activationCode,
-            'machine_id': machineId,
-            'email': license_json.get('data', {}).get('email', code_info.get('email')),
-            'license_data': license_json,
-            'status': 'active',
-            'client_ip': request.client.host,
-            'user_agent': request.headers.get('User-Agent', ''),
-            'started_at': datetime.now().isoformat(),  # Date de début du comptage
-            'activation_type': 'deferred'  # Marquer comme activation différée
-        }
+            if code_info is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Code d'activation non trouvé"
+                )
+            check_token_project(request, code_info.get('project', 'MostaGare'))
+        
+            max_activations = code_info.get('max_activations', 4)
+        
+            # Obtenir l'ID machine
+            if not machineId:
+                machineId = get_machine_id_from_request(request)
+        
+            # Créer l'activation avec timestamp de début
+            activation_data = {
+                'activation_code': activationCode,
+                'machine_id': machineId,
+                'email': license_json.get('data', {}).get('email', code_info.get('email')),
+                'license_data': license_json,
+                'status': 'active',
+                'client_ip': request.client.host,
+                'user_agent': request.headers.get('User-Agent', ''),
+                'started_at': datetime.now().isoformat(),  # Date de début du comptage
+                'activation_type': 'deferred'  # Marquer comme activation différée
+            }
         
-        # Sauvegarder l'activation
-        save_activation(activation_data)
+            # Vérifier le nombre d'activations et sauvegarder en une seule opération
+            added, active_count = await run_io(save_activation_if_available, activation_data, max_activations)
+            if not added:
+                raise HTTPException(
+                    status_code=403,
+                    detail=f"Nombre maximum d'activations atteint ({max_activations})"
+                )
         
-        # Marquer le code comme utilisé si c'est la première utilisation
-        if not code_info.get('used', False):
-            activation_codes[activationCode]['used'] = True
-            activation_codes[activationCode]['first_used_at'] = datetime.now().isoformat()
+            # Marquer le code comme utilisé si c'est la première utilisation
+            if not code_info.get('used', False):
+                code_info['used'] = True
+                code_info['first_used_at'] = datetime.now().isoformat()
         
-        # Mettre à jour la date de début de comptage
-        activation_codes[activationCode]['counting_started_at'] = datetime.now().isoformat()
-        save_activation_codes(activation_codes)
+            # Mettre à jour la date de début de comptage
+            code_info['counting_started_at'] = datetime.now().isoformat()
+            await run_io(save_activation_code, activationCode, code_info)
         
         # Calculer les jours restants depuis MAINTENANT
         license_duration = code_info.get('license_duration_days', 365)
@@ -664,7 +629,7 @@ async def start_license_counting(
                 "started_at": activation_data['started_at'],
                 "expires_at": expires_at,
                 "remaining_days": license_duration,
-                "activations_used": len(active_activations) + 1,
+                "activations_used": active_count + 1,
                 "max_activations": max_activations
             }
         }
@@ -678,13 +643,13 @@ async def start_license_counting(
 @app.get("/api/activations")
 async def get_activations():
     """Obtenir la liste des activations (pour admin)"""
-    activations = load_activations()
+    activations = await run_io(load_activations)
     return {"activations": activations, "count": len(activations)}
 
 @app.get("/admin/codes")
 async def admin_codes(request: Request):
     """Interface d'administration pour gérer les codes d'activation"""
-    codes = load_activation_codes()
+    codes = await run_io(load_activation_codes)
     return templates.TemplateResponse("admin_codes.html", {
         "request": request,
         "codes": codes
@@ -692,6 +657,7 @@ async def admin_codes(request: Request):
 
 @app.post("/api/download-license")
 async def download_license_by_code(
+    request: Request,
     activationCode: str = Form(...)
 ):
     """Télécharger une licence en utilisant seulement le code d'activation"""
@@ -703,17 +669,15 @@ async def download_license_by_code(
                 detail="Code d'activation invalide"
             )
         
-        # Charger les codes d'activation
-        activation_codes = load_activation_codes()
+        # Charger le code d'activation
+        code_info = await run_io(get_activation_code, activationCode)
         
-        if activationCode not in activation_codes:
+        if code_info is None:
             raise HTTPException(
                 status_code=404,
                 detail="Code d'activation non trouvé"
             )
         
-        code_info = activation_codes[activationCode]
-        
         # Vérifier l'expiration
         if 'expires_at' in code_info:
             expires_at = datetime.fromisoformat(code_info['expires_at'])
@@ -725,35 +689,10 @@ async def download_license_by_code(
         
         # Récupérer le projet depuis le code
         project_name = code_info.get('project', 'MostaGare')
+        check_token_project(request, project_name)
         
         # Charger la configuration du projet
-        config = load_software_config(project_name)
-        
-        # Générer les clés si elles n'existent pas
-        if not os.path.exists(PRIVATE_KEY_FILE) or not os.path.exists(PUBLIC_KEY_FILE):
-            from cryptography.hazmat.primitives.asymmetric import rsa
-            from cryptography.hazmat.primitives import serialization
-            
-            private_key = rsa.generate_private_key(
-                public_exponent=65537,
-                key_size=2048
-            )
-            
-            # Sauvegarder la clé privée
-            with open(PRIVATE_KEY_FILE, 'wb') as f:
-                f.write(private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.PKCS8,
-                    encryption_algorithm=serialization.NoEncryption()
-                ))
-            
-            # Sauvegarder la clé publique
-            public_key = private_key.public_key()
-            with open(PUBLIC_KEY_FILE, 'wb') as f:
-                f.write(public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PublicFormat.SubjectPublicKeyInfo
-                ))
+        config = await run_io(load_software_config, project_name)
         
         # Créer les données de licence
         license_data = {
@@ -768,27 +707,16 @@ async def download_license_by_code(
             "max_activations": code_info.get('max_activations', config.get('max_activations', 4))
         }
         
-        # Signer la licence
-        with open(PRIVATE_KEY_FILE, 'rb') as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-        
-        # Créer la signature
-        import json
+        # Signer la licence avec l'algorithme du projet (clé en cache, générée si absente)
+        alg = config.get('signature_alg', RSA_PSS)
         data_to_sign = json.dumps(license_data, sort_keys=True).encode()
-        signature = private_key.sign(
-            data_to_sign,
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
+        signature = await run_crypto(license_signer.sign, data_to_sign, alg)
         
         # Créer le fichier de licence signé
         signed_license = {
             "license": license_data,
             "signature": base64.b64encode(signature).decode(),
-            "alg": "RSA-PSS-SHA256"
+            "alg": alg
         }
         
         return signed_license
@@ -801,38 +729,41 @@ async def download_license_by_code(
 
 @app.post("/api/register-activation")
 async def register_activation(
+    request: Request,
     activationCode: str = Form(...),
     machineId: str = Form(...),
     machineName: str = Form(None)
 ):
     """Enregistrer une activation de machine"""
     try:
-        # Charger les codes d'activation
-        activation_codes = load_activation_codes()
+        async with code_lock:
+            # Charger le code d'activation
+            code_info = await run_io(get_activation_code, activationCode)
         
-        if activationCode not in activation_codes:
-            raise HTTPException(
-                status_code=404,
-                detail="Code d'activation non trouvé"
-            )
+            if code_info is None:
+                raise HTTPException(
+                    status_code=404,
+                    detail="Code d'activation non trouvé"
+                )
+            check_token_project(request, code_info.get('project', 'MostaGare'))
         
-        # Incrémenter le compteur d'utilisation
-        if 'used_count' not in activation_codes[activationCode]:
-            activation_codes[activationCode]['used_count'] = 0
+            # Incrémenter le compteur d'utilisation
+            if 'used_count' not in code_info:
+                code_info['used_count'] = 0
         
-        activation_codes[activationCode]['used_count'] += 1
+            code_info['used_count'] += 1
         
-        # Ajouter l'information de la machine
-        if 'machines' not in activation_codes[activationCode]:
-            activation_codes[activationCode]['machines'] = []
+            # Ajouter l'information de la machine
+            if 'machines' not in code_info:
+                code_info['machines'] = []
         
-        activation_codes[activationCode]['machines'].append({
-            'machine_id': machineId,
-            'machine_name': machineName or 'Unknown',
-            'activated_at': datetime.now().isoformat()
-        })
+            code_info['machines'].append({
+                'machine_id': machineId,
+                'machine_name': machineName or 'Unknown',
+                'activated_at': datetime.now().isoformat()
+            })
         
-        save_activation_codes(activation_codes)
+            await run_io(save_activation_code, activationCode, code_info)
         
         return {
             "success": True,
@@ -856,23 +787,19 @@ async def generate_activation_code(
         # Générer un code unique
         code = f"{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}"
         
-        codes = load_activation_codes()
-        
         # Vérifier l'unicité
-        while code in codes:
+        while await run_io(get_activation_code, code) is not None:
             code = f"{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}"
         
         # Créer l'entrée du code
-        codes[code] = {
+        await run_io(save_activation_code, code, {
             "email": email,
             "max_activations": max_activations,
             "created_at": datetime.now().isoformat(),
             "expires_at": (datetime.now() + timedelta(days=duration_days)).isoformat(),
             "used": False,
             "project": "MostaGare"
-        }
-        
-        save_activation_codes(codes)
+        })
         
         return {
             "success": True,
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Request, HTTPException, Form
+from fastapi import FastAPI, Request, HTTPException, Form, Query
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, JSONResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -7,18 +7,56 @@ from datetime import datetime, timedelta
 import uuid, json, os
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from storage import get_storage
+from key_manager import get_key_manager, get_license_signer, get_license_verifier, RSA_PKCS1V15
+from leases import issue_lease, lease_hours_for
+from heartbeats import HeartbeatBuffer
+from idempotency import install_idempotency
+from rate_limit import install_rate_limit, rules_limits, rules_security
+from api_tokens import ApiTokenStore, check_token_project, install_api_token_auth, token_project, token_refusal
+from http_cache import bodies, conditional_response, read_file, LICENSE_CACHE_CONTROL, PUBLIC_KEY_CACHE_CONTROL
+from license_store import file_signature, write_json_atomic
+from rules_history import RulesHistory
+from exports import export_dataset, export_response, license_rows, LICENSE_FIELDS
+from dashboard_stats import rollup_series
+from events import ACTIVATION, DEACTIVATION, event_stream_response, publish
 
 app = FastAPI(title="MostaGare License Server", version="2.0.0")
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+# Rejeux (Idempotency-Key) : réponse enregistrée, pas de licence ni d'activation en double
+install_idempotency(app, {"/api/activate", "/api/activate/bulk", "/api/licenses/generate-from-client"})
+
+DATA_DIR = "data"
 LICENSE_FILE = "data/licenses.json"
 RULES_FILE = "data/rules.json"
-RULES_HISTORY = "data/rules_history.json"
+RULES_HISTORY = "data/rules_history.json"  # Ancien format (copies complètes), converti au premier accès
+RULES_HISTORY_LOG = "data/rules_history.jsonl"
 LOG_FILE = "data/activations.log"
 KEYS_DIR = "data/keys"
 ACTIVATIONS_FILE = "data/activations.json"  # Nouveau : stockage détaillé des activations
 
+# Tokens d'API des clients, exigés si security.require_api_token est vrai
+api_tokens = ApiTokenStore("data/api_tokens.json")
+install_api_token_auth(
+    app,
+    {"/verify", "/api/activate", "/api/deactivate", "/api/heartbeat", "/api/licenses/generate-from-client"},
+    api_tokens,
+    rules_security(RULES_FILE),
+)
+
+# Limites de security dans rules.json (par IP et par clé de licence), relues à chaque modification ;
+# les sous-chemins (/api/activate/bulk) sont limités aussi
+install_rate_limit(app, {"/verify", "/api/activate", "/api/licenses/generate-from-client"}, rules_limits(RULES_FILE))
+
+storage = get_storage(DATA_DIR)
+rules_history = RulesHistory(RULES_HISTORY_LOG, legacy_path=RULES_HISTORY)
+key_manager = get_key_manager(os.path.join(KEYS_DIR, "private.pem"), os.path.join(KEYS_DIR, "public.pem"))
+license_signer = get_license_signer(key_manager.private_path, key_manager.public_path)
+license_verifier = get_license_verifier(key_manager.private_path, key_manager.public_path)
+heartbeat_buffer = HeartbeatBuffer(storage)
+
 # Utils
 
 def load_rules():
@@ -26,56 +64,22 @@ def load_rules():
         return json.load(f)
 
 def save_rules(data):
-    if os.path.exists(RULES_HISTORY):
-        with open(RULES_HISTORY, "r") as f:
-            history = json.load(f)
-    else:
-        history = []
-    history.append({"timestamp": datetime.now().isoformat(), "rules": data})
-    with open(RULES_HISTORY, "w") as f:
-        json.dump(history, f, indent=2)
-    with open(RULES_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    # Une ligne de changements ajoutée à l'historique, quelle que soit sa taille
+    rules_history.append(data)
+    write_json_atomic(RULES_FILE, data)
 
 def save_license(license_data):
-    if os.path.exists(LICENSE_FILE):
-        with open(LICENSE_FILE, "r") as f:
-            data = json.load(f)
-    else:
-        data = []
-    data.append(license_data)
-    with open(LICENSE_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    storage.add_license(license_data)
 
 def find_license_by_key(key):
-    if not os.path.exists(LICENSE_FILE):
-        return None
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-    for lic in licenses:
-        if lic["key"] == key:
-            return lic
-    return None
+    return storage.get_license(key)
 
 def find_license_by_email_project(email, project):
     """Trouver une licence existante pour ce client et ce projet"""
-    if not os.path.exists(LICENSE_FILE):
-        return None
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-    for lic in licenses:
-        if lic["email"] == email and lic["project"] == project:
-            return lic
-    return None
+    return storage.find_license(email, project)
 
 def update_license(key, update):
-    with open(LICENSE_FILE, "r") as f:
-        data = json.load(f)
-    for lic in data:
-        if lic["key"] == key:
-            lic.update(update)
-    with open(LICENSE_FILE, "w") as f:
-        json.dump(data, f, indent=2)
+    storage.update_license(key, update)
 
 def log_activation(entry):
     with open(LOG_FILE, "a") as f:
@@ -83,115 +87,81 @@ def log_activation(entry):
 
 def save_activation_details(activation_data):
     """Sauvegarder les détails d'activation pour suivi précis"""
-    if os.path.exists(ACTIVATIONS_FILE):
-        with open(ACTIVATIONS_FILE, "r") as f:
-            activations = json.load(f)
-    else:
-        activations = []
-    
-    activations.append(activation_data)
-    with open(ACTIVATIONS_FILE, "w") as f:
-        json.dump(activations, f, indent=2)
+    storage.add_activation(activation_data)
+
+def license_refusal(lic):
+    """Motif de refus d'activation (code HTTP, message), None si la licence est utilisable"""
+    if not lic:
+        return 404, "Licence inconnue"
+    if lic["status"] != "ACTIVE":
+        return 403, "Licence inactive"
+    if datetime.now() > datetime.fromisoformat(lic["expires_at"]):
+        return 403, "Licence expirée"
+    return None
+
+def activation_summary(machines):
+    """Résumé des postes actifs stocké dans la licence"""
+    return [{"device_id": a["device_id"], "timestamp": a["timestamp"]} for a in machines]
+
+def only_active(devices):
+    """Machines dont la dernière activation est toujours active"""
+    return [m for m in devices if m.get("status") == "active"]
 
 def get_active_machines_for_license(license_key):
-    """Récupérer les machines actives pour une licence donnée"""
-    if not os.path.exists(ACTIVATIONS_FILE):
-        return []
-    
-    with open(ACTIVATIONS_FILE, "r") as f:
-        activations = json.load(f)
-    
-    # Filtrer par licence et récupérer les activations uniques par machine
-    license_activations = {}
-    for activation in activations:
-        if activation["license_key"] == license_key:
-            device_id = activation["device_id"]
-            # Garder la dernière activation pour chaque machine
-            if device_id not in license_activations or activation["timestamp"] > license_activations[device_id]["timestamp"]:
-                license_activations[device_id] = activation
-    
-    return list(license_activations.values())
+    """Récupérer les machines actives pour une licence donnée (index par licence)"""
+    return only_active(storage.list_license_devices(license_key))
 
 def update_license_max_activations(email, project, new_max_activations):
     """Mettre à jour le nombre maximum d'activations pour une licence spécifique"""
-    if not os.path.exists(LICENSE_FILE):
-        return False
-    
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
+    def apply(lic):
+        old_max = lic.get("max_activations", 3)
+        lic["max_activations"] = new_max_activations
+        
+        # Ajouter un historique de modification
+        if "config_history" not in lic:
+            lic["config_history"] = []
+        
+        lic["config_history"].append({
+            "timestamp": datetime.now().isoformat(),
+            "action": "update_max_activations",
+            "old_value": old_max,
+            "new_value": new_max_activations,
+            "admin_action": True
+        })
     
-    updated = False
-    for lic in licenses:
-        if lic["email"] == email and lic["project"] == project:
-            old_max = lic.get("max_activations", 3)
-            lic["max_activations"] = new_max_activations
-            
-            # Ajouter un historique de modification
-            if "config_history" not in lic:
-                lic["config_history"] = []
-            
-            lic["config_history"].append({
-                "timestamp": datetime.now().isoformat(),
-                "action": "update_max_activations",
-                "old_value": old_max,
-                "new_value": new_max_activations,
-                "admin_action": True
-            })
-            updated = True
+    updated = storage.update_licenses_by_email_project(email, project, apply)
     
     if updated:
-        with open(LICENSE_FILE, "w") as f:
-            json.dump(licenses, f, indent=2)
-        
         # Re-signer la licence mise à jour
-        for lic in licenses:
-            if lic["email"] == email and lic["project"] == project:
-                sign_license(lic)
-                break
+        sign_license(updated[0])
     
-    return updated
+    return bool(updated)
+
+# (signature de rules.json, projet -> algorithme), remplacé d'un bloc quand le fichier change
+_signature_algs = (None, {})
+
+def signature_alg_for(project):
+    """Algorithme de signature du projet (champ signature_alg de rules.json, RSA par défaut)"""
+    global _signature_algs
+    version = file_signature(RULES_FILE)
+    if version != _signature_algs[0]:
+        # Premier projet retenu en cas de doublon d'identifiant
+        projects = reversed(load_rules()["projects"])
+        _signature_algs = (version, {p["id"]: p.get("signature_alg", RSA_PKCS1V15) for p in projects})
+    return _signature_algs[1].get(project, RSA_PKCS1V15)
 
 def sign_license(data):
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-
-    # Génération de la paire si absente (PyCA cryptography)
-    if not os.path.exists(privkey_path) or not os.path.exists(pubkey_path):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-
-        with open(privkey_path, "wb") as f:
-            f.write(
-                private_key.private_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.PKCS8,
-                    encryption_algorithm=serialization.NoEncryption(),
-                )
-            )
-        with open(pubkey_path, "wb") as f:
-            f.write(
-                public_key.public_bytes(
-                    encoding=serialization.Encoding.PEM,
-                    format=serialization.PublicFormat.SubjectPublicKeyInfo,
-                )
-            )
-    else:
-        with open(privkey_path, "rb") as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-
-    # Signature RSA-PKCS1v1.5 + SHA256 sur un JSON CANONIQUE (stable)
+    alg = signature_alg_for(data["project"])
+
+    # Signature (RSA-PKCS1v1.5 + SHA256 ou Ed25519) sur un JSON CANONIQUE (stable)
+    # avec la clé en cache, générée si absente (PyCA cryptography)
     payload = json.dumps(data, sort_keys=True, separators=(",", ":")).encode()
-    signature = private_key.sign(
-        payload,
-        padding.PKCS1v15(),
-        hashes.SHA256()
-    )
+    signature = license_signer.sign(payload, alg)
 
     signed_data = {
         "license": data,
         "signature": signature.hex(),   # on garde hex pour compat client (Node/Python)
-        "alg": "RSA-PKCS1v1.5-SHA256"
+        "alg": alg
     }
     path = f"data/licenses/{data['key']}.signed.json"
     os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -273,15 +243,12 @@ class ActivationRequest(BaseModel):
 def activate_device(payload: ActivationRequest, request: Request):
     """Activer un nouveau poste pour une licence"""
     lic = find_license_by_key(payload.license_key)
-    if not lic:
-        raise HTTPException(404, "Licence inconnue")
     
-    if lic["status"] != "ACTIVE":
-        raise HTTPException(403, "Licence inactive")
-    
-    # Vérifier expiration
-    if datetime.now() > datetime.fromisoformat(lic["expires_at"]):
-        raise HTTPException(403, "Licence expirée")
+    # Vérifier existence, statut et expiration
+    refusal = license_refusal(lic)
+    if refusal:
+        raise HTTPException(*refusal)
+    check_token_project(request, lic["project"])
     
     # Récupérer les activations actuelles
     active_machines = get_active_machines_for_license(payload.license_key)
@@ -303,6 +270,7 @@ def activate_device(payload: ActivationRequest, request: Request):
     # Créer la nouvelle activation
     activation_data = {
         "license_key": payload.license_key,
+        "project": lic["project"],
         "device_id": payload.device_id,
         "device_name": payload.device_name,
         "os_info": payload.os_info,
@@ -319,6 +287,8 @@ def activate_device(payload: ActivationRequest, request: Request):
     update_license(payload.license_key, {
         "activations": [{"device_id": a["device_id"], "timestamp": a["timestamp"]} for a in new_activations]
     })
+    publish(ACTIVATION, license_key=payload.license_key, project=lic["project"],
+            device_id=payload.device_id, timestamp=activation_data["timestamp"])
     
     return {
         "status": "activated",
@@ -328,26 +298,18 @@ def activate_device(payload: ActivationRequest, request: Request):
     }
 
 @app.delete("/api/deactivate/{license_key}/{device_id}")
-def deactivate_device(license_key: str, device_id: str):
+def deactivate_device(license_key: str, device_id: str, request: Request):
     """Désactiver un poste"""
     lic = find_license_by_key(license_key)
     if not lic:
         raise HTTPException(404, "Licence inconnue")
+    check_token_project(request, lic["project"])
     
     # Marquer l'activation comme inactive
-    if os.path.exists(ACTIVATIONS_FILE):
-        with open(ACTIVATIONS_FILE, "r") as f:
-            activations = json.load(f)
-        
-        for activation in activations:
-            if (activation["license_key"] == license_key and 
-                activation["device_id"] == device_id and 
-                activation.get("status") == "active"):
-                activation["status"] = "deactivated"
-                activation["deactivated_at"] = datetime.now().isoformat()
-        
-        with open(ACTIVATIONS_FILE, "w") as f:
-            json.dump(activations, f, indent=2)
+    storage.update_activations(
+        {"license_key": license_key, "device_id": device_id, "status": "active"},
+        {"status": "deactivated", "deactivated_at": datetime.now().isoformat()}
+    )
     
     # Mettre à jour la licence
     active_machines = get_active_machines_for_license(license_key)
@@ -356,9 +318,166 @@ def deactivate_device(license_key: str, device_id: str):
     update_license(license_key, {
         "activations": [{"device_id": a["device_id"], "timestamp": a["timestamp"]} for a in active_machines]
     })
+    publish(DEACTIVATION, license_key=license_key, project=lic["project"], device_id=device_id)
     
     return {"status": "deactivated", "message": "Poste désactivé"}
 
+# --- Activation / désactivation en masse ---
+
+class BulkActivationRequest(BaseModel):
+    activations: list[ActivationRequest]
+
+class BulkDeactivationItem(BaseModel):
+    license_key: str
+    device_id: str
+
+class BulkDeactivationRequest(BaseModel):
+    devices: list[BulkDeactivationItem]
+
+@app.post("/api/activate/bulk")
+def bulk_activate_devices(payload: BulkActivationRequest, request: Request):
+    """Activer un lot de postes : limites vérifiées en un passage, une seule écriture"""
+    licenses = {}
+    machines = {}
+    new_activations = []
+    results = []
+    
+    for item in payload.activations:
+        key = item.license_key
+        if key not in licenses:
+            licenses[key] = find_license_by_key(key)
+            machines[key] = get_active_machines_for_license(key) if licenses[key] else []
+        lic = licenses[key]
+        result = {"license_key": key, "device_id": item.device_id}
+        
+        refusal = license_refusal(lic) or token_refusal(request, lic["project"])
+        existing = next((m for m in machines[key] if m["device_id"] == item.device_id), None)
+        if refusal:
+            result.update({"status": "error", "code": refusal[0], "message": refusal[1]})
+        elif existing:
+            result.update({"status": "already_active", "activation_date": existing["timestamp"]})
+        elif len(machines[key]) >= lic["max_activations"]:
+            result.update({
+                "status": "error",
+                "code": 403,
+                "message": f"Limite d'activations atteinte ({lic['max_activations']} postes maximum)"
+            })
+        else:
+            activation_data = {
+                "license_key": key,
+                "project": lic["project"],
+                "device_id": item.device_id,
+                "device_name": item.device_name,
+                "os_info": item.os_info,
+                "hostname": item.hostname,
+                "ip_address": request.client.host,
+                "timestamp": datetime.now().isoformat(),
+                "status": "active"
+            }
+            new_activations.append(activation_data)
+            machines[key].append(activation_data)
+            result.update({"status": "activated", "activation_date": activation_data["timestamp"]})
+        
+        if lic and not token_refusal(request, lic["project"]):
+            result["remaining_activations"] = lic["max_activations"] - len(machines[key])
+        results.append(result)
+    
+    if new_activations:
+        storage.add_activations(new_activations)
+        changed = {a["license_key"] for a in new_activations}
+        storage.update_licenses({key: {"activations": activation_summary(machines[key])} for key in changed})
+        for a in new_activations:
+            publish(ACTIVATION, license_key=a["license_key"], project=a["project"],
+                    device_id=a["device_id"], timestamp=a["timestamp"])
+    
+    return {
+        "activated": len(new_activations),
+        "results": results
+    }
+
+@app.post("/api/deactivate/bulk")
+def bulk_deactivate_devices(payload: BulkDeactivationRequest, request: Request):
+    """Désactiver un lot de postes en une seule écriture"""
+    machines = {}
+    projects = {}
+    updates = []
+    results = []
+    deactivated_at = datetime.now().isoformat()
+    
+    for item in payload.devices:
+        key = item.license_key
+        if key not in machines:
+            lic = find_license_by_key(key)
+            projects[key] = lic["project"] if lic else None
+            machines[key] = get_active_machines_for_license(key) if lic else None
+        result = {"license_key": key, "device_id": item.device_id}
+        
+        refusal = token_refusal(request, projects[key]) if machines[key] is not None else None
+        if machines[key] is None:
+            result.update({"status": "error", "code": 404, "message": "Licence inconnue"})
+        elif refusal:
+            result.update({"status": "error", "code": refusal[0], "message": refusal[1]})
+        elif not any(m["device_id"] == item.device_id for m in machines[key]):
+            result.update({"status": "not_active", "message": "Poste non activé"})
+        else:
+            updates.append((
+                {"license_key": key, "device_id": item.device_id, "status": "active"},
+                {"status": "deactivated", "deactivated_at": deactivated_at}
+            ))
+            machines[key] = [m for m in machines[key] if m["device_id"] != item.device_id]
+            result["status"] = "deactivated"
+        results.append(result)
+    
+    if updates:
+        storage.update_activations_many(updates)
+        changed = {where["license_key"] for where, _ in updates}
+        storage.update_licenses({key: {"activations": activation_summary(machines[key])} for key in changed})
+        for where, _ in updates:
+            publish(DEACTIVATION, license_key=where["license_key"], project=projects[where["license_key"]],
+                    device_id=where["device_id"], timestamp=deactivated_at)
+    
+    return {
+        "deactivated": len(updates),
+        "results": results
+    }
+
+# --- Heartbeats des postes ---
+
+class HeartbeatItem(BaseModel):
+    license_key: str
+    device_id: str
+
+class HeartbeatRequest(BaseModel):
+    heartbeats: list[HeartbeatItem]
+
+@app.post("/api/heartbeat")
+def device_heartbeat(payload: HeartbeatRequest, request: Request):
+    """Check-ins groupés des postes actifs (gardés en mémoire, écrits par lots)"""
+    active_devices = {}
+    refusals = {}
+    results = []
+    for item in payload.heartbeats:
+        if item.license_key not in active_devices:
+            active_devices[item.license_key] = {
+                m["device_id"] for m in get_active_machines_for_license(item.license_key)
+            }
+            # Token limité à un projet : licences des autres projets refusées
+            if token_project(request):
+                lic = find_license_by_key(item.license_key)
+                refusals[item.license_key] = lic and token_refusal(request, lic["project"])
+        result = {"license_key": item.license_key, "device_id": item.device_id}
+        refusal = refusals.get(item.license_key)
+        if refusal:
+            result.update({"status": "error", "code": refusal[0], "message": refusal[1]})
+        elif item.device_id in active_devices[item.license_key]:
+            result["status"] = "ok"
+            result["last_seen"] = heartbeat_buffer.record(item.license_key, item.device_id)
+        else:
+            result["status"] = "unknown_device"
+        results.append(result)
+    
+    return {"results": results, "flush_interval_seconds": heartbeat_buffer.flush_seconds}
+
 # --- API pour configuration administrative ---
 
 class ConfigUpdateRequest(BaseModel):
@@ -394,17 +513,16 @@ def admin_update_max_activations(payload: ConfigUpdateRequest):
 @app.get("/admin/activations", response_class=HTMLResponse)
 def admin_activations(request: Request):
     """Page d'administration des activations/postes"""
-    if not os.path.exists(LICENSE_FILE):
-        licenses = []
-    else:
-        with open(LICENSE_FILE, "r") as f:
-            licenses = json.load(f)
+    licenses = storage.list_licenses()
+    devices_by_license = storage.list_devices_by_license()
     
-    # Enrichir avec les données d'activation
+    # Enrichir avec les données d'activation (un seul parcours de l'index)
     for lic in licenses:
-        active_machines = get_active_machines_for_license(lic["key"])
-        lic["active_machines"] = active_machines
-        lic["active_count"] = len(active_machines)
+        machines = only_active(devices_by_license.get(lic["key"], []))
+        for machine in machines:
+            machine["last_seen"] = heartbeat_buffer.last_seen(lic["key"], machine["device_id"]) or machine.get("last_seen")
+        lic["active_machines"] = machines
+        lic["active_count"] = len(machines)
     
     return templates.TemplateResponse("activations_admin.html", {
         "request": request, 
@@ -449,6 +567,7 @@ def generate_license_from_client(request: Request, data: dict):
     }
     Retourne : fichier de licence signée
     """
+    check_token_project(request, data["project"])
     rules = load_rules()
     project_info = next((p for p in rules["projects"] if p["id"] == data["project"]), None)
     if not project_info:
@@ -473,46 +592,8 @@ def generate_license_from_client(request: Request, data: dict):
 
     save_license(license_data)
 
-    # Génération ou chargement des clés RSA avec cryptography
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-    if not os.path.exists(privkey_path) or not os.path.exists(pubkey_path):
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-        with open(privkey_path, "wb") as f:
-            f.write(private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption()
-            ))
-        with open(pubkey_path, "wb") as f:
-            f.write(public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ))
-    else:
-        with open(privkey_path, "rb") as f:
-            private_key = serialization.load_pem_private_key(f.read(), password=None)
-
-    # Signature du JSON canonique avec RSA SHA256
-    payload = json.dumps(license_data, sort_keys=True, separators=(",", ":")).encode()
-    signature = private_key.sign(
-        payload,
-        padding.PKCS1v15(),
-        hashes.SHA256()
-    )
-
-    signed_data = {
-        "license": license_data,
-        "signature": signature.hex(),
-        "alg": "RSA-PKCS1v1.5-SHA256"
-    }
-
-    path = f"data/licenses/{key}.signed.json"
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    with open(path, "w") as f:
-        json.dump(signed_data, f, indent=2)
+    # Signature du JSON canonique avec la clé privée en cache
+    path = sign_license(license_data)
 
     return FileResponse(path, filename=f"{key}.signed.json", media_type="application/json")
 
@@ -523,17 +604,12 @@ from cryptography.hazmat.primitives.asymmetric import padding
 
 
 def _verify_signed_license_file(filepath: str) -> bool:
-    """Return True if the signed license JSON verifies with public.pem (RSA PKCS1v1.5 SHA256)."""
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    if not os.path.exists(pubkey_path):
+    """Return True if the signed license JSON verifies with the cached public key of its alg (RSA PKCS1v1.5 SHA256 or Ed25519)."""
+    if key_manager.public_key() is None and not license_signer.ed25519_manager.has_keys():
         raise HTTPException(404, "Clé publique introuvable. Générez-la depuis /admin/keys.")
     if not os.path.exists(filepath):
         raise HTTPException(404, "Fichier de licence signé introuvable.")
 
-    # Load public key
-    with open(pubkey_path, "rb") as f:
-        public_key = serialization.load_pem_public_key(f.read())
-
     # Load signed JSON
     with open(filepath, "r") as f:
         signed = json.load(f)
@@ -541,21 +617,15 @@ def _verify_signed_license_file(filepath: str) -> bool:
     if not isinstance(signed, dict) or "license" not in signed or "signature" not in signed:
         raise HTTPException(400, "Format de licence invalide.")
 
-    # Rebuild the exact payload the server signed (same json.dumps default settings)
-    payload = json.dumps(signed["license"]).encode()
-    signature = bytes.fromhex(signed["signature"])
-
+    # Rebuild the exact payload the server signed (canonical JSON, see sign_license)
+    payload = json.dumps(signed["license"], sort_keys=True, separators=(",", ":")).encode()
     try:
-        public_key.verify(
-            signature,
-            payload,
-            padding.PKCS1v15(),
-            hashes.SHA256(),
-        )
-        return True
-    except Exception:
+        signature = bytes.fromhex(signed["signature"])
+    except ValueError:
         return False
 
+    return license_verifier.verify(payload, signature, signed.get("alg", RSA_PKCS1V15))
+
 
 @app.get("/verify-signature")
 def verify_signature(key: str):
@@ -568,11 +638,17 @@ def verify_signature(key: str):
     return {"key": key, "valid_signature": ok}
 
 @app.get("/download-license")
-def download_license(key: str):
+def download_license(key: str, request: Request):
     path = f"data/licenses/{key}.signed.json"
-    if not os.path.exists(path):
+    version = file_signature(path)
+    if version is None:
         raise HTTPException(404, "Fichier introuvable")
-    return FileResponse(path, filename=f"{key}.signed.json", media_type="application/json")
+    # ETag calculé une fois par version du fichier signé ; 304 si le client l'a déjà
+    content, etag = bodies.get(f"license:{path}", version, lambda: read_file(path))
+    return conditional_response(
+        request, content, etag, "application/json", LICENSE_CACHE_CONTROL,
+        {"Content-Disposition": f'attachment; filename="{key}.signed.json"'}
+    )
 
 # Formulaire de génération des règles
 @app.get("/admin/rules", response_class=HTMLResponse)
@@ -628,36 +704,52 @@ def reset_rules():
     return RedirectResponse("/admin/rules", status_code=303)
 
 @app.get("/admin/rules/history", response_class=HTMLResponse)
-def show_rules_history(request: Request):
-    if not os.path.exists(RULES_HISTORY):
-        return templates.TemplateResponse("rules_history.html", {"request": request, "history": []})
-    with open(RULES_HISTORY, "r") as f:
-        history = json.load(f)
-    return templates.TemplateResponse("rules_history.html", {"request": request, "history": history})
+def show_rules_history(request: Request, cursor: int = None, limit: int = 20):
+    # Page de l'historique (plus récentes d'abord) : seules les lignes de la page sont lues
+    history, next_cursor, total = rules_history.page(cursor, max(1, min(limit, 200)))
+    return templates.TemplateResponse("rules_history.html", {
+        "request": request, "history": history, "next_cursor": next_cursor, "total": total,
+    })
+
+@app.get("/api/admin/rules/history")
+def rules_history_page(cursor: int = None, limit: int = 20):
+    history, next_cursor, total = rules_history.page(cursor, max(1, min(limit, 200)))
+    return {"history": history, "next_cursor": next_cursor, "total": total}
+
+@app.get("/api/admin/rules/at")
+def rules_at(timestamp: str = None, version: int = None):
+    """Règles en vigueur à une date (ISO) ou à une version de l'historique"""
+    found = rules_history.rules_at(timestamp, version)
+    if found is None:
+        raise HTTPException(404, "Aucune version des règles à cette date")
+    return {"version": found[0], "rules": found[1]}
  
  
 # Page d'administration des licences avec recherche et suppression
 @app.get("/admin/licenses", response_class=HTMLResponse)
-def admin_licenses(request: Request, q: str = ""):
-    if not os.path.exists(LICENSE_FILE):
-        licenses = []
-    else:
-        with open(LICENSE_FILE, "r") as f:
-            licenses = json.load(f)
-    if q:
-        q = q.lower()
-        licenses = [lic for lic in licenses if q in lic["email"].lower() or q in lic["project"].lower() or q in lic["key"].lower()]
-    return templates.TemplateResponse("licenses_admin.html", {"request": request, "licenses": licenses, "query": q})
+def admin_licenses(request: Request, q: str = "", sort: str = "created_at", order: str = "asc",
+                   cursor: str = None, limit: int = 50):
+    # Recherche indexée (clé, email, projet), tri et pagination par curseur
+    limit = max(1, min(limit, 200))
+    try:
+        licenses, next_cursor = storage.search_licenses(q, sort, order == "desc", cursor, limit)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return templates.TemplateResponse("licenses_admin.html", {
+        "request": request,
+        "licenses": licenses,
+        "query": q,
+        "sort": sort,
+        "order": order,
+        "limit": limit,
+        "next_cursor": next_cursor
+    })
 
 @app.post("/admin/licenses/delete")
 def delete_license(key: str = Form(...)):
-    if not os.path.exists(LICENSE_FILE):
+    if not storage.has_licenses():
         raise HTTPException(404, "Aucune licence")
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-    updated = [lic for lic in licenses if lic["key"] != key]
-    with open(LICENSE_FILE, "w") as f:
-        json.dump(updated, f, indent=2)
+    storage.delete_license(key)
     # Supprimer le fichier signé si existant
     signed_path = f"data/licenses/{key}.signed.json"
     if os.path.exists(signed_path):
@@ -665,34 +757,63 @@ def delete_license(key: str = Form(...)):
     return RedirectResponse("/admin/licenses", status_code=303)
 
 @app.get("/admin/licenses/export")
-def export_licenses_csv():
-    import csv
-    from io import StringIO
-
-    if not os.path.exists(LICENSE_FILE):
+def export_licenses_csv(format: str = "csv", project: str = None,
+                        date_from: str = Query(None, alias="from"), date_to: str = Query(None, alias="to")):
+    """Export des licences en flux (CSV ou NDJSON), filtrable par projet et date de création"""
+    if not storage.has_licenses():
         raise HTTPException(404, "Aucune licence")
 
-    with open(LICENSE_FILE, "r") as f:
-        licenses = json.load(f)
-
-    output = StringIO()
-    writer = csv.DictWriter(output, fieldnames=["key", "email", "project", "version", "status", "activations", "max_activations", "expires_at"])
-    writer.writeheader()
-    for lic in licenses:
-        writer.writerow({
-            "key": lic["key"],
-            "email": lic["email"],
-            "project": lic["project"],
-            "version": lic.get("version", ""),
-            "status": lic["status"],
-            "activations": len(lic.get("activations", [])),
-            "max_activations": lic["max_activations"],
-            "expires_at": lic["expires_at"]
-        })
+    def rows():
+        for lic in license_rows(storage, project, date_from, date_to):
+            if format != "csv":
+                yield lic
+                continue
+            yield {
+                "key": lic["key"],
+                "email": lic["email"],
+                "project": lic["project"],
+                "version": lic.get("version", ""),
+                "status": lic["status"],
+                "activations": len(lic.get("activations", [])),
+                "max_activations": lic["max_activations"],
+                "expires_at": lic["expires_at"]
+            }
 
-    response = HTMLResponse(content=output.getvalue(), media_type="text/csv")
-    response.headers["Content-Disposition"] = "attachment; filename=licenses.csv"
-    return response
+    try:
+        return export_response(rows(), format, LICENSE_FIELDS, "licenses")
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/admin/export/{dataset}")
+def export_data(dataset: str, format: str = "csv", project: str = None,
+                date_from: str = Query(None, alias="from"), date_to: str = Query(None, alias="to")):
+    """Export en flux des licences, activations ou codes (CSV ou NDJSON)"""
+    try:
+        return export_dataset(storage, dataset, format, project, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+
+@app.get("/admin/events")
+def admin_events(request: Request, types: str = None):
+    """Flux SSE des activations et désactivations de ce processus (types=activation,deactivation)"""
+    return event_stream_response(request, types)
+
+@app.get("/api/admin/metrics/activations")
+def activation_metrics(project: str = None, code: str = None, bucket: str = "day", by: str = "project",
+                       date_from: str = Query(None, alias="from"), date_to: str = Query(None, alias="to")):
+    """Volume d'activations par heure ou par jour, par projet ou par code (agrégats, sans relire l'historique)"""
+    rows = storage.activation_rollups(date_from, date_to, project, code)
+    try:
+        series = rollup_series(rows, bucket, by)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    return {
+        "bucket": bucket,
+        "from": date_from,
+        "to": date_to,
+        "total": sum(point["activations"] for point in series),
+        "series": series
+    }
 
 from fastapi.responses import HTMLResponse, RedirectResponse, FileResponse, PlainTextResponse
 
@@ -703,39 +824,23 @@ def show_keygen_form(request: Request):
 
 @app.post("/admin/keys")
 def generate_keypair_safe():
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    if os.path.exists(pubkey_path) or os.path.exists(privkey_path):
+    if key_manager.has_any_key():
         raise HTTPException(400, "❗ Clé déjà générée. Utilisez /admin/keys/force pour forcer.")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-    public_key = private_key.public_key()
-
-    with open(privkey_path, "wb") as f:
-        f.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
-    with open(pubkey_path, "wb") as f:
-        f.write(
-            public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo,
-            )
-        )
+    key_manager.generate()
     return RedirectResponse("/admin/keys", status_code=303)
 
 
 @app.get("/admin/keys/download")
-def download_public_key():
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    if not os.path.exists(pubkey_path):
+def download_public_key(request: Request, alg: str = RSA_PKCS1V15):
+    manager = license_signer.manager_for(alg)
+    version = file_signature(manager.public_path)
+    if version is None:
         raise HTTPException(404, "Clé publique introuvable")
-    return FileResponse(pubkey_path, filename="public.pem", media_type="application/x-pem-file")
+    content, etag = bodies.get(f"public-key:{manager.public_path}", version, manager.public_pem)
+    return conditional_response(
+        request, content, etag, "application/x-pem-file", PUBLIC_KEY_CACHE_CONTROL,
+        {"Content-Disposition": f'attachment; filename="{os.path.basename(manager.public_path)}"'}
+    )
 
 @app.get("/admin/keys/preview", response_class=PlainTextResponse)
 def preview_public_key():
@@ -747,28 +852,8 @@ def preview_public_key():
 
 @app.post("/admin/keys/force")
 def generate_keypair_force():
-    pubkey_path = os.path.join(KEYS_DIR, "public.pem")
-    privkey_path = os.path.join(KEYS_DIR, "private.pem")
-    os.makedirs(KEYS_DIR, exist_ok=True)
-
-    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-    public_key = private_key.public_key()
-
-    with open(privkey_path, "wb") as f:
-        f.write(
-            private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.PKCS8,
-                encryption_algorithm=serialization.NoEncryption(),
-            )
-        )
-    with open(pubkey_path, "wb") as f:
-        f.write(
-            public_key.public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo,
-            )
-        )
+    # Rotation : les nouvelles clés remplacent immédiatement celles en cache
+    license_signer.rotate()
     return RedirectResponse("/admin/keys", status_code=303)
 
     
@@ -804,6 +889,7 @@ class VerifyRequest(BaseModel):
     key: str
     device_id: str
     version: str
+    lease: bool = False           # demander un bail signé vérifiable hors ligne
 
 @app.post("/verify")
 def verify_license(payload: VerifyRequest, request: Request):
@@ -811,6 +897,7 @@ def verify_license(payload: VerifyRequest, request: Request):
     lic = find_license_by_key(payload.key)
     if not lic:
         raise HTTPException(404, "Licence inconnue")
+    check_token_project(request, lic["project"])
     if lic["status"] != "ACTIVE":
         raise HTTPException(403, "Licence inactive")
     if rules["activation_rules"]["limit_by_version"] and lic["version"] != payload.version:
@@ -835,7 +922,12 @@ def verify_license(payload: VerifyRequest, request: Request):
             "timestamp": datetime.now().isoformat()
         })
 
-    return {"status": "valid", "project": lic["project"], "expires_at": lic["expires_at"]}
+    response = {"status": "valid", "project": lic["project"], "expires_at": lic["expires_at"]}
+    if payload.lease:
+        # Le renouvellement passe par les mêmes vérifications (une machine désactivée perd son bail)
+        hours = lease_hours_for(rules, lic["project"])
+        response["lease"] = issue_lease(license_signer, lic, payload.device_id, hours, signature_alg_for(lic["project"]))
+    return response
 
 if __name__ == "__main__":
     import uvicorn
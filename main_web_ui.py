@@ -4,7 +4,7 @@ MostaGare License Server avec Interface Web Complète
 Serveur d'activation de licences avec authentification et interface d'administration
 """
 
-from fastapi import FastAPI, HTTPException, Form, File, UploadFile, Request, Depends, status, Cookie
+from fastapi import FastAPI, HTTPException, Form, File, UploadFile, Request, Depends, status, Cookie, Query
 from fastapi.responses import JSONResponse, HTMLResponse, FileResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
@@ -16,13 +16,27 @@ import json
 import os
 import uuid
 import hashlib
+from urllib.parse import urlencode
 import hmac
 import base64
 import bcrypt
 from jose import jwt
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
+import asyncio
 import logging
+from storage import get_storage
+from executors import run_io, run_crypto
+from idempotency import install_idempotency
+from rate_limit import install_rate_limit, rules_limits, rules_security
+from api_tokens import ApiTokenStore, check_token_project, install_api_token_auth
+from exports import export_dataset
+from dashboard_stats import record_project, rollup_series
+from events import ACTIVATION, CODE_GENERATED, event_stream_response, publish, recent_activities
+from license_store import write_json_atomic
+from software_registry import SoftwareRegistry
+from auth_cache import TokenCache, UserDirectory
+from key_manager import get_key_manager, get_license_signer, ED25519
 
 # Configuration du logging
 logging.basicConfig(level=logging.INFO)
@@ -35,6 +49,17 @@ app = FastAPI(
     version="4.0.0"
 )
 
+# Rejeux (Idempotency-Key) : réponse enregistrée, sans nouvelle signature
+install_idempotency(app, {"/api/download-license"})
+
+# Section security de rules.json : tokens d'API des clients et limites de débit
+RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "rules.json")
+api_tokens = ApiTokenStore(os.path.join(os.path.dirname(RULES_FILE), "api_tokens.json"))
+install_api_token_auth(app, {"/api/download-license", "/api/notify-activation"}, api_tokens, rules_security(RULES_FILE))
+
+# Limites par IP et par code ; ajoutées avant CORS pour que les 401 / 429 en portent les en-têtes
+install_rate_limit(app, {"/login", "/api/download-license", "/api/request-activation-code"}, rules_limits(RULES_FILE))
+
 # CORS pour permettre les requêtes
 app.add_middleware(
     CORSMiddleware,
@@ -58,11 +83,27 @@ ACTIVATION_CODES_FILE = os.path.join(DATA_DIR, "activation_codes.json")
 PUBLIC_KEY_FILE = os.path.join(DATA_DIR, "public.pem")
 PRIVATE_KEY_FILE = os.path.join(DATA_DIR, "private.pem")
 
+storage = get_storage(DATA_DIR)
+
+# Configurations des logiciels (required_all_email.json), rechargées quand le fichier change
+software_registry = SoftwareRegistry(DATA_DIR, "required_all_email.json")
+software_registry.refresh()
+key_manager = get_key_manager(PRIVATE_KEY_FILE, PUBLIC_KEY_FILE)
+license_signer = get_license_signer(PRIVATE_KEY_FILE, PUBLIC_KEY_FILE)
+
+# Verrou des séquences lecture-vérification-écriture sur les codes d'activation
+# (les accès au stockage se font dans le pool I/O, hors de la boucle d'événements)
+code_lock = asyncio.Lock()
+
 # Configuration JWT
 JWT_SECRET = "your-secret-key-here-change-in-production"
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Annuaire des utilisateurs et tokens décodés (invalidés à chaque écriture des utilisateurs)
+users_directory = UserDirectory(storage.load_users)
+token_cache = TokenCache()
+
 # Templates
 templates = Jinja2Templates(directory=TEMPLATES_DIR)
 
@@ -81,12 +122,18 @@ class User(BaseModel):
 
 # Utilitaires d'authentification
 def load_users():
-    """Charger les utilisateurs depuis le fichier de configuration"""
-    try:
-        with open(USERS_CONF_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    """Charger les utilisateurs (annuaire en mémoire)"""
+    return users_directory.all()
+
+def save_user_data(username, user_data):
+    """Enregistrer un utilisateur et invalider l'annuaire"""
+    storage.save_user(username, user_data)
+    users_directory.invalidate()
+
+def delete_user_data(username):
+    """Supprimer un utilisateur et invalider l'annuaire"""
+    storage.delete_user(username)
+    users_directory.invalidate()
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Vérifier le mot de passe avec bcrypt"""
@@ -108,16 +155,19 @@ def get_current_user(request: Request):
     if not token:
         return None
     
-    try:
-        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        except jwt.JWTError:
+            return None
         username = payload.get("sub")
         if username is None:
             return None
-    except jwt.PyJWTError:
-        return None
+        token_cache.put(token, username, payload.get("exp"))
     
-    users = load_users()
-    user_data = users.get(username)
+    # L'annuaire est invalidé à chaque écriture : désactivation et suppression prennent effet aussitôt
+    user_data = users_directory.get(username)
     if user_data is None or not user_data.get('active', False):
         return None
         
@@ -160,50 +210,39 @@ def ensure_data_files():
 
 def load_software_config(project_name):
     """Charger la configuration pour un logiciel spécifique"""
-    try:
-        with open(REQUIRED_ALL_EMAIL_FILE, 'r') as f:
-            configs = json.load(f)
-            return configs.get(project_name, {})
-    except FileNotFoundError:
-        return {}
+    return software_registry.get(project_name) or {}
 
 def get_all_software_configs():
     """Récupérer toutes les configurations de logiciels"""
-    try:
-        with open(REQUIRED_ALL_EMAIL_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return software_registry.all()
 
 def save_all_software_configs(configs):
     """Sauvegarder toutes les configurations"""
-    with open(REQUIRED_ALL_EMAIL_FILE, 'w') as f:
-        json.dump(configs, f, indent=2)
+    # Écriture atomique : le registre des autres processus ne lit jamais un fichier partiel
+    write_json_atomic(REQUIRED_ALL_EMAIL_FILE, configs)
+    software_registry.refresh(force=True)
 
 def load_activation_codes():
     """Charger les codes d'activation"""
-    try:
-        with open(ACTIVATION_CODES_FILE, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
+    return storage.load_codes()
+
+def get_activation_code(code):
+    """Charger un code d'activation, ou None s'il n'existe pas"""
+    return storage.get_code(code)
 
-def save_activation_codes(codes):
-    """Sauvegarder les codes d'activation"""
-    with open(ACTIVATION_CODES_FILE, 'w') as f:
-        json.dump(codes, f, indent=2)
+def save_activation_code(code, info):
+    """Sauvegarder un code d'activation (mise à jour d'une seule entrée)"""
+    storage.save_code(code, info)
 
 def get_stats():
-    """Récupérer les statistiques du serveur"""
-    codes = load_activation_codes()
-    projects = get_all_software_configs()
-    
-    return {
-        "total_licenses": len(projects),
-        "active_codes": len([c for c in codes.values() if not c.get('used', False)]),
-        "today_activations": 0,  # TODO: calculer depuis les activations
-        "total_projects": len(projects)
-    }
+    """Récupérer les statistiques du serveur (compteurs maintenus par le stockage)"""
+    stats = storage.dashboard_stats()
+    projects = software_registry.count()
+    stats.update({
+        "total_licenses": projects,
+        "total_projects": projects
+    })
+    return stats
 
 # Initialisation
 ensure_data_files()
@@ -225,7 +264,7 @@ async def login_page(request: Request):
         return RedirectResponse(url="/dashboard")
     
     # Charger dynamiquement la liste des projets
-    projects = get_all_software_configs()
+    projects = await run_io(get_all_software_configs)
     
     return templates.TemplateResponse("login.html", {
         "request": request,
@@ -235,11 +274,10 @@ async def login_page(request: Request):
 @app.post("/login")
 async def login(request: Request, username: str = Form(...), password: str = Form(...)):
     """Traitement de la connexion"""
-    users = load_users()
-    user_data = users.get(username)
+    user_data = await run_io(storage.get_user, username)
     
     if not user_data or not user_data.get('active', False):
-        projects = get_all_software_configs()
+        projects = await run_io(get_all_software_configs)
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Utilisateur non trouvé ou inactif",
@@ -247,8 +285,8 @@ async def login(request: Request, username: str = Form(...), password: str = For
             "projects": projects
         })
     
-    if not verify_password(password, user_data.get('password_hash', '')):
-        projects = get_all_software_configs()
+    if not await run_crypto(verify_password, password, user_data.get('password_hash', '')):
+        projects = await run_io(get_all_software_configs)
         return templates.TemplateResponse("login.html", {
             "request": request,
             "error": "Mot de passe incorrect",
@@ -258,9 +296,7 @@ async def login(request: Request, username: str = Form(...), password: str = For
     
     # Mettre à jour la dernière connexion
     user_data['last_login'] = datetime.now().isoformat()
-    users[username] = user_data
-    with open(USERS_CONF_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    await run_io(save_user_data, username, user_data)
     
     # Créer le token
     token = create_access_token({"sub": username})
@@ -287,20 +323,19 @@ async def logout():
 @app.get("/dashboard", response_class=HTMLResponse)
 async def dashboard(request: Request, user: User = Depends(require_auth)):
     """Dashboard principal"""
-    stats = get_stats()
-    recent_activities = []  # TODO: implémenter les activités récentes
+    stats = await run_io(get_stats)
     
     return templates.TemplateResponse("dashboard.html", {
         "request": request,
         "user": user,
         "stats": stats,
-        "recent_activities": recent_activities
+        "recent_activities": recent_activities()
     })
 
 @app.get("/admin/projects", response_class=HTMLResponse)
 async def projects_page(request: Request, user: User = Depends(require_permission("manage_licenses"))):
     """Page de gestion des projets"""
-    projects = get_all_software_configs()
+    projects = await run_io(get_all_software_configs)
     return templates.TemplateResponse("projects.html", {
         "request": request,
         "user": user,
@@ -320,7 +355,7 @@ async def save_project(request: Request,
                       user: User = Depends(require_permission("manage_licenses"))):
     """Sauvegarder un projet"""
     
-    projects = get_all_software_configs()
+    projects = await run_io(get_all_software_configs)
     
     project_data = {
         "required_email": required_email,
@@ -344,7 +379,7 @@ async def save_project(request: Request,
         project_name = project_id  # Utiliser l'ID existant
     
     projects[project_name] = project_data
-    save_all_software_configs(projects)
+    await run_io(save_all_software_configs, projects)
     
     return RedirectResponse(url="/admin/projects?message=Projet sauvegardé avec succès", status_code=302)
 
@@ -354,25 +389,26 @@ async def delete_project(project_name: str, user: User = Depends(require_permiss
     if project_name == "MostaGare":
         return RedirectResponse(url="/admin/projects?error=Impossible de supprimer le projet principal", status_code=302)
     
-    projects = get_all_software_configs()
+    projects = await run_io(get_all_software_configs)
     if project_name in projects:
         del projects[project_name]
-        save_all_software_configs(projects)
+        await run_io(save_all_software_configs, projects)
     
     return RedirectResponse(url="/admin/projects?message=Projet supprimé avec succès", status_code=302)
 
 @app.get("/admin/codes", response_class=HTMLResponse)
 async def codes_page(request: Request, user: User = Depends(require_permission("manage_codes"))):
     """Page de gestion des codes"""
-    codes = load_activation_codes()
-    projects = get_all_software_configs()
+    codes = await run_io(load_activation_codes)
+    projects = await run_io(get_all_software_configs)
+    stats = await run_io(storage.dashboard_stats)
     
     return templates.TemplateResponse("admin_codes_enhanced.html", {
         "request": request,
         "user": user,
         "codes": codes,
         "projects": projects,
-        "expired_count": 0  # TODO: calculer les codes expirés
+        "expired_count": stats["expired_codes"]
     })
 
 @app.post("/api/admin/generate-code")
@@ -388,14 +424,12 @@ async def generate_activation_code(
         # Générer un code unique au format générique
         code = f"{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}"
         
-        codes = load_activation_codes()
-        
         # Vérifier l'unicité
-        while code in codes:
+        while await run_io(get_activation_code, code) is not None:
             code = f"{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}"
         
         # Créer l'entrée du code
-        codes[code] = {
+        await run_io(save_activation_code, code, {
             "email": email,
             "project": project,
             "max_activations": max_activations,
@@ -403,9 +437,8 @@ async def generate_activation_code(
             "expires_at": (datetime.now() + timedelta(days=duration_days)).isoformat(),
             "used": False,
             "used_count": 0
-        }
-        
-        save_activation_codes(codes)
+        })
+        publish(CODE_GENERATED, code=code, project=project, email=email, max_activations=max_activations)
         
         return RedirectResponse(url="/admin/codes?message=Code généré avec succès", status_code=302)
         
@@ -416,10 +449,9 @@ async def generate_activation_code(
 @app.get("/admin/codes/delete/{code}")
 async def delete_code(code: str, user: User = Depends(require_permission("manage_codes"))):
     """Supprimer un code d'activation"""
-    codes = load_activation_codes()
-    if code in codes and not codes[code].get('used', False):
-        del codes[code]
-        save_activation_codes(codes)
+    code_info = await run_io(get_activation_code, code)
+    if code_info is not None and not code_info.get('used', False):
+        await run_io(storage.delete_code, code)
         return RedirectResponse(url="/admin/codes?message=Code supprimé avec succès", status_code=302)
     
     return RedirectResponse(url="/admin/codes?error=Impossible de supprimer ce code", status_code=302)
@@ -427,7 +459,7 @@ async def delete_code(code: str, user: User = Depends(require_permission("manage
 @app.get("/admin/users", response_class=HTMLResponse)
 async def users_page(request: Request, user: User = Depends(require_permission("manage_users"))):
     """Page de gestion des utilisateurs"""
-    users = load_users()
+    users = await run_io(load_users)
     return templates.TemplateResponse("users.html", {
         "request": request,
         "user": user,
@@ -443,7 +475,7 @@ async def save_user(request: Request,
                     active: bool = Form(True),
                     user: User = Depends(require_permission("manage_users"))):
     """Sauvegarder un utilisateur"""
-    users = load_users()
+    existing = await run_io(storage.get_user, username)
     
     # Définir les permissions par rôle
     role_permissions = {
@@ -458,26 +490,23 @@ async def save_user(request: Request,
         "role": role,
         "permissions": role_permissions.get(role, []),
         "active": active,
-        "last_login": users.get(username, {}).get('last_login')
+        "last_login": (existing or {}).get('last_login')
     }
     
     # Si nouveau mot de passe fourni, le hasher
     if password:
-        user_data["password_hash"] = bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+        user_data["password_hash"] = (await run_crypto(bcrypt.hashpw, password.encode(), bcrypt.gensalt())).decode()
     else:
         # Conserver l'ancien hash si pas de nouveau mot de passe
-        if username in users:
-            user_data["password_hash"] = users[username].get("password_hash")
+        if existing is not None:
+            user_data["password_hash"] = existing.get("password_hash")
     
-    if username not in users:
+    if existing is None:
         user_data["created_at"] = datetime.now().isoformat()
     else:
-        user_data["created_at"] = users[username].get("created_at", datetime.now().isoformat())
+        user_data["created_at"] = existing.get("created_at", datetime.now().isoformat())
     
-    users[username] = user_data
-    
-    with open(USERS_CONF_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+    await run_io(save_user_data, username, user_data)
     
     return RedirectResponse(url="/admin/users?message=Utilisateur sauvegardé avec succès", status_code=302)
 
@@ -487,34 +516,125 @@ async def delete_user(username: str, request: Request, user: User = Depends(requ
     if username == user.username:
         return RedirectResponse(url="/admin/users?error=Impossible de supprimer votre propre compte", status_code=302)
     
-    users = load_users()
-    if username in users:
-        del users[username]
-        with open(USERS_CONF_FILE, 'w') as f:
-            json.dump(users, f, indent=2)
+    await run_io(delete_user_data, username)
     
     return RedirectResponse(url="/admin/users?message=Utilisateur supprimé avec succès", status_code=302)
 
 @app.get("/admin/activations", response_class=HTMLResponse)
-async def activations_page(request: Request, user: User = Depends(require_permission("view_stats"))):
-    """Page des activations"""
-    try:
-        with open(ACTIVATIONS_FILE, 'r') as f:
-            activations = json.load(f)
-    except FileNotFoundError:
-        activations = []
+async def activations_page(
+    request: Request,
+    project: str = None,
+    status: str = None,
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    cursor: int = None,
+    limit: int = 50,
+    user: User = Depends(require_permission("view_stats"))
+):
+    """Page des activations (filtres et pagination côté serveur)"""
+    limit = max(1, min(limit, 200))
+    # Un champ vide du formulaire signifie « pas de filtre »
+    filters = {"project": project or None, "status": status or None, "from": date_from or None, "to": date_to or None}
+    activations, next_cursor, total = await run_io(
+        storage.page_activations,
+        filters["project"], filters["status"], filters["from"], filters["to"], cursor, limit
+    )
+    for activation in activations:
+        activation["project"] = record_project(activation) or None
+    
+    stats = await run_io(storage.dashboard_stats)
+    projects = await run_io(get_all_software_configs)
     
-    codes = load_activation_codes()
-    projects = get_all_software_configs()
+    query = {name: value for name, value in filters.items() if value}
+    next_url = None
+    if next_cursor is not None:
+        next_url = "/admin/activations?" + urlencode({**query, "cursor": next_cursor, "limit": limit})
     
     return templates.TemplateResponse("activations.html", {
         "request": request,
         "user": user,
         "activations": activations,
-        "codes": codes,
+        "total": total,
+        "filters": filters,
+        "first_url": "/admin/activations?" + urlencode({**query, "limit": limit}),
+        "next_url": next_url,
+        "stats": stats,
         "projects": projects
     })
 
+@app.get("/admin/export/{dataset}")
+async def export_data(
+    dataset: str,
+    format: str = "csv",
+    project: str = None,
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    user: User = Depends(require_permission("view_stats"))
+):
+    """Export en flux des licences, activations ou codes (CSV ou NDJSON)"""
+    try:
+        # Les lignes sont lues par le générateur, hors de la boucle d'événements
+        return export_dataset(storage, dataset, format, project, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/admin/events")
+async def admin_events(
+    request: Request,
+    types: str = None,
+    user: User = Depends(require_permission("view_stats"))
+):
+    """Flux SSE des activations et codes générés par ce processus (types=activation,code_generated)"""
+    return event_stream_response(request, types)
+
+@app.get("/api/admin/metrics/activations")
+async def activation_metrics(
+    project: str = None,
+    code: str = None,
+    bucket: str = "day",
+    by: str = "project",
+    date_from: str = Query(None, alias="from"),
+    date_to: str = Query(None, alias="to"),
+    user: User = Depends(require_permission("view_stats"))
+):
+    """Volume d'activations par heure ou par jour, par projet ou par code (agrégats, sans relire l'historique)"""
+    rows = await run_io(storage.activation_rollups, date_from, date_to, project, code)
+    try:
+        series = rollup_series(rows, bucket, by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "bucket": bucket,
+        "from": date_from,
+        "to": date_to,
+        "total": sum(point["activations"] for point in series),
+        "series": series
+    }
+
+@app.get("/api/admin/api-tokens")
+async def list_api_tokens(user: User = Depends(require_permission("manage_licenses"))):
+    """Tokens d'API des clients (sans empreinte)"""
+    return {"tokens": await run_io(api_tokens.list)}
+
+@app.post("/api/admin/api-tokens")
+async def create_api_token(
+    name: str = Form(...),
+    project: str = Form(None),
+    user: User = Depends(require_permission("manage_licenses"))
+):
+    """Créer un token d'API (limité à project si fourni) ; le token en clair n'est renvoyé qu'une fois"""
+    token, record = await run_io(api_tokens.create, name, project)
+    logger.info(f"Token d'API {record['prefix']} créé par {user.username}")
+    return {"token": token, **record}
+
+@app.post("/api/admin/api-tokens/{prefix}/revoke")
+async def revoke_api_token(prefix: str, user: User = Depends(require_permission("manage_licenses"))):
+    """Révoquer un token d'API (effet immédiat dans ce processus, sous 2 s dans les autres)"""
+    if not await run_io(api_tokens.revoke, prefix):
+        raise HTTPException(status_code=404, detail="Token inconnu")
+    logger.info(f"Token d'API {prefix} révoqué par {user.username}")
+    return {"success": True, "prefix": prefix}
+
 # Route pour demande de code d'activation (public)
 @app.post("/api/request-activation-code")
 async def request_activation_code(
@@ -526,7 +646,7 @@ async def request_activation_code(
     """API publique pour demander un code d'activation"""
     try:
         # Vérifier que le projet existe
-        projects = get_all_software_configs()
+        projects = await run_io(get_all_software_configs)
         if project not in projects:
             raise HTTPException(status_code=400, detail="Projet non reconnu")
         
@@ -546,14 +666,12 @@ async def request_activation_code(
         # Générer automatiquement le code d'activation au format générique
         code = f"{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}"
         
-        codes = load_activation_codes()
-        
         # Vérifier l'unicité du code
-        while code in codes:
+        while await run_io(get_activation_code, code) is not None:
             code = f"{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}-{uuid.uuid4().hex[:4].upper()}"
         
         # Créer l'entrée du code avec les paramètres du projet
-        codes[code] = {
+        await run_io(save_activation_code, code, {
             "email": email,
             "project": project,
             "company": company,
@@ -564,9 +682,9 @@ async def request_activation_code(
             "used": False,
             "used_count": 0,
             "auto_generated": True  # Marquer comme généré automatiquement
-        }
-        
-        save_activation_codes(codes)
+        })
+        publish(CODE_GENERATED, code=code, project=project, email=email,
+                max_activations=project_config.get('max_activations', 4))
         
         return {
             "success": True,
@@ -598,14 +716,14 @@ async def download_license_by_code(request: Request, activationCode: str = Form(
         if not activationCode:
             raise HTTPException(status_code=400, detail="Code d'activation requis")
         
-        codes = load_activation_codes()
+        code_info = await run_io(get_activation_code, activationCode)
         
-        if activationCode not in codes:
+        if code_info is None:
             raise HTTPException(status_code=404, detail="Code d'activation non trouvé")
         
-        code_info = codes[activationCode]
         project_name = code_info.get('project', 'MostaGare')
-        config = load_software_config(project_name)
+        check_token_project(request, project_name)
+        config = await run_io(load_software_config, project_name)
         
         # Créer les données de licence au format exact attendu par l'application
         license_data = {
@@ -621,28 +739,21 @@ async def download_license_by_code(request: Request, activationCode: str = Form(
             "version": "1.0.0"
         }
         
-        # Générer une signature RSA compatible avec cryptography
-        # Utiliser les vraies clés RSA pour assurer la compatibilité
+        # Algorithme de signature du projet (RSA-PKCS1v15-SHA256 par défaut, ou Ed25519)
+        alg = config.get('signature_alg', "RSA-PKCS1v15-SHA256")
+        
+        # Générer une signature compatible avec cryptography
+        # Utiliser les vraies clés pour assurer la compatibilité
         try:
-            # Charger la clé privée si elle existe
-            if os.path.exists(PRIVATE_KEY_FILE):
-                with open(PRIVATE_KEY_FILE, 'rb') as f:
-                    private_key = serialization.load_pem_private_key(
-                        f.read(),
-                        password=None
-                    )
-                
+            # Clé RSA en cache si elle existe ; la paire Ed25519 est créée à la demande
+            if alg == ED25519 or await run_crypto(key_manager.private_key, generate=False) is not None:
                 # Créer le JSON canonique pour signature
                 sorted_keys = sorted(license_data.keys())
                 sorted_license = {key: license_data[key] for key in sorted_keys}
                 canonical_payload = json.dumps(sorted_license, separators=(',', ':'))
                 
-                # Signer avec RSA-PKCS1v15-SHA256 (compatible avec Node.js crypto)
-                signature_bytes = private_key.sign(
-                    canonical_payload.encode('utf-8'),
-                    padding.PKCS1v15(),
-                    hashes.SHA256()
-                )
+                # Signer (RSA-PKCS1v15-SHA256 ou Ed25519, compatibles avec Node.js crypto)
+                signature_bytes = await run_crypto(license_signer.sign, canonical_payload.encode('utf-8'), alg)
                 signature = signature_bytes.hex()
             else:
                 # Fallback : signature temporaire compatible
@@ -660,59 +771,64 @@ async def download_license_by_code(request: Request, activationCode: str = Form(
         signed_license = {
             "license": license_data,
             "signature": signature,
-            "alg": "RSA-PKCS1v15-SHA256"
+            "alg": alg
         }
         
         return signed_license
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erreur téléchargement licence: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/notify-activation")
 async def notify_activation(
+    request: Request,
     activationCode: str = Form(...),
     machineId: str = Form(...),
     machineName: str = Form(None)
 ):
     """Notifier le serveur qu'une activation a eu lieu"""
     try:
-        codes = load_activation_codes()
-        
-        if activationCode not in codes:
-            raise HTTPException(status_code=404, detail="Code d'activation non trouvé")
-        
-        code_info = codes[activationCode]
-        
-        # Incrémenter le compteur d'utilisation
-        current_count = code_info.get('used_count', 0)
-        code_info['used_count'] = current_count + 1
-        
-        # Marquer comme utilisé si c'est la première activation
-        if not code_info.get('used', False):
-            code_info['used'] = True
-            code_info['first_activation_at'] = datetime.now().isoformat()
+        async with code_lock:
+            code_info = await run_io(get_activation_code, activationCode)
+        
+            if code_info is None:
+                raise HTTPException(status_code=404, detail="Code d'activation non trouvé")
+            check_token_project(request, code_info.get('project', 'MostaGare'))
+        
+            # Incrémenter le compteur d'utilisation
+            current_count = code_info.get('used_count', 0)
+            code_info['used_count'] = current_count + 1
+        
+            # Marquer comme utilisé si c'est la première activation
+            if not code_info.get('used', False):
+                code_info['used'] = True
+                code_info['first_activation_at'] = datetime.now().isoformat()
+        
+            # Enregistrer les détails de la machine si pas déjà fait
+            if 'activations' not in code_info:
+                code_info['activations'] = []
+        
+            # Vérifier si cette machine est déjà dans la liste
+            machine_exists = any(
+                activation.get('machine_id') == machineId 
+                for activation in code_info['activations']
+            )
         
-        # Enregistrer les détails de la machine si pas déjà fait
-        if 'activations' not in code_info:
-            code_info['activations'] = []
+            if not machine_exists:
+                code_info['activations'].append({
+                    'machine_id': machineId,
+                    'machine_name': machineName or 'Inconnue',
+                    'activated_at': datetime.now().isoformat()
+                })
         
-        # Vérifier si cette machine est déjà dans la liste
-        machine_exists = any(
-            activation.get('machine_id') == machineId 
-            for activation in code_info['activations']
-        )
+            # Sauvegarder les modifications
+            await run_io(save_activation_code, activationCode, code_info)
         
-        if not machine_exists:
-            code_info['activations'].append({
-                'machine_id': machineId,
-                'machine_name': machineName or 'Inconnue',
-                'activated_at': datetime.now().isoformat()
-            })
-        
-        # Sauvegarder les modifications
-        codes[activationCode] = code_info
-        save_activation_codes(codes)
+        publish(ACTIVATION, activation_code=activationCode, project=code_info.get('project'),
+                machine_id=machineId, new_machine=not machine_exists)
         
         return {
             "success": True,
@@ -721,6 +837,8 @@ async def notify_activation(
             "activations": len(code_info['activations'])
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Erreur notification activation: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Script pour migrer les fichiers JSON du serveur de licences vers la base SQLite
+Importe licenses.json, activations.json (+ journal), activation_codes.json et users_conf.json
+"""
+import os
+import sys
+
+from storage import JsonStorage, SqliteStorage, SQLITE_PATH
+
+def migrate(data_dir, db_path):
+    """Importer toutes les données JSON dans la base SQLite"""
+    source = JsonStorage(data_dir)
+    target = SqliteStorage(db_path)
+
+    print(f"Migration de {data_dir} vers {db_path}...")
+    target.import_from(source)
+
+    print(f"✓ Licences importées : {len(target.list_licenses())}")
+    print(f"✓ Activations importées : {len(target.list_activations())}")
+    print(f"✓ Codes d'activation importés : {len(target.load_codes())}")
+    print(f"✓ Utilisateurs importés : {len(target.load_users())}")
+    print("\nPour utiliser la base SQLite, démarrer le serveur avec :")
+    print("  LICENSE_STORAGE_BACKEND=sqlite")
+
+if __name__ == "__main__":
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    db_path = sys.argv[2] if len(sys.argv) > 2 else (SQLITE_PATH or os.path.join(data_dir, "licenses.db"))
+
+    if os.path.exists(db_path):
+        response = input("La base SQLite existe déjà. Voulez-vous remplacer son contenu ? (y/N): ")
+        if response.lower() != 'y':
+            print("Migration annulée.")
+            sys.exit(0)
+
+    migrate(data_dir, db_path)
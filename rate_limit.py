@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Limitation de débit des routes publiques (seaux à jetons en mémoire)
+Un seau par adresse IP et un par clé de licence (ou code d'activation), rechargés au
+rythme de security.rate_limit_per_ip_per_hour de rules.json. Au-delà : 429 avec Retry-After.
+Seaux bornés (LRU), propres à chaque processus
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from email.parser import BytesParser
+from urllib.parse import parse_qs
+
+from fastapi.responses import JSONResponse
+
+from license_store import file_signature
+
+# Nombre maximum de seaux gardés (les moins récents sont oubliés, donc remis à plein)
+MAX_BUCKETS = int(os.environ.get("RATE_LIMIT_MAX_BUCKETS", "50000"))
+
+# Champs identifiant une licence dans les corps JSON ou formulaires des routes limitées
+KEY_FIELDS = ("license_key", "key", "activationCode", "activation_code")
+# Corps plus gros ignorés pour la clé (seule l'IP est alors limitée)
+MAX_BODY_INSPECTED = 64 * 1024
+
+
+class TokenBuckets:
+    """Seaux à jetons : capacité = limite horaire, recharge continue de limite / 3600 par seconde"""
+
+    def __init__(self, max_entries=MAX_BUCKETS):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()
+
+    def take(self, key, per_hour):
+        """Consommer un jeton ; retourne 0 si accordé, sinon le délai d'attente en secondes"""
+        now = time.monotonic()
+        rate = per_hour / 3600
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (per_hour, now))
+            tokens = min(per_hour, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                retry_after = 0
+            else:
+                self._buckets[key] = (tokens, now)
+                retry_after = max(1, math.ceil((1 - tokens) / rate))
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+def rules_security(rules_file):
+    """Fonction retournant la section security de rules.json, relue seulement si le fichier change"""
+    cached = {"signature": None, "security": {}}
+    lock = threading.Lock()
+
+    def security():
+        signature = file_signature(rules_file)
+        with lock:
+            if signature == cached["signature"]:
+                return cached["security"]
+        try:
+            with open(rules_file, "r") as f:
+                section = json.load(f).get("security") or {}
+        except (OSError, ValueError, AttributeError):
+            # Fichier absent ou illisible : aucun contrôle
+            section = {}
+        with lock:
+            cached["signature"] = signature
+            cached["security"] = section
+        return section
+
+    return security
+
+
+def rules_limits(rules_file):
+    """Fonction retournant (limite par IP, limite par clé) par heure depuis rules.json"""
+    security = rules_security(rules_file)
+
+    def limits():
+        section = security()
+        per_ip = section.get("rate_limit_per_ip_per_hour")
+        return per_ip, section.get("rate_limit_per_key_per_hour", per_ip)
+
+    return limits
+
+
+def _form_fields(body, content_type):
+    """Champs d'un corps JSON, urlencoded ou multipart (dictionnaire, vide si illisible)"""
+    try:
+        if content_type.startswith("application/json"):
+            data = json.loads(body)
+            return data if isinstance(data, dict) else {}
+        if content_type.startswith("application/x-www-form-urlencoded"):
+            return {name: values[0] for name, values in parse_qs(body.decode()).items()}
+        if content_type.startswith("multipart/form-data"):
+            message = BytesParser().parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+            return {
+                part.get_param("name", header="content-disposition"): part.get_payload(decode=True).decode()
+                for part in message.get_payload()
+                if part.get_filename() is None
+            }
+    except (ValueError, UnicodeDecodeError, AttributeError, TypeError):
+        pass
+    return {}
+
+
+async def license_identifier(request):
+    """Clé de licence ou code d'activation de la requête, None s'il n'y en a pas"""
+    for field in KEY_FIELDS:
+        if request.query_params.get(field):
+            return request.query_params[field]
+    length = request.headers.get("content-length")
+    if length is None or not length.isdigit() or int(length) > MAX_BODY_INSPECTED:
+        return None
+    fields = _form_fields(await request.body(), request.headers.get("content-type", ""))
+    for field in KEY_FIELDS:
+        value = fields.get(field)
+        if value and isinstance(value, str):
+            return value
+    return None
+
+
+def too_many_requests(retry_after):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"Trop de requêtes, réessayez dans {retry_after} s"},
+        headers={"Retry-After": str(retry_after)},
+    )
+
+
+def install_rate_limit(app, paths, limits, buckets=None):
+    """Limiter les routes listées (et leurs sous-chemins) par IP et par clé ; limits() retourne (par IP, par clé) par heure"""
+    buckets = buckets or TokenBuckets()
+    prefixes = tuple(path + "/" for path in paths)
+
+    @app.middleware("http")
+    async def rate_limit_middleware(request, call_next):
+        # Les routes limitées sont des POST (GET /login n'affiche que le formulaire)
+        path = request.url.path
+        if request.method != "POST" or (path not in paths and not path.startswith(prefixes)):
+            return await call_next(request)
+        per_ip, per_key = limits()
+
+        if per_ip:
+            client = request.client.host if request.client else "inconnu"
+            retry_after = buckets.take(("ip", client), per_ip)
+            if retry_after:
+                return too_many_requests(retry_after)
+
+        if per_key:
+            identifier = await license_identifier(request)
+            if identifier:
+                retry_after = buckets.take(("key", identifier), per_key)
+                if retry_after:
+                    return too_many_requests(retry_after)
+
+        return await call_next(request)
+
+    return buckets
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Historique des règles en ajout seul (rules_history.jsonl)
+Chaque enregistrement des règles ajoute une ligne contenant seulement les changements ;
+toutes les CHECKPOINT_EVERY entrées, la ligne est à la place une copie complète (point de reprise).
+Un index en mémoire (position de chaque ligne) permet de paginer l'historique et de
+reconstruire les règles à une date en ne lisant que depuis le point de reprise précédent
+(les changements d'un point de reprise sont recalculés ainsi à l'affichage)
+"""
+
+import copy
+import json
+import os
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import datetime
+
+from license_store import write_text_atomic
+
+try:
+    import fcntl
+except ImportError:  # Windows : verrouillage limité au processus
+    fcntl = None
+
+# Entrées entre deux copies complètes des règles
+CHECKPOINT_EVERY = int(os.environ.get("RULES_HISTORY_CHECKPOINT_EVERY", "20"))
+
+
+def diff_rules(old, new, path=()):
+    """Changements pour passer de old à new : {"path": [...], "value": ...} ou {"path": [...], "delete": true}"""
+    changes = []
+    for key in old:
+        if key not in new:
+            changes.append({"path": [*path, key], "delete": True})
+    for key, value in new.items():
+        previous = old.get(key)
+        if isinstance(previous, dict) and isinstance(value, dict):
+            changes.extend(diff_rules(previous, value, (*path, key)))
+        elif key not in old or previous != value:
+            changes.append({"path": [*path, key], "value": value})
+    return changes
+
+
+def apply_changes(rules, changes):
+    """Appliquer des changements (diff_rules) sur les règles, en place"""
+    for change in changes:
+        *parents, key = change["path"]
+        target = rules
+        for name in parents:
+            target = target.setdefault(name, {})
+        if change.get("delete"):
+            target.pop(key, None)
+        else:
+            target[key] = copy.deepcopy(change["value"])
+    return rules
+
+
+class RulesHistory:
+    """Journal des versions des règles : une ligne par enregistrement, index des positions en mémoire"""
+
+    def __init__(self, path, legacy_path=None, checkpoint_every=CHECKPOINT_EVERY):
+        self.path = path
+        self.legacy_path = legacy_path
+        self.lock_path = path + ".lock"
+        self.checkpoint_every = checkpoint_every
+        self._lock = threading.RLock()
+        self._offset = 0
+        # Par entrée : (horodatage, position dans le fichier, point de reprise ?)
+        self._entries = []
+        self._timestamps = []
+        self._checkpoints = []
+        # Règles de la dernière entrée (base du prochain diff)
+        self._current = None
+        self._migrated = False
+
+    @contextmanager
+    def _file_lock(self):
+        """Verrou inter-processus des ajouts"""
+        if fcntl is None:
+            yield
+            return
+        directory = os.path.dirname(self.lock_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # --- Lecture ---
+
+    def _index(self, entry, offset):
+        if "rules" in entry:
+            self._checkpoints.append(len(self._entries))
+            self._current = copy.deepcopy(entry["rules"])
+        else:
+            apply_changes(self._current, entry["changes"])
+        self._entries.append((entry["timestamp"], offset, "rules" in entry))
+        self._timestamps.append(entry["timestamp"])
+
+    def _read_tail(self):
+        """Indexer uniquement les lignes ajoutées depuis la dernière lecture"""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return
+        # Ignorer une éventuelle ligne incomplète en fin de fichier
+        end = chunk.rfind(b"\n") + 1
+        position = 0
+        for line in chunk[:end].splitlines(keepends=True):
+            if line.strip():
+                self._index(json.loads(line), self._offset + position)
+            position += len(line)
+        self._offset += end
+
+    def _refresh(self):
+        if not self._migrated:
+            with self._file_lock():
+                self._migrate_legacy()
+            self._migrated = True
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if size > self._offset:
+            self._read_tail()
+
+    def _read_entries(self, first, last):
+        """Entrées first..last (incluses) lues en un seul bloc"""
+        start = self._entries[first][1]
+        end = self._entries[last + 1][1] if last + 1 < len(self._entries) else self._offset
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            chunk = f.read(end - start)
+        return [json.loads(line) for line in chunk.splitlines() if line.strip()]
+
+    # --- Écriture ---
+
+    def _entry(self, rules, timestamp):
+        """Ligne à ajouter : règles complètes (point de reprise) ou changements ; None si rien n'a changé"""
+        changes = diff_rules(self._current or {}, rules)
+        if self._entries and not changes:
+            return None
+        if not self._checkpoints or len(self._entries) - self._checkpoints[-1] >= self.checkpoint_every:
+            return {"timestamp": timestamp, "rules": rules}
+        return {"timestamp": timestamp, "changes": changes}
+
+    def _write(self, entries):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+
+    def _migrate_legacy(self):
+        """Convertir une fois l'ancien rules_history.json (copies complètes) en journal de diffs"""
+        if not self.legacy_path or os.path.exists(self.path) or not os.path.exists(self.legacy_path):
+            return
+        with open(self.legacy_path, "r") as f:
+            legacy = json.load(f)
+        entries = []
+        for item in legacy:
+            entry = self._entry(item["rules"], item["timestamp"])
+            if entry is not None:
+                entries.append(entry)
+                self._index(entry, 0)
+        write_text_atomic(self.path, "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in entries))
+        # Index reconstruit depuis le fichier écrit (positions réelles)
+        self._entries, self._timestamps, self._checkpoints, self._current = [], [], [], None
+
+    def append(self, rules, timestamp=None):
+        """Enregistrer une version des règles (une ligne ajoutée) ; False si rien n'a changé"""
+        with self._lock:
+            self._refresh()
+            with self._file_lock():
+                # Lignes ajoutées par un autre processus avant la prise du verrou
+                self._refresh()
+                entry = self._entry(rules, timestamp or datetime.now().isoformat())
+                if entry is None:
+                    return False
+                self._write([entry])
+                self._read_tail()
+        return True
+
+    # --- Consultation ---
+
+    def page(self, cursor=None, limit=20):
+        """(entrées, curseur suivant ou None, total), plus récentes d'abord ; curseur = numéro d'entrée"""
+        with self._lock:
+            self._refresh()
+            total = len(self._entries)
+            end = min(cursor, total) if cursor is not None else total
+            start = max(0, end - limit)
+            if start >= end:
+                return [], None, total
+            # Lecture depuis le point de reprise qui précède la page : état connu avant chaque entrée
+            first = self._checkpoints[bisect_right(self._checkpoints, start - 1) - 1] if start > 0 else 0
+            entries = self._read_entries(first, end - 1)
+        page = []
+        rules = {}
+        for position, entry in enumerate(entries, first):
+            if "rules" in entry:
+                # Rejeu sur une copie : les changements affichés restent ceux de la ligne lue
+                changes = diff_rules(rules, entry["rules"]) if position >= start else None
+                rules = copy.deepcopy(entry["rules"])
+            else:
+                changes = entry["changes"]
+                apply_changes(rules, changes)
+            if position >= start:
+                page.append({"version": position + 1, "timestamp": entry["timestamp"], "changes": changes,
+                             "checkpoint": "rules" in entry})
+        return page[::-1], (start if start > 0 else None), total
+
+    def rules_at(self, timestamp=None, version=None):
+        """(numéro de version, règles) en vigueur à cette date ou à cette version ; None si aucune"""
+        with self._lock:
+            self._refresh()
+            if version is not None:
+                position = min(version, len(self._entries)) - 1
+            elif timestamp is not None:
+                position = bisect_right(self._timestamps, timestamp) - 1
+            else:
+                position = len(self._entries) - 1
+            if position < 0:
+                return None
+            checkpoint = self._checkpoints[bisect_right(self._checkpoints, position) - 1]
+            entries = self._read_entries(checkpoint, position)
+        rules = copy.deepcopy(entries[0]["rules"])
+        for entry in entries[1:]:
+            apply_changes(rules, entry["changes"])
+        return position + 1, rules
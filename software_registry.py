@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Registre des configurations de logiciels
+Fusionne une fois les fichiers de configuration (fichier multi-logiciels, fichiers
+required_email_<projet>.json, configuration par défaut) et ne les relit que lorsque
+leurs signatures changent : la résolution d'une configuration devient une lecture de dictionnaire
+"""
+
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+from license_store import file_signature
+
+logger = logging.getLogger(__name__)
+
+# Préfixe des fichiers de configuration par projet
+PROJECT_FILE_PREFIX = "required_email_"
+
+# Délai minimal entre deux scrutations du dossier de données
+CHECK_INTERVAL_SECONDS = 2
+
+
+def _read_json(path):
+    """Lire un fichier JSON en UTF-8, ou en latin-1 (anciens fichiers, dont required_email.json)"""
+    with open(path, "rb") as f:
+        raw = f.read()
+    try:
+        text = raw.decode("utf-8")
+    except UnicodeDecodeError:
+        text = raw.decode("latin-1")
+    return json.loads(text)
+
+
+class SoftwareRegistry:
+    """Configurations fusionnées des logiciels, rechargées quand un fichier source change"""
+
+    def __init__(self, data_dir, configs_file, project_files=False, default_file=None,
+                 check_interval=CHECK_INTERVAL_SECONDS):
+        self.data_dir = data_dir
+        self.configs_file = configs_file
+        self.project_files = project_files
+        self.default_file = default_file
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self._version = None
+        # (toutes les configurations, fichier multi-logiciels, fichiers par projet, défaut), remplacé d'un bloc
+        self._state = ({}, {}, {}, None)
+
+    def _sources(self):
+        """Noms des fichiers sources présents dans le dossier de données"""
+        names = []
+        if self.project_files:
+            try:
+                names = [
+                    name for name in os.listdir(self.data_dir)
+                    if name.startswith(PROJECT_FILE_PREFIX) and name.endswith(".json")
+                ]
+            except FileNotFoundError:
+                names = []
+        return sorted(names) + [self.configs_file] + ([self.default_file] if self.default_file else [])
+
+    def _scan(self):
+        return tuple((name, file_signature(os.path.join(self.data_dir, name))) for name in self._sources())
+
+    def _load(self, names):
+        multi = {}
+        path = os.path.join(self.data_dir, self.configs_file)
+        if os.path.exists(path):
+            try:
+                multi = _read_json(path)
+            except ValueError as e:
+                logger.warning(f"Erreur lecture config {self.configs_file}: {e}")
+        configs = dict(multi)
+
+        # Fichiers individuels : prioritaires, indexés par le nom de fichier et par leur projet
+        by_file = {}
+        if self.project_files:
+            for name in names:
+                if not name.startswith(PROJECT_FILE_PREFIX):
+                    continue
+                project_name = name[len(PROJECT_FILE_PREFIX):-5]
+                try:
+                    config = _read_json(os.path.join(self.data_dir, name))
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Erreur lecture config {name}: {e}")
+                    continue
+                by_file[project_name] = config
+                configs[config.get("project", project_name.title())] = config
+
+        default = None
+        if self.default_file:
+            try:
+                default = _read_json(os.path.join(self.data_dir, self.default_file))
+            except FileNotFoundError:
+                default = None
+            except (OSError, ValueError) as e:
+                logger.warning(f"Erreur lecture config {self.default_file}: {e}")
+                default = None
+
+        return configs, multi, by_file, default
+
+    def refresh(self, force=False):
+        """Recharger si un fichier source a changé (scrutation au plus toutes les check_interval secondes)"""
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked_at is not None and now - self._checked_at < self.check_interval:
+                return
+            self._checked_at = now
+            version = self._scan()
+            if version != self._version:
+                self._state = self._load([name for name, _ in version])
+                self._version = version
+
+    def version(self):
+        """Signatures des fichiers sources de l'état chargé (clé de cache des réponses)"""
+        self.refresh()
+        return self._version
+
+    def all(self):
+        """Toutes les configurations, par projet (copie du dictionnaire, configurations partagées)"""
+        self.refresh()
+        return dict(self._state[0])
+
+    def count(self):
+        self.refresh()
+        return len(self._state[0])
+
+    def get(self, project_name):
+        """Configuration d'un projet (copie) : fichier du projet, fichier multi-logiciels, puis défaut ; None sinon"""
+        self.refresh()
+        _, multi, by_file, default = self._state
+        config = by_file.get(project_name.lower())
+        if config is None:
+            config = multi.get(project_name)
+        if config is None:
+            config = default
+        return copy.deepcopy(config)
@@ -0,0 +1,816 @@
+#!/usr/bin/env python3
+"""
+Couche de stockage du serveur de licences
+Deux backends interchangeables exposant la même API :
+  - json   : fichiers historiques (licenses.json, activations.json + journal,
+             activation_codes.json, users_conf.json)
+  - sqlite : base SQLite en mode WAL, lecteurs concurrents et mises à jour ligne par ligne
+
+Sélection par variable d'environnement :
+  LICENSE_STORAGE_BACKEND=json|sqlite   (défaut : json)
+  LICENSE_SQLITE_PATH=/chemin/licenses.db (défaut : <data>/licenses.db)
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+from license_store import LicenseStore, file_signature, write_json_atomic
+from license_search import SEARCH_FIELDS, SORT_FIELDS, decode_cursor, encode_cursor
+from activation_journal import ActivationJournal, keep_latest, matches
+from dashboard_stats import CodeStats, hour_range, summarize
+
+STORAGE_BACKEND = os.environ.get("LICENSE_STORAGE_BACKEND", "json").lower()
+SQLITE_PATH = os.environ.get("LICENSE_SQLITE_PATH")
+
+
+class JsonStorage:
+    """Backend fichiers JSON (comportement historique)"""
+
+    backend = "json"
+
+    def __init__(self, data_dir):
+        self.data_dir = data_dir
+        self.licenses = LicenseStore(os.path.join(data_dir, "licenses.json"))
+        self.activations = ActivationJournal(os.path.join(data_dir, "activations.json"))
+        self.codes_file = os.path.join(data_dir, "activation_codes.json")
+        self.users_file = os.path.join(data_dir, "users_conf.json")
+        self._lock = threading.RLock()
+        # Compteurs des codes, valables pour la version du fichier de codes qui les a produits
+        self._code_stats = None
+        self._codes_signature = None
+
+    def _load_dict(self, path):
+        try:
+            with open(path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    # --- Licences ---
+
+    def has_licenses(self):
+        return self.licenses.exists()
+
+    def get_license(self, key):
+        return self.licenses.get(key)
+
+    def find_license(self, email, project):
+        return self.licenses.find_by_email_project(email, project)
+
+    def list_licenses(self):
+        return self.licenses.all()
+
+    def iter_licenses(self):
+        """Licences une par une, pour les exports en flux"""
+        return self.licenses.iter_all()
+
+    def search_licenses(self, query="", sort="created_at", descending=False, cursor=None, limit=50):
+        """Page de licences (recherche par trigrammes, tri, curseur) et curseur suivant"""
+        return self.licenses.page(query, sort, descending, cursor, limit)
+
+    def add_license(self, license_data):
+        self.licenses.add(license_data)
+
+    def update_license(self, key, update):
+        return self.licenses.update(key, update)
+
+    def update_licenses(self, updates):
+        """Mettre à jour plusieurs licences ({clé: champs}) en une seule écriture"""
+        return self.licenses.update_many(updates)
+
+    def update_licenses_by_email_project(self, email, project, updater):
+        return self.licenses.update_by_email_project(email, project, updater)
+
+    def delete_license(self, key):
+        self.licenses.delete(key)
+
+    # --- Activations ---
+
+    def list_activations(self):
+        return self.activations.all()
+
+    def iter_activations(self):
+        """Activations une par une, pour les exports en flux"""
+        return self.activations.iter_all()
+
+    def page_activations(self, project=None, status=None, date_from=None, date_to=None, cursor=None, limit=50):
+        """Page d'activations filtrées (plus récentes d'abord), curseur suivant et nombre total"""
+        return self.activations.page(project, status, date_from, date_to, cursor, limit)
+
+    def add_activation(self, record):
+        self.activations.append(record)
+
+    def add_activations(self, records):
+        self.activations.append_many(records)
+
+    def add_activation_if_available(self, record, max_activations):
+        """Ajouter l'activation si son code a encore un poste libre (vérification et ajout atomiques)
+        Retourne (ajoutée ?, activations actives avant l'ajout)"""
+        return self.activations.append_if_available(record, max_activations)
+
+    def update_activations(self, where, changes):
+        return self.activations.update_where(where, changes)
+
+    def update_activations_many(self, updates):
+        """Appliquer un lot de (filtre, changements) en une seule écriture"""
+        return self.activations.update_many(updates)
+
+    def count_active_activations(self, activation_code):
+        """Nombre d'activations actives pour un code d'activation"""
+        return self.activations.count_active(activation_code)
+
+    def list_license_devices(self, license_key):
+        """Dernière activation de chaque machine d'une licence"""
+        return self.activations.latest_by_device(license_key)
+
+    def list_devices_by_license(self):
+        """Dernière activation de chaque machine, groupée par licence"""
+        return self.activations.latest_by_license()
+
+    # --- Codes d'activation ---
+
+    def load_codes(self):
+        return self._load_dict(self.codes_file)
+
+    def iter_codes(self):
+        """Paires (code, informations), pour les exports en flux"""
+        return iter(self.load_codes().items())
+
+    def get_code(self, code):
+        return self.load_codes().get(code)
+
+    def save_code(self, code, info):
+        with self._lock:
+            current = self._code_stats is not None and file_signature(self.codes_file) == self._codes_signature
+            codes = self.load_codes()
+            codes[code] = info
+            write_json_atomic(self.codes_file, codes)
+            if current:
+                self._code_stats.add(code, info)
+                self._codes_signature = file_signature(self.codes_file)
+
+    def delete_code(self, code):
+        with self._lock:
+            current = self._code_stats is not None and file_signature(self.codes_file) == self._codes_signature
+            codes = self.load_codes()
+            if codes.pop(code, None) is not None:
+                write_json_atomic(self.codes_file, codes)
+                if current:
+                    self._code_stats.remove(code)
+                    self._codes_signature = file_signature(self.codes_file)
+
+    # --- Statistiques ---
+
+    def dashboard_stats(self, now=None):
+        """Statistiques du tableau de bord depuis les compteurs maintenus (codes, activations, postes)"""
+        now = now or datetime.now()
+        with self._lock:
+            signature = file_signature(self.codes_file)
+            if self._code_stats is None or signature != self._codes_signature:
+                # Premier accès ou fichier modifié par un autre processus : recompter une fois
+                self._code_stats = CodeStats(self.load_codes())
+                self._codes_signature = signature
+            code_projects = self._code_stats.projects()
+            expired = self._code_stats.expired(now.isoformat())
+        today, seats_used = self.activations.stats(now.date().isoformat())
+        return summarize(code_projects, expired, seats_used, today)
+
+    def activation_rollups(self, date_from=None, date_to=None, project=None, code=None):
+        """Agrégats horaires (heure, projet, code, nombre) des activations de l'intervalle"""
+        return self.activations.rollups(date_from, date_to, project, code)
+
+    # --- Utilisateurs ---
+
+    def load_users(self):
+        return self._load_dict(self.users_file)
+
+    def get_user(self, username):
+        return self.load_users().get(username)
+
+    def save_user(self, username, user_data):
+        with self._lock:
+            users = self.load_users()
+            users[username] = user_data
+            write_json_atomic(self.users_file, users)
+
+    def delete_user(self, username):
+        with self._lock:
+            users = self.load_users()
+            if users.pop(username, None) is not None:
+                write_json_atomic(self.users_file, users)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS licenses (
+    key TEXT PRIMARY KEY,
+    email TEXT NOT NULL,
+    project TEXT NOT NULL,
+    created_at TEXT,
+    expires_at TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_licenses_email_project ON licenses(email, project);
+
+CREATE TABLE IF NOT EXISTS activations (
+    rowid INTEGER PRIMARY KEY AUTOINCREMENT,
+    license_key TEXT,
+    activation_code TEXT,
+    device_id TEXT,
+    status TEXT,
+    timestamp TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activations_license_key ON activations(license_key);
+CREATE INDEX IF NOT EXISTS idx_activations_code ON activations(activation_code);
+CREATE INDEX IF NOT EXISTS idx_activations_code_status ON activations(activation_code, status);
+CREATE INDEX IF NOT EXISTS idx_activations_device_id ON activations(device_id);
+
+CREATE TABLE IF NOT EXISTS activation_codes (
+    code TEXT PRIMARY KEY,
+    project TEXT,
+    email TEXT,
+    data TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    data TEXT NOT NULL
+);
+"""
+
+# Recherche de sous-chaînes sur clé/email/projet (FTS5 trigram, SQLite >= 3.34),
+# tenue à jour par triggers
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS licenses_search USING fts5(key, email, project, tokenize='trigram');
+CREATE TRIGGER IF NOT EXISTS licenses_search_insert AFTER INSERT ON licenses BEGIN
+    INSERT INTO licenses_search (rowid, key, email, project) VALUES (new.rowid, new.key, new.email, new.project);
+END;
+CREATE TRIGGER IF NOT EXISTS licenses_search_delete AFTER DELETE ON licenses BEGIN
+    DELETE FROM licenses_search WHERE rowid = old.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS licenses_search_update AFTER UPDATE OF key, email, project ON licenses BEGIN
+    DELETE FROM licenses_search WHERE rowid = old.rowid;
+    INSERT INTO licenses_search (rowid, key, email, project) VALUES (new.rowid, new.key, new.email, new.project);
+END;
+"""
+
+# Expressions SQL équivalentes à dashboard_stats ({row} : "new.", "old." ou "")
+ACTIVATION_PROJECT = (
+    "COALESCE(NULLIF(json_extract({row}data, '$.project'), ''), "
+    "NULLIF(json_extract({row}data, '$.license_data.data.project'), ''), '')"
+)
+ACTIVATION_HOUR = "substr(COALESCE({row}timestamp, ''), 1, 13)"
+CODE_USED = "(COALESCE(json_extract({row}data, '$.used'), 0) != 0)"
+CODE_SEATS = "COALESCE(json_extract({row}data, '$.max_activations'), 0)"
+CODE_EXPIRES_AT = "json_extract({row}data, '$.expires_at')"
+
+
+def _activation_stats_sql(row, delta):
+    project = ACTIVATION_PROJECT.format(row=row)
+    return f"""
+    INSERT INTO activation_rollups (hour, project, activation_code, count)
+        VALUES ({ACTIVATION_HOUR.format(row=row)}, {project}, COALESCE({row}activation_code, ''), {delta})
+        ON CONFLICT(hour, project, activation_code) DO UPDATE SET count = count + excluded.count;
+    INSERT INTO activation_seats (project, active) SELECT {project}, {delta}
+        WHERE {row}status = 'active' AND {row}activation_code IS NOT NULL
+        ON CONFLICT(project) DO UPDATE SET active = active + excluded.active;"""
+
+
+def _code_stats_sql(row, delta):
+    return f"""
+    INSERT INTO code_stats (project, total, used, seats)
+        VALUES (COALESCE({row}project, ''), {delta}, {delta} * {CODE_USED.format(row=row)}, {delta} * {CODE_SEATS.format(row=row)})
+        ON CONFLICT(project) DO UPDATE SET total = total + excluded.total,
+            used = used + excluded.used, seats = seats + excluded.seats;"""
+
+
+# Compteurs du tableau de bord tenus à jour par triggers (toutes écritures, tous processus)
+STATS_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS activation_rollups (
+    hour TEXT NOT NULL,
+    project TEXT NOT NULL,
+    activation_code TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (hour, project, activation_code)
+);
+CREATE TABLE IF NOT EXISTS activation_seats (project TEXT PRIMARY KEY, active INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS code_stats (
+    project TEXT PRIMARY KEY,
+    total INTEGER NOT NULL,
+    used INTEGER NOT NULL,
+    seats INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_activations_project_timestamp
+    ON activations({ACTIVATION_PROJECT.format(row="")}, timestamp);
+CREATE INDEX IF NOT EXISTS idx_activations_timestamp ON activations(timestamp);
+CREATE INDEX IF NOT EXISTS idx_codes_unused_expiry ON activation_codes({CODE_EXPIRES_AT.format(row="")})
+    WHERE NOT {CODE_USED.format(row="")};
+
+CREATE TRIGGER IF NOT EXISTS activations_stats_insert AFTER INSERT ON activations BEGIN
+    {_activation_stats_sql("new.", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS activations_stats_delete AFTER DELETE ON activations BEGIN
+    {_activation_stats_sql("old.", -1)}
+END;
+CREATE TRIGGER IF NOT EXISTS activations_stats_update AFTER UPDATE ON activations BEGIN
+    {_activation_stats_sql("old.", -1)}
+    {_activation_stats_sql("new.", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS codes_stats_insert AFTER INSERT ON activation_codes BEGIN
+    {_code_stats_sql("new.", 1)}
+END;
+CREATE TRIGGER IF NOT EXISTS codes_stats_delete AFTER DELETE ON activation_codes BEGIN
+    {_code_stats_sql("old.", -1)}
+END;
+CREATE TRIGGER IF NOT EXISTS codes_stats_update AFTER UPDATE ON activation_codes BEGIN
+    {_code_stats_sql("old.", -1)}
+    {_code_stats_sql("new.", 1)}
+END;
+"""
+
+# Recalcul complet des compteurs (base créée avant les triggers)
+STATS_BACKFILL = f"""
+DELETE FROM activation_rollups;
+INSERT INTO activation_rollups (hour, project, activation_code, count)
+    SELECT {ACTIVATION_HOUR.format(row="")}, {ACTIVATION_PROJECT.format(row="")}, COALESCE(activation_code, ''), COUNT(*)
+    FROM activations GROUP BY 1, 2, 3;
+DELETE FROM activation_seats;
+INSERT INTO activation_seats (project, active)
+    SELECT {ACTIVATION_PROJECT.format(row="")}, COUNT(*) FROM activations
+    WHERE status = 'active' AND activation_code IS NOT NULL GROUP BY 1;
+DELETE FROM code_stats;
+INSERT INTO code_stats (project, total, used, seats)
+    SELECT COALESCE(project, ''), COUNT(*), SUM({CODE_USED.format(row="")}), SUM({CODE_SEATS.format(row="")})
+    FROM activation_codes GROUP BY 1;
+"""
+
+# Colonnes indexées utilisables directement dans un filtre d'activations
+ACTIVATION_COLUMNS = ("license_key", "activation_code", "device_id", "status")
+
+
+def _activation_columns(record):
+    return (
+        record.get("license_key"),
+        record.get("activation_code"),
+        record.get("device_id") or record.get("machine_id"),
+        record.get("status"),
+        record.get("timestamp") or record.get("activated_at"),
+        json.dumps(record),
+    )
+
+
+class SqliteStorage:
+    """Backend SQLite en mode WAL : une connexion par thread, écritures ligne par ligne"""
+
+    backend = "sqlite"
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        try:
+            conn.executescript(SEARCH_SCHEMA)
+            self._fts = True
+        except sqlite3.OperationalError:
+            # SQLite sans FTS5 trigram : recherche par instr()
+            self._fts = False
+        conn.executescript(STATS_SCHEMA)
+        with self._transaction() as conn:
+            activations = conn.execute("SELECT COUNT(*) FROM activations").fetchone()[0]
+            counted = conn.execute("SELECT COALESCE(SUM(count), 0) FROM activation_rollups").fetchone()[0]
+            codes = conn.execute("SELECT COUNT(*) FROM activation_codes").fetchone()[0]
+            counted_codes = conn.execute("SELECT COALESCE(SUM(total), 0) FROM code_stats").fetchone()[0]
+            if activations != counted or codes != counted_codes:
+                # Base créée avant les compteurs : les calculer une fois
+                for statement in STATS_BACKFILL.split(";"):
+                    if statement.strip():
+                        conn.execute(statement)
+        if self._fts:
+            with self._transaction() as conn:
+                count = conn.execute("SELECT COUNT(*) FROM licenses").fetchone()[0]
+                indexed = conn.execute("SELECT COUNT(*) FROM licenses_search").fetchone()[0]
+                if count != indexed:
+                    # Base créée avant l'index de recherche : le remplir une fois
+                    conn.execute("DELETE FROM licenses_search")
+                    conn.execute(
+                        "INSERT INTO licenses_search (rowid, key, email, project) "
+                        "SELECT rowid, key, email, project FROM licenses"
+                    )
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            # INSERT OR REPLACE doit déclencher le trigger de suppression de l'index de recherche
+            conn.execute("PRAGMA recursive_triggers=ON")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        """Transaction d'écriture ; BEGIN IMMEDIATE évite les pertes de mise à jour entre workers"""
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _query(self, sql, params=()):
+        return self._connection().execute(sql, params).fetchall()
+
+    def _iter_rows(self, table, columns, batch_size=500):
+        """Parcourir une table par lots de rowid : mémoire constante, et chaque lot est lu
+        avec la connexion du thread courant (un flux peut changer de thread entre deux lots)"""
+        last_rowid = 0
+        while True:
+            rows = self._query(
+                f"SELECT rowid, {columns} FROM {table} WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, batch_size),
+            )
+            if not rows:
+                return
+            for row in rows:
+                yield row[1:]
+            last_rowid = rows[-1][0]
+
+    # --- Licences ---
+
+    def has_licenses(self):
+        return bool(self._query("SELECT 1 FROM licenses LIMIT 1"))
+
+    def get_license(self, key):
+        rows = self._query("SELECT data FROM licenses WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def find_license(self, email, project):
+        rows = self._query(
+            "SELECT data FROM licenses WHERE email = ? AND project = ? ORDER BY rowid LIMIT 1",
+            (email, project),
+        )
+        return json.loads(rows[0][0]) if rows else None
+
+    def list_licenses(self):
+        return [json.loads(row[0]) for row in self._query("SELECT data FROM licenses ORDER BY rowid")]
+
+    def iter_licenses(self):
+        for (data,) in self._iter_rows("licenses", "data"):
+            yield json.loads(data)
+
+    def search_licenses(self, query="", sort="created_at", descending=False, cursor=None, limit=50):
+        """Page de licences (recherche FTS5 trigram, tri, curseur) et curseur suivant"""
+        if sort not in SORT_FIELDS:
+            raise ValueError(f"Tri non supporté : {sort}")
+        conditions = []
+        params = []
+        query = query.lower()
+        if query and self._fts and len(query) >= 3:
+            conditions.append("rowid IN (SELECT rowid FROM licenses_search WHERE licenses_search MATCH ?)")
+            params.append('"' + query.replace('"', '""') + '"')
+        elif query:
+            conditions.append("(" + " OR ".join(f"instr(lower({field}), ?) > 0" for field in SEARCH_FIELDS) + ")")
+            params.extend([query] * len(SEARCH_FIELDS))
+        if cursor:
+            conditions.append(f"(COALESCE({sort}, ''), key) {'<' if descending else '>'} (?, ?)")
+            params.extend(decode_cursor(cursor))
+        direction = "DESC" if descending else "ASC"
+        sql = "SELECT data FROM licenses"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f" ORDER BY COALESCE({sort}, '') {direction}, key {direction} LIMIT ?"
+        params.append(limit + 1)
+        licenses = [json.loads(row[0]) for row in self._query(sql, tuple(params))]
+        next_cursor = None
+        if len(licenses) > limit:
+            licenses = licenses[:limit]
+            last = licenses[-1]
+            next_cursor = encode_cursor(last.get(sort) or "", last["key"])
+        return licenses, next_cursor
+
+    def _write_license(self, conn, lic):
+        conn.execute(
+            "INSERT OR REPLACE INTO licenses (key, email, project, created_at, expires_at, data) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (lic["key"], lic["email"], lic["project"], lic.get("created_at"),
+             lic.get("expires_at"), json.dumps(lic)),
+        )
+
+    def add_license(self, license_data):
+        with self._transaction() as conn:
+            self._write_license(conn, license_data)
+
+    def _rewrite_license(self, conn, key, lic):
+        """Mettre à jour une licence existante (même rowid) : données JSON et colonnes indexées"""
+        conn.execute(
+            "UPDATE licenses SET email = ?, project = ?, created_at = ?, expires_at = ?, data = ? WHERE key = ?",
+            (lic["email"], lic["project"], lic.get("created_at"), lic.get("expires_at"), json.dumps(lic), key),
+        )
+
+    def _update_license(self, conn, key, update):
+        rows = conn.execute("SELECT data FROM licenses WHERE key = ?", (key,)).fetchall()
+        if not rows:
+            return False
+        lic = json.loads(rows[0][0])
+        lic.update(update)
+        self._rewrite_license(conn, key, lic)
+        return True
+
+    def update_license(self, key, update):
+        with self._transaction() as conn:
+            return self._update_license(conn, key, update)
+
+    def update_licenses(self, updates):
+        """Mettre à jour plusieurs licences ({clé: champs}) dans une seule transaction"""
+        with self._transaction() as conn:
+            return [key for key, update in updates.items() if self._update_license(conn, key, update)]
+
+    def update_licenses_by_email_project(self, email, project, updater):
+        updated = []
+        with self._transaction() as conn:
+            rows = conn.execute(
+                "SELECT key, data FROM licenses WHERE email = ? AND project = ? ORDER BY rowid",
+                (email, project),
+            ).fetchall()
+            for key, data in rows:
+                lic = json.loads(data)
+                updater(lic)
+                self._rewrite_license(conn, key, lic)
+                updated.append(lic)
+        return updated
+
+    def delete_license(self, key):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM licenses WHERE key = ?", (key,))
+
+    # --- Activations ---
+
+    def list_activations(self):
+        return [json.loads(row[0]) for row in self._query("SELECT data FROM activations ORDER BY rowid")]
+
+    def iter_activations(self):
+        for (data,) in self._iter_rows("activations", "data"):
+            yield json.loads(data)
+
+    def page_activations(self, project=None, status=None, date_from=None, date_to=None, cursor=None, limit=50):
+        """Page d'activations filtrées (plus récentes d'abord), curseur suivant et nombre total (COUNT indexé)"""
+        conditions = []
+        params = []
+        if project is not None:
+            conditions.append(f"{ACTIVATION_PROJECT.format(row='')} = ?")
+            params.append(project)
+        if status is not None:
+            conditions.append("status = ?")
+            params.append(status)
+        # Mêmes bornes que les agrégats horaires, comparées à l'horodatage complet (indexé)
+        start, end = hour_range(date_from, date_to)
+        if start:
+            conditions.append("timestamp >= ?")
+            params.append(start)
+        if end:
+            conditions.append("timestamp < ?")
+            params.append(end)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        total = self._query("SELECT COUNT(*) FROM activations" + where, tuple(params))[0][0]
+        if cursor is not None:
+            conditions.append("rowid < ?")
+            params.append(cursor)
+            where = " WHERE " + " AND ".join(conditions)
+        rows = self._query(
+            "SELECT rowid, data FROM activations" + where + " ORDER BY rowid DESC LIMIT ?",
+            tuple(params) + (limit + 1,),
+        )
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        return [json.loads(data) for _, data in rows], next_cursor, total
+
+    def add_activation(self, record):
+        self.add_activations([record])
+
+    def add_activations(self, records):
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO activations (license_key, activation_code, device_id, status, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [_activation_columns(record) for record in records],
+            )
+
+    def add_activation_if_available(self, record, max_activations):
+        """Ajouter l'activation si son code a encore un poste libre, dans une seule transaction
+        (BEGIN IMMEDIATE : le comptage et l'insertion ne peuvent pas s'entrelacer entre workers)"""
+        with self._transaction() as conn:
+            active = conn.execute(
+                "SELECT COUNT(*) FROM activations WHERE activation_code = ? AND status = 'active'",
+                (record.get("activation_code"),),
+            ).fetchone()[0]
+            if active >= max_activations:
+                return False, active
+            conn.execute(
+                "INSERT INTO activations (license_key, activation_code, device_id, status, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                _activation_columns(record),
+            )
+        return True, active
+
+    def _update_activations(self, conn, where, changes):
+        indexed = {field: value for field, value in where.items() if field in ACTIVATION_COLUMNS}
+        sql = "SELECT rowid, data FROM activations"
+        if indexed:
+            sql += " WHERE " + " AND ".join(f"{field} = ?" for field in indexed)
+        count = 0
+        for rowid, data in conn.execute(sql, tuple(indexed.values())).fetchall():
+            record = json.loads(data)
+            if not matches(record, where):
+                continue
+            record.update(changes)
+            columns = _activation_columns(record)
+            conn.execute(
+                "UPDATE activations SET license_key = ?, activation_code = ?, device_id = ?, "
+                "status = ?, timestamp = ?, data = ? WHERE rowid = ?",
+                columns + (rowid,),
+            )
+            count += 1
+        return count
+
+    def update_activations(self, where, changes):
+        """Mettre à jour les activations correspondant au filtre ; retourne le nombre modifié"""
+        with self._transaction() as conn:
+            return self._update_activations(conn, where, changes)
+
+    def update_activations_many(self, updates):
+        """Appliquer un lot de (filtre, changements) dans une seule transaction"""
+        with self._transaction() as conn:
+            return sum(self._update_activations(conn, where, changes) for where, changes in updates)
+
+    def count_active_activations(self, activation_code):
+        """Nombre d'activations actives pour un code d'activation (index activation_code, status)"""
+        rows = self._query(
+            "SELECT COUNT(*) FROM activations WHERE activation_code = ? AND status = 'active'",
+            (activation_code,),
+        )
+        return rows[0][0]
+
+    def list_license_devices(self, license_key):
+        """Dernière activation de chaque machine d'une licence (index license_key)"""
+        devices = {}
+        for (data,) in self._query(
+            "SELECT data FROM activations WHERE license_key = ? ORDER BY rowid", (license_key,)
+        ):
+            keep_latest(devices, json.loads(data))
+        return list(devices.values())
+
+    def list_devices_by_license(self):
+        """Dernière activation de chaque machine, groupée par licence (un seul parcours)"""
+        by_license = {}
+        for license_key, data in self._query(
+            "SELECT license_key, data FROM activations WHERE license_key IS NOT NULL ORDER BY rowid"
+        ):
+            keep_latest(by_license.setdefault(license_key, {}), json.loads(data))
+        return {license_key: list(devices.values()) for license_key, devices in by_license.items()}
+
+    # --- Codes d'activation ---
+
+    def load_codes(self):
+        return {code: json.loads(data) for code, data in self._query("SELECT code, data FROM activation_codes ORDER BY rowid")}
+
+    def iter_codes(self):
+        for code, data in self._iter_rows("activation_codes", "code, data"):
+            yield code, json.loads(data)
+
+    def get_code(self, code):
+        rows = self._query("SELECT data FROM activation_codes WHERE code = ?", (code,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_code(self, code, info):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO activation_codes (code, project, email, data) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(code) DO UPDATE SET project = excluded.project, email = excluded.email, data = excluded.data",
+                (code, info.get("project"), info.get("email"), json.dumps(info)),
+            )
+
+    def delete_code(self, code):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM activation_codes WHERE code = ?", (code,))
+
+    # --- Statistiques ---
+
+    def dashboard_stats(self, now=None):
+        """Statistiques du tableau de bord depuis les compteurs tenus par triggers"""
+        now = now or datetime.now()
+        code_projects = {
+            project: (total, used, seats)
+            for project, total, used, seats in self._query("SELECT project, total, used, seats FROM code_stats WHERE total != 0")
+        }
+        # Codes non utilisés expirés : index partiel sur l'expiration
+        expired = self._query(
+            f"SELECT COUNT(*) FROM activation_codes WHERE NOT {CODE_USED.format(row='')} "
+            f"AND {CODE_EXPIRES_AT.format(row='')} <= ?",
+            (now.isoformat(),),
+        )[0][0]
+        seats_used = dict(self._query("SELECT project, active FROM activation_seats WHERE active != 0"))
+        day = now.date().isoformat()
+        today = {}
+        for _, project, _, count in self.activation_rollups(day, day):
+            today[project] = today.get(project, 0) + count
+        return summarize(code_projects, expired, seats_used, today)
+
+    def activation_rollups(self, date_from=None, date_to=None, project=None, code=None):
+        """Agrégats horaires (heure, projet, code, nombre) de l'intervalle (clé primaire par heure)"""
+        start, end = hour_range(date_from, date_to)
+        conditions = ["hour >= ?", "count != 0"]
+        params = [start]
+        if end:
+            conditions.append("hour < ?")
+            params.append(end)
+        if project is not None:
+            conditions.append("project = ?")
+            params.append(project)
+        if code is not None:
+            conditions.append("activation_code = ?")
+            params.append(code)
+        return self._query(
+            "SELECT hour, project, activation_code, count FROM activation_rollups WHERE "
+            + " AND ".join(conditions) + " ORDER BY hour",
+            tuple(params),
+        )
+
+    # --- Utilisateurs ---
+
+    def load_users(self):
+        return {username: json.loads(data) for username, data in self._query("SELECT username, data FROM users ORDER BY rowid")}
+
+    def get_user(self, username):
+        rows = self._query("SELECT data FROM users WHERE username = ?", (username,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def save_user(self, username, user_data):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO users (username, data) VALUES (?, ?) "
+                "ON CONFLICT(username) DO UPDATE SET data = excluded.data",
+                (username, json.dumps(user_data)),
+            )
+
+    def delete_user(self, username):
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM users WHERE username = ?", (username,))
+
+    # --- Migration ---
+
+    def import_from(self, source):
+        """Importer tout le contenu d'un autre backend (remplace les données existantes)"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM licenses")
+            conn.execute("DELETE FROM activations")
+            conn.execute("DELETE FROM activation_codes")
+            conn.execute("DELETE FROM users")
+            for lic in source.list_licenses():
+                self._write_license(conn, lic)
+            conn.executemany(
+                "INSERT INTO activations (license_key, activation_code, device_id, status, timestamp, data) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [_activation_columns(record) for record in source.list_activations()],
+            )
+            conn.executemany(
+                "INSERT INTO activation_codes (code, project, email, data) VALUES (?, ?, ?, ?)",
+                [(code, info.get("project"), info.get("email"), json.dumps(info))
+                 for code, info in source.load_codes().items()],
+            )
+            conn.executemany(
+                "INSERT INTO users (username, data) VALUES (?, ?)",
+                [(username, json.dumps(data)) for username, data in source.load_users().items()],
+            )
+
+
+_storages = {}
+_storages_lock = threading.Lock()
+
+
+def get_storage(data_dir, backend=None):
+    """Backend de stockage configuré pour ce dossier de données (instance partagée par processus)"""
+    backend = (backend or STORAGE_BACKEND).lower()
+    cache_key = (os.path.abspath(data_dir), backend)
+    with _storages_lock:
+        if cache_key not in _storages:
+            if backend == "sqlite":
+                _storages[cache_key] = SqliteStorage(SQLITE_PATH or os.path.join(data_dir, "licenses.db"))
+            elif backend == "json":
+                _storages[cache_key] = JsonStorage(data_dir)
+            else:
+                raise ValueError(f"Backend de stockage inconnu : {backend}")
+        return _storages[cache_key]
@@ -0,0 +1,155 @@
+import random
+import threading
+
+import pytest
+
+import activation_journal
+
+from activation_journal import ActivationJournal
+from dashboard_stats import activation_hour, record_project
+
+PROJECTS = ["MostaGare", "Ecrimaths", "InventoryPro"]
+
+
+@pytest.fixture
+def journal(tmp_path):
+    rng = random.Random(7)
+    journal = ActivationJournal(str(tmp_path / "activations.json"), compact_every=50)
+    journal.append_many([
+        {
+            "license_key": f"KEY-{i % 10}",
+            "device_id": f"device-{i}",
+            "project": rng.choice(PROJECTS),
+            "status": "active",
+            "timestamp": f"2024-03-{1 + i % 28:02d}T{i % 24:02d}:00:00",
+        }
+        for i in range(120)
+    ])
+    for i in range(0, 120, 7):
+        journal.update_where({"device_id": f"device-{i}"}, {"status": "deactivated"})
+    return journal
+
+
+def journal_files(directory):
+    """Journaux présents (actif ou renommés par une compaction), hors fichier de verrou"""
+    return [path.name for path in directory.glob("activations.journal.jsonl*") if path.suffix != ".lock"]
+
+
+def expected(records, project, status, date_from, date_to):
+    start, end = date_from or "", (date_to + "~") if date_to else None
+    return [
+        record for record in reversed(records)
+        if (project is None or record_project(record) == project)
+        and (status is None or record["status"] == status)
+        and start <= activation_hour(record) and (end is None or activation_hour(record) < end)
+    ]
+
+
+@pytest.mark.parametrize("project", [None, "Ecrimaths"])
+@pytest.mark.parametrize("status", [None, "active", "deactivated"])
+@pytest.mark.parametrize("dates", [(None, None), ("2024-03-05", "2024-03-12")])
+def test_page_matches_full_scan(journal, project, status, dates):
+    wanted = expected(journal.all(), project, status, *dates)
+    seen = []
+    cursor = None
+    while True:
+        page, cursor, total = journal.page(project, status, *dates, cursor=cursor, limit=6)
+        assert total == len(wanted)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert seen == wanted
+
+
+def test_status_change_moves_record(journal):
+    journal.update_where({"device_id": "device-1"}, {"status": "deactivated"})
+    page, _, _ = journal.page(status="deactivated", limit=1000)
+    assert "device-1" in {record["device_id"] for record in page}
+    page, _, _ = journal.page(status="active", limit=1000)
+    assert "device-1" not in {record["device_id"] for record in page}
+
+
+def test_compaction_runs_in_background(tmp_path):
+    journal = ActivationJournal(str(tmp_path / "activations.json"), compact_every=5)
+    for i in range(5):
+        journal.append({"license_key": "KEY-1", "device_id": f"device-{i}", "status": "active"})
+    journal._compactor.join(timeout=5)
+    assert journal_files(tmp_path) == []
+    reloaded = ActivationJournal(str(tmp_path / "activations.json"))
+    assert [record["device_id"] for record in reloaded.all()] == [f"device-{i}" for i in range(5)]
+
+
+@pytest.mark.parametrize("crash_at", ["write_json_atomic", "remove"])
+def test_crash_during_compaction_does_not_duplicate(tmp_path, monkeypatch, crash_at):
+    snapshot = str(tmp_path / "activations.json")
+    journal = ActivationJournal(snapshot, compact_every=0)
+    journal.append_many([
+        {"license_key": "KEY-1", "activation_code": "CODE-1", "device_id": f"device-{i}", "status": "active"}
+        for i in range(3)
+    ])
+
+    def crash(*args, **kwargs):
+        if crash_at == "write_json_atomic":
+            raise OSError("arrêt simulé avant l'instantané")
+        raise OSError("arrêt simulé après l'instantané")
+
+    if crash_at == "write_json_atomic":
+        monkeypatch.setattr(activation_journal, "write_json_atomic", crash)
+    else:
+        monkeypatch.setattr(activation_journal.os, "remove", crash)
+    with pytest.raises(OSError):
+        journal.compact()
+    monkeypatch.undo()
+
+    reloaded = ActivationJournal(snapshot, compact_every=0)
+    assert [record["device_id"] for record in reloaded.all()] == ["device-0", "device-1", "device-2"]
+    assert reloaded.count_active("CODE-1") == 3
+
+    # Les ajouts suivants et une nouvelle compaction repartent d'un état propre
+    reloaded.append({"license_key": "KEY-1", "activation_code": "CODE-1", "device_id": "device-3", "status": "active"})
+    reloaded.compact()
+    assert journal_files(tmp_path) == []
+    assert ActivationJournal(snapshot).count_active("CODE-1") == 4
+
+
+def test_legacy_list_snapshot(tmp_path):
+    snapshot = tmp_path / "activations.json"
+    snapshot.write_text('[{"license_key": "KEY-1", "device_id": "device-0", "status": "active"}]')
+    journal = ActivationJournal(str(snapshot))
+    journal.append({"license_key": "KEY-1", "device_id": "device-1", "status": "active"})
+    journal.compact()
+    assert [record["device_id"] for record in ActivationJournal(str(snapshot)).all()] == ["device-0", "device-1"]
+
+
+def test_large_heartbeat_lines_trigger_compaction(tmp_path):
+    snapshot = str(tmp_path / "activations.json")
+    journal = ActivationJournal(snapshot, compact_every=1000, compact_bytes=4096)
+    journal.append_many([{"license_key": "KEY-1", "device_id": f"device-{i}", "status": "active"} for i in range(100)])
+    journal._compactor.join(timeout=5)
+    # Un seul lot de heartbeats : une ligne, mais de plus de compact_bytes octets
+    journal.update_many([
+        ({"license_key": "KEY-1", "device_id": f"device-{i}", "status": "active"}, {"last_seen": "2024-03-01T10:00:00"})
+        for i in range(100)
+    ])
+    journal._compactor.join(timeout=5)
+    assert journal_files(tmp_path) == []
+    assert all(record["last_seen"] == "2024-03-01T10:00:00" for record in ActivationJournal(snapshot).all())
+
+
+def test_seat_limit_shared_between_instances(tmp_path):
+    # Deux instances sur les mêmes fichiers : comme deux workers, chacune avec son propre verrou de fichier
+    snapshot = str(tmp_path / "activations.json")
+    journals = [ActivationJournal(snapshot), ActivationJournal(snapshot)]
+    results = []
+
+    def activate(n):
+        record = {"license_key": "KEY-1", "activation_code": "CODE-1", "device_id": f"device-{n}", "status": "active"}
+        results.append(journals[n % 2].append_if_available(record, 5)[0])
+
+    threads = [threading.Thread(target=activate, args=(n,)) for n in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count(True) == 5
+    assert ActivationJournal(snapshot).count_active("CODE-1") == 5
@@ -0,0 +1,39 @@
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from api_tokens import ApiTokenStore, check_token_project, install_api_token_auth
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ApiTokenStore(str(tmp_path / "api_tokens.json"))
+
+
+@pytest.fixture
+def client(store):
+    app = FastAPI()
+
+    @app.post("/api/download-license/{project}")
+    def download(project: str, request: Request):
+        check_token_project(request, project)
+        return {"project": project}
+
+    install_api_token_auth(app, {"/api/download-license"}, store, lambda: {"require_api_token": True})
+    return TestClient(app)
+
+
+def test_token_required(client, store):
+    assert client.post("/api/download-license/MostaGare").status_code == 401
+    token, _ = store.create("Client")
+    response = client.post("/api/download-license/MostaGare", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+
+def test_project_scope_enforced(client, store):
+    token, record = store.create("Client ACME", "MostaGare")
+    headers = {"X-API-Token": token}
+    assert client.post("/api/download-license/mostagare", headers=headers).status_code == 200
+    assert client.post("/api/download-license/Ecrimaths", headers=headers).status_code == 403
+    store.revoke(record["prefix"])
+    assert client.post("/api/download-license/MostaGare", headers=headers).status_code == 401
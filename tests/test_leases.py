@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from key_manager import get_key_manager, get_license_signer, get_license_verifier
+from leases import issue_lease, verify_lease
+
+LICENSE = {
+    "key": "KEY-1",
+    "project": "MostaGare",
+    "expires_at": (datetime.now() + timedelta(days=30)).isoformat(),
+}
+
+
+@pytest.fixture
+def keys(tmp_path):
+    private_path, public_path = str(tmp_path / "private.pem"), str(tmp_path / "public.pem")
+    get_key_manager(private_path, public_path).generate()
+    return get_license_signer(private_path, public_path), get_license_verifier(private_path, public_path)
+
+
+def test_valid_lease(keys):
+    signer, verifier = keys
+    signed = issue_lease(signer, LICENSE, "device-1", 24)
+    assert verify_lease(verifier, signed, "KEY-1", "device-1")
+    assert not verify_lease(verifier, signed, "KEY-1", "device-2")
+
+
+@pytest.mark.parametrize("previous_lease", [
+    {"lease": "not-a-lease", "signature": "00"},
+    {"lease": ["key", "device_id"], "signature": "00"},
+    {"lease": None, "signature": "00"},
+    {"lease": {"key": "KEY-1"}, "signature": "00"},
+    {"lease": {"key": "KEY-1", "device_id": "device-1"}, "signature": "zz"},
+    {"signature": "00"},
+    {"lease": {}, "signature": "00", "alg": ["rsa"]},
+    "string",
+    ["lease"],
+])
+def test_malformed_previous_lease(keys, previous_lease):
+    _, verifier = keys
+    assert verify_lease(verifier, previous_lease, "KEY-1", "device-1") is False
+
+
+def test_tampered_lease(keys):
+    signer, verifier = keys
+    signed = issue_lease(signer, LICENSE, "device-1", 24)
+    signed["lease"]["expires_at"] = (datetime.now() + timedelta(days=365)).isoformat()
+    assert not verify_lease(verifier, signed, "KEY-1", "device-1")
@@ -0,0 +1,25 @@
+import json
+import threading
+
+from license_store import write_json_atomic
+
+
+def test_concurrent_atomic_writes(tmp_path):
+    path = tmp_path / "licenses.json"
+    errors = []
+
+    def write(n):
+        try:
+            for i in range(20):
+                write_json_atomic(str(path), [{"writer": n, "i": i}] * 50)
+        except OSError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(json.loads(path.read_text())) == 50
+    assert [p.name for p in tmp_path.iterdir()] == ["licenses.json"]
@@ -0,0 +1,38 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rate_limit import install_rate_limit
+
+
+def make_client(per_ip, per_key):
+    app = FastAPI()
+
+    @app.post("/api/activate")
+    def activate(payload: dict):
+        return {"status": "activated"}
+
+    @app.post("/api/activate/bulk")
+    def bulk_activate(payload: dict):
+        return {"activated": len(payload["activations"])}
+
+    install_rate_limit(app, {"/api/activate"}, lambda: (per_ip, per_key))
+    return TestClient(app)
+
+
+def test_bulk_requests_are_throttled():
+    client = make_client(2, None)
+    body = {"activations": [{"license_key": "KEY-1", "device_id": "d1"}]}
+    assert client.post("/api/activate/bulk", json=body).status_code == 200
+    assert client.post("/api/activate/bulk", json=body).status_code == 200
+    response = client.post("/api/activate/bulk", json=body)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    # Même seau par IP que la route unitaire
+    assert client.post("/api/activate", json={"license_key": "KEY-2"}).status_code == 429
+
+
+def test_limit_by_key():
+    client = make_client(None, 1)
+    assert client.post("/api/activate", json={"license_key": "KEY-1"}).status_code == 200
+    assert client.post("/api/activate", json={"license_key": "KEY-1"}).status_code == 429
+    assert client.post("/api/activate", json={"license_key": "KEY-2"}).status_code == 200
@@ -0,0 +1,57 @@
+import json
+import random
+
+from rules_history import RulesHistory, apply_changes, diff_rules
+
+
+def versions(count):
+    rng = random.Random(3)
+    rules = {"default_rules": {"max_activations": 3}, "projects": []}
+    result = []
+    for i in range(count):
+        rules = json.loads(json.dumps(rules))
+        rules["default_rules"]["max_activations"] = rng.randint(1, 5)
+        rules["revision"] = i
+        if i % 4 == 0:
+            rules["projects"].append({"id": f"P{i}"})
+        rules["default_rules"].pop("track", None) if i % 3 else rules["default_rules"].update(track=i)
+        result.append(rules)
+    return result
+
+
+def test_checkpoints_store_only_full_rules(tmp_path):
+    path = str(tmp_path / "rules_history.jsonl")
+    history = RulesHistory(path, checkpoint_every=5)
+    all_rules = versions(23)
+    for i, rules in enumerate(all_rules):
+        history.append(rules, f"2024-01-01T00:{i:02d}:00")
+
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    checkpoints = [line for line in lines if "rules" in line]
+    assert checkpoints and all("changes" not in line for line in checkpoints)
+
+    fresh = RulesHistory(path, checkpoint_every=5)
+    for version, rules in enumerate(all_rules, 1):
+        assert fresh.rules_at(version=version) == (version, rules)
+
+    seen = []
+    cursor = None
+    while True:
+        page, cursor, total = fresh.page(cursor, limit=4)
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert total == len(all_rules)
+    seen.reverse()
+    previous = {}
+    for entry, rules in zip(seen, all_rules):
+        assert apply_changes(json.loads(json.dumps(previous)), entry["changes"]) == rules
+        assert entry["changes"] == diff_rules(previous, rules)
+        previous = rules
+
+
+def test_unchanged_rules_are_not_recorded(tmp_path):
+    history = RulesHistory(str(tmp_path / "rules_history.jsonl"))
+    assert history.append({"a": 1})
+    assert not history.append({"a": 1})
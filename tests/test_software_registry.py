@@ -0,0 +1,19 @@
+import json
+
+from software_registry import SoftwareRegistry
+
+
+def test_latin1_default_file(tmp_path):
+    (tmp_path / "required_email.json").write_bytes(
+        json.dumps({"required_email": "a@b.fr", "company_name": "Société"}, ensure_ascii=False).encode("latin-1")
+    )
+    registry = SoftwareRegistry(str(tmp_path), "software_configs.json", project_files=True,
+                                default_file="required_email.json")
+    assert registry.get("Inconnu")["company_name"] == "Société"
+
+
+def test_get_returns_copy(tmp_path):
+    (tmp_path / "software_configs.json").write_text(json.dumps({"MostaGare": {"max_activations": 4}}))
+    registry = SoftwareRegistry(str(tmp_path), "software_configs.json")
+    registry.get("MostaGare")["max_activations"] = 99
+    assert registry.get("MostaGare")["max_activations"] == 4
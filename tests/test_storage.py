@@ -0,0 +1,32 @@
+from storage import SqliteStorage
+
+LICENSE = {
+    "key": "KEY-1",
+    "email": "client@example.com",
+    "project": "MostaGare",
+    "created_at": "2024-01-01T00:00:00",
+    "expires_at": "2024-12-31T00:00:00",
+    "status": "ACTIVE",
+}
+
+
+def test_update_by_email_project_updates_indexed_columns(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "licenses.db"))
+    storage.add_license(dict(LICENSE))
+
+    def extend(lic):
+        lic["expires_at"] = "2025-12-31T00:00:00"
+
+    updated = storage.update_licenses_by_email_project("client@example.com", "MostaGare", extend)
+    assert [lic["expires_at"] for lic in updated] == ["2025-12-31T00:00:00"]
+    assert storage._query("SELECT expires_at FROM licenses WHERE key = ?", ("KEY-1",))[0][0] == "2025-12-31T00:00:00"
+    assert storage.get_license("KEY-1")["expires_at"] == "2025-12-31T00:00:00"
+
+
+def test_add_activation_if_available(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "licenses.db"))
+    record = {"license_key": "KEY-1", "activation_code": "CODE-1", "status": "active", "timestamp": "2024-03-01T10:00:00"}
+    assert storage.add_activation_if_available({**record, "device_id": "device-1"}, 2) == (True, 0)
+    assert storage.add_activation_if_available({**record, "device_id": "device-2"}, 2) == (True, 1)
+    assert storage.add_activation_if_available({**record, "device_id": "device-3"}, 2) == (False, 2)
+    assert storage.count_active_activations("CODE-1") == 2